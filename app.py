@@ -4,26 +4,105 @@ import pandas as pd
 import altair as alt
 from groq import Groq
 import time  # <- for timing the backtest
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from data_plane import get_shared_data
+from today_store import default_configs, lookup_today, start_background_precompute
 from engine import (
     PortfolioConfig,
-    load_all_data,
+    backtest_artifacts_key,
+    prepare_backtest_artifacts,
     run_backtest,
     run_today_optimization,
+    run_bootstrap_backtests,
 )
 
 from functions import (
     validate_constraints,
     compute_backtest_stats,
+    compute_backtest_stats_matrix,
+    compute_rolling_analytics,
     management_fee_from_wealth,
+    simulate_portfolio_wealth,
     build_backtest_context_text,
+    commentary_cache_key,
+    load_cached_commentary,
+    store_cached_commentary,
 )
 
 
 # --------------- GLOBAL DATA (cached) ---------------
-@st.cache_data
+# cache_resource: one read-only object per process, no per-rerun unpickling.
+# The numeric panels are memory-mapped from the shared data plane, so every
+# Streamlit process on the host reads the same pages.
+@st.cache_resource
 def get_data():
-    return load_all_data()
+    return get_shared_data()
+
+
+def get_prefetch_executor():
+    """
+    This session's background thread for speculative backtest preparation.
+
+    One worker per session: a slow preparation of one user never queues
+    behind (or delays) the prefetch of another session.
+    """
+    executor = st.session_state.get("prefetch_executor")
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backtest-prefetch")
+        st.session_state["prefetch_executor"] = executor
+    return executor
+
+
+def start_artifacts_prefetch(config, data):
+    """
+    Start prepare_backtest_artifacts for the current Step 1-2 settings,
+    cancelling the job of previous settings of this session.
+    """
+    key = backtest_artifacts_key(config)
+    job = st.session_state.get("artifacts_job")
+    if job is not None and job["key"] == key:
+        return
+
+    if job is not None:
+        job["cancel"].set()
+        job["future"].cancel()
+
+    cancel = threading.Event()
+    future = get_prefetch_executor().submit(prepare_backtest_artifacts, config, data, cancel_event=cancel)
+    st.session_state["artifacts_job"] = {"key": key, "future": future, "cancel": cancel}
+
+
+def get_prefetched_artifacts(config):
+    """
+    Artifacts prepared for this configuration (waits if still running), or
+    None when the Step 1-2 settings changed since the prefetch started.
+
+    Waiting on this session's own worker never takes longer than preparing
+    from scratch, so the job is only cancelled when its settings are stale.
+    """
+    job = st.session_state.get("artifacts_job")
+    if job is None:
+        return None
+    if job["key"] != backtest_artifacts_key(config):
+        job["cancel"].set()
+        job["future"].cancel()
+        st.session_state.pop("artifacts_job", None)
+        return None
+    try:
+        return job["future"].result()
+    except Exception:
+        # any failure (or cancellation) is reported by the live run_backtest
+        return None
+
+
+# Once per process: precompute today's portfolio of the default configurations
+# for every questionnaire answer, in a background thread.
+@st.cache_resource
+def start_default_precompute(_data):
+    return start_background_precompute(default_configs(_data), _data)
 
 
 def main():
@@ -39,6 +118,7 @@ def main():
     )
 
     data = get_data()
+    start_default_precompute(data)
 
     if page == "About us":
         page_about()
@@ -297,15 +377,29 @@ def page_portfolio_optimization(data):
     with colD:
         rebalance_label = st.selectbox(
             "Rebalancing Frequency",
-            options=["Yearly", "Quarterly", "Monthly"],
+            options=["Yearly", "Quarterly", "Monthly", "Quarter-ends",
+                     "Index reconstitutions", "Quarter-ends + reconstitutions"],
             index=0,
+            help="Yearly / Quarterly / Monthly count from the start of the backtest. "
+            "Quarter-ends rebalance in March, June, September and December; "
+            "reconstitutions rebalance after each change of the index composition.",
         )
+        rebalance_schedule = "periodic"
         if rebalance_label == "Yearly":
             rebalancing = 12
         elif rebalance_label == "Quarterly":
             rebalancing = 3
+        elif rebalance_label == "Monthly":
+            rebalancing = 1
+        elif rebalance_label == "Quarter-ends":
+            rebalancing = 3
+            rebalance_schedule = "calendar"
+        elif rebalance_label == "Index reconstitutions":
+            rebalancing = 1
+            rebalance_schedule = "events"
         else:
             rebalancing = 1
+            rebalance_schedule = "mixed"
 
     with colE:
         est_months = st.selectbox(
@@ -315,6 +409,44 @@ def page_portfolio_optimization(data):
             format_func=lambda m: f"{m} months",
         )
 
+        # Daily / weekly estimation is only offered when daily prices are loaded
+        if "returns_daily" in data:
+            estimation_frequency = st.selectbox(
+                "Estimation Data Frequency",
+                options=["M", "W", "D"],
+                index=0,
+                format_func=lambda f: {"M": "Monthly", "W": "Weekly", "D": "Daily"}[f],
+                help="Frequency of the returns used to estimate expected returns and risk. "
+                "Rebalancing and reporting remain monthly.",
+            )
+        else:
+            estimation_frequency = "M"
+
+        covariance_labels = {
+            "ledoit_wolf": "Ledoit-Wolf shrinkage",
+            "oas": "Oracle approximating shrinkage",
+            "constant_correlation": "Shrinkage to constant correlation",
+            "ewma": "Exponentially weighted",
+            "sample": "Sample covariance",
+        }
+        covariance_estimator = st.selectbox(
+            "Risk Model",
+            options=list(covariance_labels),
+            index=0,
+            format_func=covariance_labels.get,
+            help="How the covariance of returns is estimated. Shrinkage estimators are more stable "
+            "when the window is short compared with the number of assets.",
+        )
+        covariance_halflife_months = 12.0
+        if covariance_estimator == "ewma":
+            covariance_halflife_months = float(st.slider(
+                "Risk model half-life (months)",
+                min_value=1,
+                max_value=max(int(est_months), 2),
+                value=min(12, max(int(est_months), 2)),
+                step=1,
+            ))
+
     st.markdown("---")
 
     # ============================================================
@@ -425,6 +557,26 @@ def page_portfolio_optimization(data):
 
     keep_ids_by_class = keep_ids_by_class if keep_ids_by_class else None
 
+    # Steps 1-2 fix the universes and estimation windows of every rebalance:
+    # prepare them (and their covariance estimates) in the background while
+    # the user goes through the questionnaire and constraints.
+    prefetch_config = PortfolioConfig(
+        today_date=pd.Timestamp("2025-10-01"),
+        investment_horizon_years=investment_horizon_years,
+        est_months=est_months,
+        rebalancing=rebalancing,
+        universe_choice=universe_choice,
+        keep_sectors=keep_sectors,
+        keep_esg=keep_esg,
+        selected_asset_classes_other=selected_asset_classes_other,
+        keep_ids_by_class=keep_ids_by_class,
+        estimation_frequency=estimation_frequency,
+        rebalance_schedule=rebalance_schedule,
+        covariance_estimator=covariance_estimator,
+        covariance_halflife_months=covariance_halflife_months,
+    )
+    start_artifacts_prefetch(prefetch_config, data)
+
     st.markdown("---")
 
     # ============================================================
@@ -827,6 +979,161 @@ def page_portfolio_optimization(data):
 
         st.markdown("---")
 
+    # ------------------------------------------------------------
+    # 4.4 Allocation method (same constraints for every method)
+    # ------------------------------------------------------------
+    st.subheader("Allocation Method")
+
+    allocator_labels = {
+        "mean_variance": "Mean-variance (uses your risk profile)",
+        "min_variance": "Minimum variance",
+        "risk_parity": "Risk parity (equal risk contributions)",
+        "max_diversification": "Maximum diversification",
+        "mean_cvar": "Mean-CVaR (uses your risk profile, tail-loss aware)",
+    }
+    allocator = st.selectbox(
+        "Portfolio construction",
+        options=list(allocator_labels),
+        format_func=allocator_labels.get,
+        help="All methods respect the constraints above. Only mean-variance and mean-CVaR use "
+        "expected returns and the risk aversion from the questionnaire.",
+    )
+
+    cvar_alpha = 0.95
+    cvar_n_scenarios = None
+    if allocator == "mean_cvar":
+        colC1, colC2 = st.columns(2)
+        with colC1:
+            cvar_alpha = st.slider(
+                "CVaR confidence level",
+                min_value=0.80,
+                max_value=0.99,
+                value=0.95,
+                step=0.01,
+                help="0.95 = the optimizer limits the average loss of the worst 5% of months.",
+            )
+        with colC2:
+            if st.checkbox("Bootstrap return scenarios", value=False,
+                           help="Resample months of the estimation window instead of using "
+                           "each historical month once."):
+                cvar_n_scenarios = st.slider(
+                    "Number of scenarios",
+                    min_value=200,
+                    max_value=2000,
+                    value=1000,
+                    step=100,
+                    help="More scenarios give a smoother tail estimate but a slower optimization.",
+                )
+
+    mean_estimator_labels = {
+        "sample": "Historical average",
+        "ewma": "Exponentially weighted (recent months count more)",
+        "james_stein": "Shrunk towards the cross-sectional average (James-Stein)",
+        "black_litterman": "Black-Litterman (equal-weight equilibrium prior)",
+    }
+    mean_estimator = st.selectbox(
+        "Expected returns estimate",
+        options=list(mean_estimator_labels),
+        format_func=mean_estimator_labels.get,
+        disabled=allocator not in ("mean_variance", "mean_cvar"),
+        help="Historical averages over a short window are noisy and make the portfolio jump between "
+        "rebalances; the shrunk estimates are more stable (methods using expected returns only).",
+    )
+    mean_halflife_months = 6.0
+    if mean_estimator == "ewma":
+        mean_halflife_months = float(st.slider(
+            "Half-life of the weights (months)",
+            min_value=1,
+            max_value=max(int(est_months), 2),
+            value=min(6, max(int(est_months), 2)),
+            step=1,
+        ))
+
+    max_positions = None
+    min_position_weight = 0.0
+    if st.checkbox("Limit the number of holdings", value=False,
+                   help="Keeps the portfolio to a few names by dropping the smallest positions and "
+                   "re-optimizing over the remaining assets."):
+        min_names = math.ceil(round(1.0 / max_weight_per_asset, 9))
+        colP1, colP2 = st.columns(2)
+        with colP1:
+            max_positions = st.number_input(
+                "Maximum number of positions",
+                min_value=min_names,
+                max_value=500,
+                value=max(30, min_names),
+                step=1,
+                help=f"At least {min_names} positions are needed to be fully invested "
+                f"with at most {max_weight_per_asset:.0%} per asset.",
+            )
+        with colP2:
+            min_position_weight = st.slider(
+                "Minimum position size",
+                min_value=0.0,
+                max_value=float(max_weight_per_asset),
+                value=0.0,
+                step=0.0025,
+                format="%.4f",
+                help="Positions below this weight are removed (0 = no minimum).",
+            )
+
+    # ------------------------------------------------------------
+    # 4.5 Turnover control (trading costs inside the optimizer)
+    # ------------------------------------------------------------
+    st.subheader("Turnover Control")
+
+    use_turnover_control = st.checkbox(
+        "Account for trading costs when rebalancing",
+        value=False,
+        disabled=allocator != "mean_variance",
+        help="The optimizer starts from the drifted portfolio and only trades when the expected "
+        "benefit outweighs the transaction costs (mean-variance only).",
+    )
+
+    turnover_aversion = 0.0
+    max_turnover = None
+    if use_turnover_control and allocator == "mean_variance":
+        colT1, colT2 = st.columns(2)
+        with colT1:
+            turnover_aversion = st.slider(
+                "Turnover aversion (× transaction cost)",
+                min_value=0.0,
+                max_value=10.0,
+                value=1.0,
+                step=0.5,
+                help="1 = trading costs counted at their expected value, spread over the holding period.",
+            )
+        with colT2:
+            cap_turnover = st.checkbox("Cap turnover per rebalance", value=False)
+            if cap_turnover:
+                max_turnover = st.slider(
+                    "Maximum one-way turnover",
+                    min_value=0.05,
+                    max_value=1.0,
+                    value=0.30,
+                    step=0.05,
+                )
+
+    use_band = st.checkbox(
+        "Skip rebalances while the portfolio stays close to its target",
+        value=False,
+        help="On each scheduled date, the portfolio is only re-optimized if a weight drifted "
+        "further than the band from its last target, or if trading back is worth its cost.",
+    )
+    rebalance_trigger = "band" if use_band else "calendar"
+    rebalance_band = 0.02
+    if use_band:
+        rebalance_band = st.slider(
+            "No-trade band (absolute weight deviation)",
+            min_value=0.005,
+            max_value=0.10,
+            value=0.02,
+            step=0.005,
+            format="%.3f",
+        )
+
+    st.markdown("---")
+
     constraint_errors = validate_constraints(
         sector_constraints=sector_constraints,
         esg_constraints=esg_constraints,
@@ -865,6 +1172,15 @@ def page_portfolio_optimization(data):
             est_months=est_months,
             rebalancing=rebalancing,
             gamma=gamma,
+            allocator=allocator,
+            cvar_alpha=cvar_alpha,
+            cvar_scenarios=cvar_n_scenarios,
+            mean_estimator=mean_estimator,
+            mean_halflife_months=mean_halflife_months,
+            covariance_estimator=covariance_estimator,
+            covariance_halflife_months=covariance_halflife_months,
+            max_positions=max_positions,
+            min_position_weight=min_position_weight,
             universe_choice=universe_choice,
             keep_sectors=keep_sectors,
             keep_esg=keep_esg,
@@ -875,13 +1191,22 @@ def page_portfolio_optimization(data):
             esg_constraints=esg_constraints,
             asset_class_constraints=asset_class_constraints,
             initial_wealth=investment_amount,
+            estimation_frequency=estimation_frequency,
+            turnover_aversion=turnover_aversion,
+            max_turnover=max_turnover,
+            rebalance_trigger=rebalance_trigger,
+            rebalance_band=rebalance_band,
+            rebalance_schedule=rebalance_schedule,
         )
 
         # 3) Run **ONLY** the backtest here (timed)
         try:
             with st.spinner("Optimizing and backtesting..."):
                 t0 = time.perf_counter()
-                perf, summary_df, debug_weights_df = run_backtest(config, data)
+                artifacts = get_prefetched_artifacts(config)
+                perf, summary_df, weights_history, attribution_df = run_backtest(
+                    config, data, artifacts=artifacts, attribution=True
+                )
                 t1 = time.perf_counter()
 
             st.write(f"⏱️ Backtest time: {t1 - t0:.2f} seconds")
@@ -893,16 +1218,27 @@ def page_portfolio_optimization(data):
             st.caption(
                 "This usually means sector/ESG minimums or max-weight-per-asset are too tight."
             )
+            st.caption(f"Details: {e}")
             st.stop()
 
         st.success("Backtest completed.")
 
+        # Rolling risk frames are cheap (O(T)) but precomputed once here, so
+        # re-runs of the page only redraw them
+        rolling_analytics = compute_rolling_analytics(perf, data.get("benchmarks", None))
+
+        # Solve today's portfolio for all other questionnaire answers of this
+        # configuration in the background
+        start_background_precompute([config], data)
+
         # store everything — NOT today's optimization
         st.session_state["backtest_results"] = {
             "config": config,
             "perf": perf,
             "summary_df": summary_df,
-            "debug_weights_df": debug_weights_df,
+            "weights_history": weights_history,
+            "attribution_df": attribution_df,
+            "rolling_analytics": rolling_analytics,
             "today_res": None,
             "investment_amount": investment_amount,
             "universe_choice": universe_choice,
@@ -925,7 +1261,9 @@ def page_portfolio_optimization(data):
         config = r["config"]  # full config stored
         perf = r["perf"]
         summary_df = r["summary_df"]
-        debug_weights_df = r["debug_weights_df"]
+        weights_history = r["weights_history"]
+        attribution_df = r.get("attribution_df")
+        rolling_analytics = r.get("rolling_analytics", {})
         today_res = r.get("today_res")  # may be None the first time
 
         investment_amount = r["investment_amount"]
@@ -956,8 +1294,16 @@ def page_portfolio_optimization(data):
                 # --------------------------------------------------------
                 returns_bench = data.get("benchmarks", None)
 
+                # Net, gross and every benchmark side by side: their stats are
+                # computed in one vectorized pass (table under the statistics)
+                series_returns = pd.DataFrame({
+                    "Portfolio": perf["Rp"],
+                    "Portfolio (gross)": perf["Rp_gross"],
+                })
+
                 if returns_bench is not None and not returns_bench.empty:
                     bench = returns_bench.reindex(perf.index)
+                    series_returns = pd.concat([series_returns, bench], axis=1)
                     bench_cum = (1.0 + bench).cumprod() - 1.0
                     combined = pd.concat([perf["CumReturn"], bench_cum], axis=1)
                     combined.columns = ["Portfolio"] + list(bench_cum.columns)
@@ -1134,6 +1480,232 @@ def page_portfolio_optimization(data):
 
                 st.table(pd.DataFrame(stats_rows, columns=["Metric", "Value"]))
 
+                st.markdown("**Strategy vs Benchmarks**")
+
+                stats_table = compute_backtest_stats_matrix(series_returns)
+                comparison = pd.DataFrame({
+                    "Annualised return": stats_table["annualised_avg_return"].map(fmt_pct),
+                    "Annualised volatility": stats_table["annualised_volatility"].map(fmt_pct),
+                    "Annualised cumulative return": stats_table["annualised_cum_return"].map(fmt_pct),
+                    "Max drawdown": stats_table["max_drawdown"].map(fmt_pct),
+                    "Sharpe ratio": stats_table["sharpe_ratio"].map(lambda x: f"{x:.2f}"),
+                    "Sortino ratio": stats_table["sortino_ratio"].map(lambda x: f"{x:.2f}"),
+                    "Calmar ratio": stats_table["calmar_ratio"].map(lambda x: f"{x:.2f}"),
+                })
+                st.table(comparison)
+                st.caption("Ratios use a zero risk-free rate. The portfolio line is net of all fees.")
+
+                # --------------------------------------------------------
+                # D2) ROLLING RISK ANALYTICS
+                # --------------------------------------------------------
+                st.markdown("**Rolling Risk Analytics**")
+
+                rolling_window = st.radio(
+                    "Rolling window",
+                    options=sorted(rolling_analytics.keys()),
+                    format_func=lambda m: f"{m} months",
+                    horizontal=True,
+                )
+                rolling_df = rolling_analytics.get(rolling_window, pd.DataFrame()).dropna(how="all")
+
+                if rolling_df.empty:
+                    st.info(
+                        f"The backtest is shorter than {rolling_window} months: "
+                        "no rolling statistics are available for this window."
+                    )
+                else:
+                    if isinstance(rolling_df.index, pd.PeriodIndex):
+                        rolling_df.index = rolling_df.index.to_timestamp()
+                    rolling_df.index.name = "Date"
+
+                    col_roll_risk, col_roll_bench = st.columns(2)
+
+                    def rolling_chart(columns, title, fmt):
+                        long_df = rolling_df[columns].reset_index().melt(
+                            "Date", var_name="Series", value_name="Value"
+                        )
+                        return (
+                            alt.Chart(long_df)
+                            .mark_line()
+                            .encode(
+                                x=alt.X("Date:T", axis=alt.Axis(format="%b %Y", labelAngle=-45)),
+                                y=alt.Y("Value:Q", title=title, axis=alt.Axis(format=fmt)),
+                                color=alt.Color("Series:N"),
+                                tooltip=[
+                                    alt.Tooltip("Date:T", title="Date", format="%b %Y"),
+                                    alt.Tooltip("Series:N", title="Series"),
+                                    alt.Tooltip("Value:Q", title=title, format=fmt),
+                                ],
+                            )
+                            .properties(height=250)
+                            .interactive()
+                        )
+
+                    with col_roll_risk:
+                        st.altair_chart(
+                            rolling_chart(["Volatility"], "Annualised volatility", ".1%"),
+                            use_container_width=True,
+                        )
+                        st.altair_chart(
+                            rolling_chart(["Sharpe"], "Sharpe ratio", ".2f"),
+                            use_container_width=True,
+                        )
+
+                    beta_cols = [c for c in rolling_df.columns if c.startswith("Beta vs ")]
+                    te_cols = [c for c in rolling_df.columns if c.startswith("Tracking error vs ")]
+
+                    with col_roll_bench:
+                        if beta_cols:
+                            st.altair_chart(
+                                rolling_chart(beta_cols, "Beta", ".2f"),
+                                use_container_width=True,
+                            )
+                            st.altair_chart(
+                                rolling_chart(te_cols, "Tracking error", ".1%"),
+                                use_container_width=True,
+                            )
+                        else:
+                            st.info("No benchmark data available for beta / tracking error.")
+
+                # --------------------------------------------------------
+                # D3) PERFORMANCE ATTRIBUTION
+                # --------------------------------------------------------
+                if attribution_df is not None and not attribution_df.empty:
+                    with st.expander("Performance attribution"):
+                        st.caption(
+                            "Brinson attribution of each holding period against the equally weighted "
+                            "investable universe: allocation (over/underweighting groups), selection "
+                            "(picking assets within groups) and their interaction. Effects are "
+                            "summed over all holding periods."
+                        )
+
+                        dimension_labels = {"SECTOR": "Sector", "ESG": "ESG bucket", "ASSET_CLASS": "Asset class"}
+                        dimension = st.radio(
+                            "Group by",
+                            options=list(dimension_labels),
+                            format_func=dimension_labels.get,
+                            horizontal=True,
+                        )
+
+                        effects = (
+                            attribution_df[attribution_df["Dimension"] == dimension]
+                            .groupby("Group")[["Allocation", "Selection", "Interaction", "Total"]]
+                            .sum()
+                            .sort_values("Total", ascending=False)
+                        )
+                        st.dataframe(effects.style.format("{:.2%}"), use_container_width=True)
+
+                        effects_long = effects.drop(columns="Total").reset_index().melt(
+                            id_vars="Group", var_name="Effect", value_name="Value"
+                        )
+                        st.altair_chart(
+                            alt.Chart(effects_long)
+                            .mark_bar()
+                            .encode(
+                                x=alt.X("Group:N", sort=list(effects.index), title=None),
+                                y=alt.Y("Value:Q", title="Contribution", axis=alt.Axis(format="%")),
+                                color=alt.Color("Effect:N", title=None),
+                                xOffset="Effect:N",
+                                tooltip=["Group", "Effect", alt.Tooltip("Value:Q", format=".2%")],
+                            )
+                            .properties(height=280),
+                            use_container_width=True,
+                        )
+
+                        st.markdown("**Top contributors (all holding periods)**")
+                        by_asset = (
+                            weights_history.to_frame().groupby(["ID", "NAME"], dropna=False)[
+                                ["Return_Contribution", "Risk_Contribution"]
+                            ]
+                            .sum()
+                            .sort_values("Return_Contribution", ascending=False)
+                        )
+                        contributors = pd.concat([by_asset.head(5), by_asset.tail(5)]).drop_duplicates()
+                        st.dataframe(
+                            contributors.rename(columns={
+                                "Return_Contribution": "Return contribution",
+                                "Risk_Contribution": "Share of variance",
+                            }).style.format("{:.2%}"),
+                            use_container_width=True,
+                        )
+
+                # --------------------------------------------------------
+                # D4) ROBUSTNESS CHECK (BLOCK BOOTSTRAP)
+                # --------------------------------------------------------
+                with st.expander("Robustness check: block-bootstrapped backtests"):
+                    st.caption(
+                        "Re-runs the full optimization and rebalancing on resampled return "
+                        "histories (blocks of consecutive months drawn with replacement), to show "
+                        "how much the statistics above depend on the single historical path."
+                    )
+
+                    col_nrep, col_block = st.columns(2)
+                    with col_nrep:
+                        n_replications = st.select_slider(
+                            "Number of replications",
+                            options=[50, 100, 200, 500],
+                            value=100,
+                        )
+                    with col_block:
+                        block_size = st.select_slider(
+                            "Block length (months)",
+                            options=[1, 3, 6, 12],
+                            value=6,
+                        )
+
+                    if st.button("Run robustness check"):
+                        with st.spinner("Running bootstrapped backtests..."):
+                            t0 = time.perf_counter()
+                            st.session_state["backtest_results"]["bootstrap_res"] = run_bootstrap_backtests(
+                                config,
+                                data,
+                                n_replications=n_replications,
+                                block_size=block_size,
+                                seed=0,
+                            )
+                            t1 = time.perf_counter()
+                        st.write(f"⏱️ Robustness check time: {t1 - t0:.2f} seconds")
+
+                    bootstrap_res = st.session_state["backtest_results"].get("bootstrap_res")
+                    if bootstrap_res is not None:
+                        summary_boot = bootstrap_res["summary"]
+
+                        if summary_boot.empty:
+                            st.warning("No replication produced a valid backtest.")
+                        else:
+                            boot_table = pd.DataFrame({
+                                "Annualised return": summary_boot["annualised_avg_return"].map(fmt_pct),
+                                "Annualised volatility": summary_boot["annualised_volatility"].map(fmt_pct),
+                                "Annualised cumulative return": summary_boot["annualised_cum_return"].map(fmt_pct),
+                                "Max drawdown": summary_boot["max_drawdown"].map(fmt_pct),
+                                "Sharpe ratio": summary_boot["sharpe_ratio"].map(lambda x: f"{x:.2f}"),
+                            })
+                            boot_table.index = [f"{q:.0%} quantile" for q in summary_boot.index]
+                            st.table(boot_table)
+
+                            hist_data = bootstrap_res["stats"][["annualised_cum_return"]].astype(float)
+                            st.altair_chart(
+                                alt.Chart(hist_data)
+                                .mark_bar(color="#4BA3FF")
+                                .encode(
+                                    x=alt.X(
+                                        "annualised_cum_return:Q",
+                                        bin=alt.Bin(maxbins=30),
+                                        title="Annualised cumulative return",
+                                        axis=alt.Axis(format="%"),
+                                    ),
+                                    y=alt.Y("count():Q", title="Replications"),
+                                )
+                                .properties(height=250),
+                                use_container_width=True,
+                            )
+
+                        if bootstrap_res["n_failed"]:
+                            st.caption(
+                                f"{bootstrap_res['n_failed']} replication(s) had no feasible "
+                                "portfolio and were left out."
+                            )
+
                 # --------------------------------------------------------
                 # E) AI Commentary on the Backtest
                 # --------------------------------------------------------
@@ -1149,8 +1721,6 @@ def page_portfolio_optimization(data):
                 )
 
                 if explain_btn:
-                    client_llm = get_llm_client()
-
                     # Build a textual context for the model, including client inputs
                     context_text = build_backtest_context_text(
                         stats=stats,
@@ -1190,15 +1760,28 @@ def page_portfolio_optimization(data):
                         f"{context_text}"
                     )
 
-                    with st.spinner("Generating AI commentary..."):
-                        response = client_llm.chat.completions.create(
-                            model="llama-3.1-8b-instant",
-                            messages=[
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": user_message},
-                            ],
-                        )
-                        commentary = response.choices[0].message.content
+                    llm_model = "llama-3.1-8b-instant"
+
+                    # Same context + prompt -> same commentary: reuse it from the
+                    # on-disk cache (shared across sessions) instead of calling the LLM
+                    cache_key = commentary_cache_key(context_text, system_prompt, model=llm_model)
+                    commentary = load_cached_commentary(cache_key)
+
+                    if commentary is None:
+                        client_llm = get_llm_client()
+
+                        with st.spinner("Generating AI commentary..."):
+                            response = client_llm.chat.completions.create(
+                                model=llm_model,
+                                messages=[
+                                    {"role": "system", "content": system_prompt},
+                                    {"role": "user", "content": user_message},
+                                ],
+                            )
+                            commentary = response.choices[0].message.content
+
+                        if commentary:
+                            store_cached_commentary(cache_key, commentary)
 
                     st.markdown(
                         """
@@ -1216,6 +1799,9 @@ def page_portfolio_optimization(data):
 
             # Lazily compute today's optimal portfolio only the first time
             today_res = r.get("today_res")
+            if today_res is None:
+                # precomputed for this configuration / gamma?
+                today_res = lookup_today(config)
             if today_res is None:
                 with st.spinner("Computing today's optimal portfolio..."):
                     today_res = run_today_optimization(config, data)
@@ -1228,6 +1814,19 @@ def page_portfolio_optimization(data):
             sector_in_eq = today_res["sector_in_equity"]
             esg_in_eq = today_res["esg_in_equity"]
 
+            # risk parity under binding constraints: contributions cannot all be equal
+            if config.allocator == "risk_parity":
+                _, sigma_m = today_res["monthly_moments"]
+                w_rc = today_df.set_index("ID")["Weight"].reindex(sigma_m.index).fillna(0.0)
+                rc = w_rc * (sigma_m.to_numpy() @ w_rc.to_numpy())
+                rc = rc[w_rc > 1e-6] / rc.sum()
+                if len(rc) and (rc.max() - rc.min()) * len(rc) > 0.05:
+                    st.warning(
+                        "The constraints bind: risk contributions are not all equal "
+                        f"(from {rc.min():.2%} to {rc.max():.2%} of portfolio risk). "
+                        "This is the closest risk-budgeting portfolio that satisfies them."
+                    )
+
             st.markdown("**Top 5 Holdings**")
             st.dataframe(top5)
 
@@ -1474,6 +2073,83 @@ def page_portfolio_optimization(data):
             with st.expander("Full Portfolio Weights"):
                 st.dataframe(today_df)
 
+            # ----- Forward simulation over the investment horizon -----
+            st.markdown("---")
+            st.markdown("**Simulated Wealth over Your Investment Horizon**")
+
+            sim_method = st.radio(
+                "Simulation method",
+                options=["normal", "bootstrap"],
+                format_func=lambda m: (
+                    "Normal returns (estimated mean & covariance)"
+                    if m == "normal"
+                    else "Block bootstrap of historical returns"
+                ),
+                horizontal=True,
+            )
+
+            # 10'000 paths run in well under a second, but keep them per method
+            sim_cache = st.session_state["backtest_results"].setdefault("simulations", {})
+            if sim_method not in sim_cache:
+                with st.spinner("Simulating wealth paths..."):
+                    sim_cache[sim_method] = simulate_portfolio_wealth(
+                        weights=today_df.set_index("ID")["Weight"],
+                        # monthly returns: the simulation steps are months, also
+                        # with daily / weekly estimation
+                        estimation_window=today_res["monthly_window"],
+                        horizon_months=12 * config.investment_horizon_years,
+                        initial_wealth=config.initial_wealth,
+                        n_paths=10_000,
+                        method=sim_method,
+                        seed=0,
+                        # same model as today's weights (configured estimators)
+                        mu=today_res["monthly_moments"][0],
+                        sigma=today_res["monthly_moments"][1],
+                    )
+            sim_res = sim_cache[sim_method]
+
+            fan = sim_res["quantiles"].copy()
+            fan.columns = ["P5", "P25", "P50", "P75", "P95"]
+            fan = fan.reset_index()
+
+            base_fan = alt.Chart(fan).encode(
+                x=alt.X("Month:Q", title="Months from today")
+            )
+            band_outer = base_fan.mark_area(opacity=0.25, color="#4BA3FF").encode(
+                y=alt.Y("P5:Q", title="Wealth"), y2="P95:Q"
+            )
+            band_inner = base_fan.mark_area(opacity=0.45, color="#4BA3FF").encode(
+                y="P25:Q", y2="P75:Q"
+            )
+            median_line = base_fan.mark_line(color="#0A0F1F").encode(
+                y="P50:Q",
+                tooltip=[
+                    alt.Tooltip("Month:Q"),
+                    alt.Tooltip("P5:Q", title="5th percentile", format=",.0f"),
+                    alt.Tooltip("P50:Q", title="Median", format=",.0f"),
+                    alt.Tooltip("P95:Q", title="95th percentile", format=",.0f"),
+                ],
+            )
+
+            st.altair_chart(
+                (band_outer + band_inner + median_line).properties(height=320).interactive(),
+                use_container_width=True,
+            )
+
+            col_sim1, col_sim2, col_sim3 = st.columns(3)
+            with col_sim1:
+                st.metric("Median final wealth", f"{fan['P50'].iloc[-1]:,.0f}")
+            with col_sim2:
+                st.metric("Expected final wealth", f"{sim_res['expected_final_wealth']:,.0f}")
+            with col_sim3:
+                st.metric("Probability of ending below initial wealth", f"{sim_res['prob_loss']:.1%}")
+
+            st.caption(
+                "Shaded bands show the 5–95% and 25–75% ranges of 10,000 simulated paths, "
+                "net of management fees. The portfolio is assumed to be rebalanced monthly to "
+                "today's weights. Simulations are illustrative, not a forecast."
+            )
+
 
 # --------------- PAGE 3: AI ---------------
 def page_ai_assistant():
@@ -0,0 +1,264 @@
+# batch.py
+"""
+Headless batch runner: backtests for many client profiles.
+
+Usage:
+    python batch.py profiles.jsonl --out batch_results --workers 4
+
+The input is a JSONL file (one object per line) or a YAML file (a list of
+objects). Each object holds PortfolioConfig fields, plus an optional "id"
+used as output folder name, e.g.
+
+    {"id": "client_001", "today_date": "2025-10-01", "gamma": 2.0,
+     "universe_choice": "SP500", "esg_constraints": {"H": {"min": 0.2}}}
+
+For every profile, <out>/<id>/ receives perf.parquet, summary.parquet,
+weights.parquet and config.json. A profile whose folder already holds a
+_DONE marker written for the same spec and the same data is skipped, so an
+interrupted run can simply be restarted; a changed spec or new source data
+reruns it.
+"""
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data_plane import attach_data, ensure_data_plane, source_fingerprint
+from engine import PortfolioConfig, run_backtest
+
+DONE_MARKER = "_DONE"
+ERROR_NAME = "error.txt"
+
+# data dict of the worker process (set once by _init_worker)
+_WORKER_DATA = None
+
+
+def read_profiles(path):
+    """
+    Read the list of profile specs (dicts) from a .jsonl / .json / .yaml file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    with open(path, "r", encoding="utf-8") as f:
+        if ext in (".yaml", ".yml"):
+            import yaml  # only needed for YAML input
+            specs = yaml.safe_load(f) or []
+        elif ext == ".json":
+            specs = json.load(f)
+        else:
+            specs = [json.loads(line) for line in f if line.strip()]
+
+    if not isinstance(specs, list):
+        raise ValueError(f"{path}: expected a list of profiles.")
+
+    return specs
+
+
+def profile_id(spec):
+    """
+    Output folder name of a profile: its "id", or a hash of the spec.
+    """
+    if spec.get("id") is not None:
+        return str(spec["id"])
+    payload = json.dumps(spec, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+def data_fingerprint(data):
+    """
+    Short hash of the price panels of a data dict (an explicit `data` given
+    to run_batch; the shared data plane uses source_fingerprint()).
+    """
+    h = hashlib.sha1()
+    for key in sorted(data["prices"]):
+        prices = data["prices"][key]
+        h.update(f"{key}|{list(prices.index.astype(str))}|{list(prices.columns)}\n".encode("utf-8"))
+        h.update(prices.to_numpy(dtype="float64").tobytes())
+    return h.hexdigest()[:16]
+
+
+def run_key(spec, data_key):
+    """
+    What a _DONE marker is valid for: hashes of the profile spec and of the data.
+    """
+    payload = json.dumps(spec, sort_keys=True, default=str).encode("utf-8")
+    return {"spec": hashlib.sha1(payload).hexdigest()[:16], "data": data_key}
+
+
+def is_done(target, key):
+    """
+    True if `target` holds a _DONE marker written for this run key.
+    """
+    try:
+        with open(os.path.join(target, DONE_MARKER), "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(marker, dict) and all(marker.get(k) == v for k, v in key.items())
+
+
+def config_from_spec(spec):
+    """
+    Build a PortfolioConfig from a profile dict (unknown keys are an error).
+    """
+    known = {f.name for f in dataclasses.fields(PortfolioConfig)}
+    kwargs = {k: v for k, v in spec.items() if k != "id"}
+
+    unknown = sorted(set(kwargs) - known)
+    if unknown:
+        raise ValueError(f"Unknown PortfolioConfig fields: {unknown}")
+
+    if "today_date" not in kwargs:
+        raise ValueError("Profile is missing 'today_date'.")
+    kwargs["today_date"] = pd.Timestamp(kwargs["today_date"])
+
+    return PortfolioConfig(**kwargs)
+
+
+def _init_worker(data_source):
+    """
+    data_source: path of a published data plane (attached zero-copy),
+    or the data dict itself.
+    """
+    global _WORKER_DATA
+    _WORKER_DATA = attach_data(data_source) if isinstance(data_source, str) else data_source
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_profile(spec, out_dir, data=None, data_key=None):
+    """
+    Run one backtest and write its outputs to out_dir/<id>/.
+
+    data_key : fingerprint of the data, recorded in the _DONE marker
+               (see run_key)
+
+    Returns (id, status, seconds) with status 'done' or an error message.
+    """
+    data = _WORKER_DATA if data is None else data
+    pid = profile_id(spec)
+    target = os.path.join(out_dir, pid)
+    t0 = time.perf_counter()
+
+    # outputs of an earlier run stop counting as done while this one runs
+    _remove(os.path.join(target, DONE_MARKER))
+
+    try:
+        config = config_from_spec(spec)
+        perf, summary_df, weights_history = run_backtest(config, data)
+
+        os.makedirs(target, exist_ok=True)
+        perf.to_parquet(os.path.join(target, "perf.parquet"))
+        summary_df.to_parquet(os.path.join(target, "summary.parquet"), index=False)
+        weights_history.to_frame().to_parquet(os.path.join(target, "weights.parquet"), index=False)
+
+        with open(os.path.join(target, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(spec, f, indent=2, default=str)
+
+        # an error of an earlier attempt no longer applies
+        _remove(os.path.join(target, ERROR_NAME))
+
+        # written last: a profile only counts as done once all files exist
+        marker = dict(run_key(spec, data_key), finished=pd.Timestamp.now().isoformat())
+        with open(os.path.join(target, DONE_MARKER), "w", encoding="utf-8") as f:
+            json.dump(marker, f)
+
+        status = "done"
+    except Exception as e:
+        os.makedirs(target, exist_ok=True)
+        with open(os.path.join(target, ERROR_NAME), "w", encoding="utf-8") as f:
+            f.write(traceback.format_exc())
+        status = f"failed: {e}"
+
+    return pid, status, time.perf_counter() - t0
+
+
+def run_batch(specs, out_dir, workers=1, data=None):
+    """
+    Run every profile not yet done for this spec and data, loading the data
+    only once (from the shared data plane, see data_plane.py, unless `data`
+    is given).
+
+    Returns a DataFrame with one row per profile (id, status, seconds).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    # the plane of the current source files is named after their fingerprint
+    data_key = source_fingerprint() if data is None else data_fingerprint(data)
+
+    todo, rows = [], []
+    seen = set()
+    for spec in specs:
+        pid = profile_id(spec)
+        if pid in seen:
+            raise ValueError(f"Duplicate profile id: {pid}")
+        seen.add(pid)
+
+        if is_done(os.path.join(out_dir, pid), run_key(spec, data_key)):
+            rows.append({"id": pid, "status": "skipped (already done)", "seconds": 0.0})
+        else:
+            todo.append(spec)
+
+    print(f"{len(todo)} profile(s) to run, {len(rows)} already done.")
+
+    if todo:
+        plane_dir = None
+        if data is None:
+            plane_dir = ensure_data_plane()
+            data = attach_data(plane_dir)
+
+        if workers <= 1:
+            results = (run_profile(spec, out_dir, data, data_key) for spec in todo)
+            for pid, status, secs in results:
+                print(f"[{pid}] {status} ({secs:.1f}s)")
+                rows.append({"id": pid, "status": status, "seconds": secs})
+        else:
+            # workers attach the shared data plane; an explicit data dict is
+            # shipped once per worker, never once per profile
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(plane_dir or data,)) as pool:
+                futures = [pool.submit(run_profile, spec, out_dir, None, data_key) for spec in todo]
+                for fut in as_completed(futures):
+                    pid, status, secs = fut.result()
+                    print(f"[{pid}] {status} ({secs:.1f}s)")
+                    rows.append({"id": pid, "status": status, "seconds": secs})
+
+    report = pd.DataFrame(rows, columns=["id", "status", "seconds"])
+    report.to_csv(os.path.join(out_dir, "batch_report.csv"), index=False)
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run backtests for many client profiles.")
+    parser.add_argument("profiles", help="JSONL / JSON / YAML file of PortfolioConfig specs")
+    parser.add_argument("--out", default="batch_results", help="output folder (default: batch_results)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: all CPUs)")
+    args = parser.parse_args(argv)
+
+    specs = read_profiles(args.profiles)
+    report = run_batch(specs, args.out, workers=args.workers)
+
+    n_failed = int(report["status"].str.startswith("failed").sum())
+    print(f"Finished: {len(report) - n_failed} ok, {n_failed} failed. Report: "
+          f"{os.path.join(args.out, 'batch_report.csv')}")
+
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# data_plane.py
+"""
+Shared, memory-mapped copy of the load_all_data() panels.
+
+The numeric panels (prices, returns, benchmarks, optional daily returns) are
+written once as .npy files and opened with mmap_mode='r' by every process:
+Streamlit workers, batch / service pool workers, ... They all read the same
+OS page cache, so memory stays flat however many processes attach.
+Composition and ESG label panels are stored as integer code matrices
+(-1 = missing) and decoded on attach; metadata tables are small and kept in
+the manifest.
+
+The monthly returns of the asset panels (STORE_KEYS) are written as
+returns_store.ReturnsStore folders under <plane>/stores/<key>/ and attached
+as ReturnsStore objects: engine slices them per window instead of holding
+the full panels in memory.
+
+A data plane lives in <root>/<fingerprint>/, where the fingerprint covers
+the source workbooks (name, size, mtime): editing a workbook publishes a new
+plane on the next call to ensure_data_plane(), and with it new returns
+stores.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from returns_store import ReturnsStore, write_returns_store
+
+DATA_PLANE_DIR = os.path.join(".cache", "data_plane")
+SOURCE_FILES = ("Prices.xlsx", "Composition.xlsx", "metadata.xlsx", "ESG Score.xlsx",
+                "Prices_daily.xlsx")
+MANIFEST_NAME = "manifest.pkl"
+STORES_DIR = "stores"
+STORE_KEYS = ("SP500", "MSCI", "Other")
+
+ESG_CATEGORIES = ["L", "M", "H"]
+
+
+def source_fingerprint(paths=SOURCE_FILES):
+    """
+    Short hash of the source files' names, sizes and modification times.
+    """
+    h = hashlib.sha1()
+    for p in paths:
+        try:
+            st = os.stat(p)
+            h.update(f"{p}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+        except OSError:
+            h.update(f"{p}|missing\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+# -------------------- Encoding helpers --------------------
+def _encode_labels(values, vocabulary):
+    """
+    Object array -> int32 codes into `vocabulary` (-1 for NaN / unknown).
+    """
+    lookup = {v: i for i, v in enumerate(vocabulary)}
+    flat = values.ravel()
+    codes = np.fromiter((lookup.get(v, -1) if not pd.isna(v) else -1 for v in flat),
+                        dtype=np.int32, count=flat.size)
+    return codes.reshape(values.shape)
+
+
+def _decode_labels(codes, vocabulary):
+    """
+    int codes -> object array; -1 becomes NaN (last slot of the lookup table).
+    """
+    table = np.empty(len(vocabulary) + 1, dtype=object)
+    table[:-1] = vocabulary
+    table[-1] = np.nan
+    return table[codes]
+
+
+# -------------------- Publish / attach --------------------
+def publish_data(data, target_dir, fingerprint=None):
+    """
+    Write the panels of a load_all_data() dict to `target_dir`.
+
+    fingerprint : source fingerprint recorded in the returns stores
+                  (default: the name of `target_dir`)
+
+    The plane is written to a temporary folder and renamed, so readers only
+    ever see a complete plane; if another process published the same plane
+    first, its copy is kept.
+    """
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".publish-")
+
+    if fingerprint is None:
+        fingerprint = os.path.basename(os.path.normpath(target_dir))
+
+    manifest = {"numeric": {}, "stores": {}, "composition": {}, "esg_labels": {},
+                "metadata": data["metadata"]}
+
+    try:
+        # ---- Monthly asset returns: one returns store per key, from the prices ----
+        for key in STORE_KEYS:
+            if key not in data["prices"]:
+                continue
+            rel_dir = os.path.join(STORES_DIR, key)
+            write_returns_store(data["prices"][key], os.path.join(tmp_dir, rel_dir),
+                                fingerprint=fingerprint)
+            manifest["stores"][key] = rel_dir
+
+        # ---- Numeric panels: one .npy per (group, key) ----
+        for group in ("prices", "returns", "returns_daily"):
+            for key, df in data.get(group, {}).items():
+                if group == "returns" and key in manifest["stores"]:
+                    continue
+                fname = f"{group}__{key}.npy"
+                np.save(os.path.join(tmp_dir, fname),
+                        np.ascontiguousarray(df.to_numpy(dtype=np.float64)))
+                manifest["numeric"][(group, key)] = {
+                    "file": fname,
+                    "index": df.index,
+                    "columns": df.columns,
+                }
+
+        # ---- Composition: codes into the vocabulary of IDs ----
+        for key, comp in data["composition"].items():
+            values = comp.to_numpy(dtype=object)
+            vocabulary = sorted({v for v in values.ravel() if not pd.isna(v)})
+            fname = f"composition__{key}.npy"
+            np.save(os.path.join(tmp_dir, fname), _encode_labels(values, vocabulary))
+            manifest["composition"][key] = {
+                "file": fname,
+                "index": comp.index,
+                "columns": comp.columns,
+                "vocabulary": vocabulary,
+            }
+
+        # ---- ESG labels: int8 codes into L/M/H ----
+        for key, esg in data["esg_labels"].items():
+            fname = f"esg_labels__{key}.npy"
+            codes = _encode_labels(esg.to_numpy(dtype=object), ESG_CATEGORIES).astype(np.int8)
+            np.save(os.path.join(tmp_dir, fname), codes)
+            manifest["esg_labels"][key] = {
+                "file": fname,
+                "index": esg.index,
+                "columns": esg.columns,
+            }
+
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "wb") as f:
+            pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.rename(tmp_dir, target_dir)
+        except OSError:
+            # someone else published this plane in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return target_dir
+
+
+def attach_data(plane_dir):
+    """
+    Rebuild the load_all_data() dict from a published plane.
+
+    Prices / benchmarks / daily returns are read-only DataFrames backed
+    directly by the memory-mapped files (no copy); the monthly returns of
+    STORE_KEYS are ReturnsStore objects.
+    """
+    with open(os.path.join(plane_dir, MANIFEST_NAME), "rb") as f:
+        manifest = pickle.load(f)
+
+    data = {"prices": {}, "returns": {}, "composition": {}, "esg_labels": {},
+            "metadata": manifest["metadata"]}
+
+    for (group, key), info in manifest["numeric"].items():
+        values = np.load(os.path.join(plane_dir, info["file"]), mmap_mode="r")
+        data.setdefault(group, {})[key] = pd.DataFrame(values, index=info["index"],
+                                        columns=info["columns"], copy=False)
+
+    for key, rel_dir in manifest.get("stores", {}).items():
+        data["returns"][key] = ReturnsStore(os.path.join(plane_dir, rel_dir))
+
+    for key, info in manifest["composition"].items():
+        codes = np.load(os.path.join(plane_dir, info["file"]), mmap_mode="r")
+        data["composition"][key] = pd.DataFrame(_decode_labels(codes, info["vocabulary"]),
+                                                index=info["index"], columns=info["columns"])
+
+    for key, info in manifest["esg_labels"].items():
+        codes = np.load(os.path.join(plane_dir, info["file"]), mmap_mode="r")
+        data["esg_labels"][key] = pd.DataFrame(_decode_labels(codes, ESG_CATEGORIES),
+                                               index=info["index"], columns=info["columns"])
+
+    data["benchmarks"] = data["returns"]["Benchmarks"]
+
+    return data
+
+
+def ensure_data_plane(root=DATA_PLANE_DIR, loader=None):
+    """
+    Path of the data plane for the current source files, publishing it
+    (with `loader`, default engine.load_all_data) if it does not exist yet.
+    """
+    fingerprint = source_fingerprint()
+    plane_dir = os.path.join(root, fingerprint)
+
+    if not os.path.exists(os.path.join(plane_dir, MANIFEST_NAME)):
+        if loader is None:
+            from engine import load_all_data
+            loader = load_all_data
+        publish_data(loader(), plane_dir, fingerprint=fingerprint)
+
+    return plane_dir
+
+
+def get_shared_data(root=DATA_PLANE_DIR, loader=None):
+    """
+    load_all_data() replacement: attach to the shared plane (publishing it once).
+    """
+    return attach_data(ensure_data_plane(root, loader))
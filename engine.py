@@ -1,11 +1,26 @@
 # engine.py
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
+import json
+import os
 import pandas as pd
 import numpy as np
+import joblib
+from joblib import Parallel, delayed
 from dateutil.relativedelta import relativedelta
-from functions import (markowitz_long_only,
+from weights_history import WeightsHistory
+from ledger import HoldingsLedger
+from estimators import (EXPECTED_RETURN_ESTIMATORS,
+                        COVARIANCE_ESTIMATORS,
+                        expected_returns,
+                        expected_returns_batch,
+                        iter_covariances)
+from functions import (allocate_portfolio,
+                       cvar_scenarios,
+                       ALLOCATORS,
+                       GAMMA_ALLOCATORS,
                        load_price_panel,
+                       resample_returns,
                        load_composition_panel,
                        normalize_id,
                        load_metadata_panel,
@@ -16,7 +31,12 @@ from functions import (markowitz_long_only,
                        check_esg_constraints_feasibility,
                        select_other_assets,
                        check_asset_class_constraints_feasibility,
-                       management_fee_from_wealth)
+                       check_constraints_feasibility_lp,
+                       management_fee_from_wealth,
+                       mean_variance_objective,
+                       estimate_moments,
+                       brinson_attribution,
+                       compute_backtest_stats_matrix)
 
 @dataclass
 class PortfolioConfig:
@@ -29,6 +49,30 @@ class PortfolioConfig:
     # Risk aversion
     gamma: float = 2.0            # will later be computed from questionnaire
 
+    # Allocation engine: "mean_variance" (uses gamma), "min_variance",
+    # "risk_parity" (equal risk contributions), "max_diversification" or
+    # "mean_cvar" (uses gamma: CVaR - gamma * expected return, LP)
+    allocator: str = "mean_variance"
+    cvar_alpha: float = 0.95                 # CVaR confidence level (mean_cvar)
+    cvar_scenarios: Optional[int] = None     # None = rows of the estimation window,
+                                             # N = N bootstrapped one-month scenarios
+
+    # Expected returns fed to the optimizers (see estimators.py): "sample",
+    # "ewma", "james_stein" or "black_litterman" (equal-weight benchmark prior)
+    mean_estimator: str = "sample"
+    mean_halflife_months: float = 6.0        # ewma
+    bl_risk_aversion: float = 2.5            # black_litterman: prior = risk_aversion * Sigma w_bench
+    bl_tau: float = 0.05                     # black_litterman: uncertainty of the prior
+
+    # Covariance estimator: "ledoit_wolf", "oas", "ewma", "constant_correlation"
+    # or "sample" (see estimators.py)
+    covariance_estimator: str = "ledoit_wolf"
+    covariance_halflife_months: float = 12.0  # ewma
+
+    # Position limits (any allocator), reached by greedy pruning + re-solve
+    max_positions: Optional[int] = None      # at most this many held assets
+    min_position_weight: float = 0.0         # no holding below this weight (0 = off)
+
     # Initial invested wealth
     initial_wealth: float = 1_000_000.0
 
@@ -52,12 +96,38 @@ class PortfolioConfig:
     # Transaction cost
     transaction_cost_bps: float = 50.0
 
+    # Turnover-aware rebalancing (off by default): the optimizer starts from the
+    # drifted weights and pays for trading.
+    turnover_aversion: float = 0.0            # x transaction cost, spread over the holding period
+    turnover_penalty_quadratic: float = 0.0   # 0.5 * q * sum (w - w_prev)^2
+    max_turnover: Optional[float] = None      # cap on one-way turnover per rebalance
+
+    # Rebalance trigger: "calendar" = re-optimize and trade on every scheduled date,
+    # "band" = only when the drifted weights left +/- rebalance_band around the last
+    # target, or moving back to it is worth its trading cost.
+    rebalance_trigger: str = "calendar"
+    rebalance_band: float = 0.02
+
+    # Rebalance schedule: "periodic" = every `rebalancing` months from the first feasible
+    # month, "calendar" = on the months of year in rebalance_calendar_months,
+    # "events" = after each change of the index composition, "mixed" = calendar + events.
+    # Outside "periodic", each holding period runs until the next rebalance.
+    rebalance_schedule: str = "periodic"
+    rebalance_calendar_months: Optional[List[int]] = None   # default: quarter-ends [3, 6, 9, 12]
 
+    # Frequency of the returns used to estimate mu / Sigma:
+    # "M" = monthly panels, "W" / "D" = weekly / daily (needs data["returns_daily"]).
+    # Rebalancing and all reporting stay monthly.
+    estimation_frequency: str = "M"
 
-def load_all_data():
+
+def load_all_data(daily_prices_path="Prices_daily.xlsx"):
     """
     Load all prices, returns, compositions, metadata and ESG labels.
     Returns a dict with a clear structure, so we don't re-load in Streamlit.
+
+    If the daily price workbook exists (same sheets as Prices.xlsx), daily
+    returns are added under data["returns_daily"] for daily / weekly estimation.
     """
 
     # ---- S&P 500 ----
@@ -110,17 +180,375 @@ def load_all_data():
         "benchmarks": returns_bench,
     }
 
+    # ---- Optional daily prices (estimation only) ----
+    if daily_prices_path and os.path.exists(daily_prices_path):
+        data["returns_daily"] = {
+            key: load_price_panel(daily_prices_path, sheet_name=sheet, freq="D")[1]
+            for key, sheet in (("SP500", "S&P500"), ("MSCI", "MSCI"), ("Other", "Other Class Assets"))
+        }
+
     return data
 
 
-def run_backtest(config: PortfolioConfig, data: dict):
+# -------------------- Incremental refresh --------------------
+PRICE_SHEETS = {"SP500": "S&P500", "MSCI": "MSCI", "Other": "Other Class Assets",
+                "Benchmarks": "Benchmarks"}
+COMPOSITION_SHEETS = {"SP500": "S&P500 Comp", "MSCI": "MSCI Comp"}
+ESG_SHEETS = {"SP500": "S&P500", "MSCI": "MSCI"}
+
+
+def load_month_update(prices_path=None, composition_path=None, esg_path=None):
     """
-    Run the full backtest given a configuration and pre-loaded data.
+    Read update workbooks that only hold the new month(s), with the same
+    layout and sheet names as Prices.xlsx / Composition.xlsx / ESG Score.xlsx.
+    Missing sheets are skipped.
 
     Returns:
-        perf : DataFrame with columns ['Rp', 'Growth'], index = Date
-        summary_df : DataFrame with Top1/Top2/Top3/Top3_Total/Num_Assets per rebalance
-        debug_weights_df : DataFrame with weights and metadata for each rebalance
+        dict with keys 'prices', 'composition', 'esg_scores' ({key: DataFrame}),
+        ready for refresh_data(data, **update).
+    """
+    def read_sheets(path, sheets, reader):
+        if path is None:
+            return {}
+        available = pd.ExcelFile(path).sheet_names
+        return {key: reader(path, sheet) for key, sheet in sheets.items() if sheet in available}
+
+    return {
+        "prices": read_sheets(prices_path, PRICE_SHEETS, lambda p, s: load_price_panel(p, s)[0]),
+        "composition": read_sheets(composition_path, COMPOSITION_SHEETS, load_composition_panel),
+        "esg_scores": read_sheets(esg_path, ESG_SHEETS, load_esg_scores),
+    }
+
+
+def _upsert_rows(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows of `new` replace / extend the rows of `old`; new columns are appended
+    after the existing ones (whose order is kept).
+    """
+    columns = old.columns.union(new.columns, sort=False)
+    kept = old.drop(index=old.index.intersection(new.index))
+    out = pd.concat([kept.reindex(columns=columns), new.reindex(columns=columns)])
+    out = out.sort_index()
+    out.index.name = old.index.name
+    return out
+
+
+def _refresh_returns(prices: pd.DataFrame, old_returns, updated_months):
+    """
+    Returns panel for the updated `prices`: the old rows are reused and only
+    the rows whose price pair changed are recomputed (r_t = P_{t+1}/P_t - 1).
+
+    Returns:
+        returns: DataFrame (index = prices.index[:-1])
+        recomputed: list of recomputed return months
+    """
+    if hasattr(old_returns, "to_frame"):
+        old_returns = old_returns.to_frame()
+
+    ret_index = prices.index[:-1]
+    values = old_returns.reindex(index=ret_index, columns=prices.columns).to_numpy(dtype=float, copy=True)
+
+    # a new / revised price at month m changes the returns dated m-1 and m
+    pos = prices.index.get_indexer(updated_months)
+    rows = np.union1d(pos - 1, pos)
+    rows = rows[(rows >= 0) & (rows < len(ret_index))]
+
+    p = prices.to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values[rows] = p[rows + 1] / p[rows] - 1.0
+
+    returns = pd.DataFrame(values, index=ret_index, columns=prices.columns)
+    return returns, list(ret_index[rows])
+
+
+def refresh_data(data: dict,
+                 prices: Optional[Dict[str, pd.DataFrame]] = None,
+                 composition: Optional[Dict[str, pd.DataFrame]] = None,
+                 esg_scores: Optional[Dict[str, pd.DataFrame]] = None,
+                 metadata: Optional[Dict[str, pd.DataFrame]] = None):
+    """
+    Append new month(s) to a load_all_data() dict without re-reading the
+    workbooks.
+
+    prices      : {key: DataFrame}, rows = new months (Period[M]), columns = IDs
+    composition : {key: DataFrame}, columns = new months, rows = constituents
+    esg_scores  : {key: DataFrame}, rows = new months, raw numeric ESG scores
+    metadata    : {key: DataFrame}, rows = new / revised assets
+
+    Months already present are replaced (data revisions). Only the affected
+    return rows and the ESG label rows of the new months are recomputed.
+    `data` itself is not modified (it may be a shared read-only data plane).
+
+    Returns:
+        new_data: refreshed dict (unchanged panels are shared with `data`)
+        stale: {"months": sorted list of months whose derived results are
+                stale, "prices" / "returns" / "composition" / "esg_labels" /
+                "metadata": {key: list of updated months (or IDs)}}
+    """
+    prices = prices or {}
+    composition = composition or {}
+    esg_scores = esg_scores or {}
+    metadata = metadata or {}
+
+    new_data = dict(data)
+    for group in ("prices", "returns", "composition", "esg_labels", "metadata"):
+        new_data[group] = dict(data[group])
+
+    stale = {"prices": {}, "returns": {}, "composition": {}, "esg_labels": {}, "metadata": {}}
+
+    # ---- Prices and returns ----
+    for key, new_prices in prices.items():
+        if key not in data["prices"]:
+            raise ValueError(f"refresh_data: unknown price panel {key!r}")
+        if new_prices.empty:
+            continue
+        updated = pd.PeriodIndex(new_prices.index, freq="M")
+        new_prices = new_prices.set_axis(updated, axis=0)
+
+        panel = _upsert_rows(data["prices"][key], new_prices)
+        returns, recomputed = _refresh_returns(panel, data["returns"][key], updated)
+
+        new_data["prices"][key] = panel
+        new_data["returns"][key] = returns
+        stale["prices"][key] = list(updated)
+        stale["returns"][key] = recomputed
+
+    # ---- Composition (columns = months) ----
+    for key, new_comp in composition.items():
+        if key not in data["composition"]:
+            raise ValueError(f"refresh_data: unknown composition panel {key!r}")
+        if new_comp.empty:
+            continue
+        old = data["composition"][key]
+        panel = pd.concat([old.drop(columns=old.columns.intersection(new_comp.columns)), new_comp], axis=1)
+        panel = panel.reindex(columns=panel.columns.sort_values())
+
+        new_data["composition"][key] = panel
+        stale["composition"][key] = list(new_comp.columns)
+
+    # ---- ESG: classify only the new months ----
+    for key, scores in esg_scores.items():
+        if key not in data["esg_labels"]:
+            raise ValueError(f"refresh_data: unknown ESG panel {key!r}")
+        if scores.empty:
+            continue
+        labels = classify_esg(scores)
+
+        new_data["esg_labels"][key] = _upsert_rows(data["esg_labels"][key], labels)
+        stale["esg_labels"][key] = list(labels.index)
+
+    # ---- Metadata (static, rows = assets) ----
+    for key, new_meta in metadata.items():
+        if key not in data["metadata"]:
+            raise ValueError(f"refresh_data: unknown metadata panel {key!r}")
+        old = data["metadata"][key]
+        new_data["metadata"][key] = pd.concat([old.drop(index=old.index.intersection(new_meta.index)), new_meta])
+        stale["metadata"][key] = list(new_meta.index)
+
+    new_data["benchmarks"] = new_data["returns"]["Benchmarks"]
+
+    months = set()
+    for group in ("returns", "composition", "esg_labels"):
+        for values in stale[group].values():
+            months.update(values)
+    stale["months"] = sorted(months)
+
+    return new_data, stale
+
+
+def returns_window(panels, start, end, ids, rows=None):
+    """
+    Returns for months start..end (inclusive) and assets `ids`, taken from
+    several returns panels (equity, other asset classes) without building
+    their full concatenation first.
+
+    panels : list of DataFrames or returns_store.ReturnsStore objects
+    ids : asset IDs (all must exist in one of the panels), kept in this order
+    rows : optional precomputed (i0, i1) row bounds of start..end, one pair
+           per panel (see build_rebalance_schedule); skips the label lookup
+    """
+    ids = pd.Index(ids)
+    pieces = []
+
+    for k, panel in enumerate(panels):
+        cols = panel.columns.intersection(ids)
+        if len(cols) == 0:
+            continue
+        if rows is not None:
+            i0, i1 = rows[k]
+            if hasattr(panel, "window"):
+                pieces.append(panel.window(ids=cols, rows=slice(i0, i1)))
+            else:
+                pieces.append(panel.iloc[i0:i1].loc[:, cols])
+        elif hasattr(panel, "window"):
+            pieces.append(panel.window(start, end, cols))
+        else:
+            pieces.append(panel.loc[start:end, cols])
+
+    if not pieces:
+        return pd.DataFrame(columns=ids, dtype=float)
+
+    window = pd.concat(pieces, axis=1).sort_index()
+    return window.reindex(columns=ids)
+
+
+def estimation_panels(config: PortfolioConfig, data: dict):
+    """
+    Higher-frequency returns panels [equity, other] used for estimation,
+    or None when mu / Sigma are estimated on the monthly panels.
+
+    Weekly panels are compounded from the daily ones once per call.
+    """
+    freq = config.estimation_frequency
+    if freq == "M":
+        return None
+
+    if freq not in ("W", "D"):
+        raise ValueError(f"Unknown estimation_frequency: {freq}")
+
+    if "returns_daily" not in data:
+        raise ValueError(
+            f"estimation_frequency={freq!r} needs daily returns (data['returns_daily']), "
+            "but no daily price panel was loaded."
+        )
+
+    panels = [data["returns_daily"][config.universe_choice], data["returns_daily"]["Other"]]
+    if freq == "W":
+        panels = [resample_returns(p, "W") for p in panels]
+
+    return panels
+
+
+def high_frequency_window(panels, start_month, end_month, ids):
+    """
+    Daily / weekly returns of `ids` dated inside months start_month..end_month
+    (weeks are dated by their last day, see resample_returns: only weeks that
+    end by the end of end_month are used).
+
+    Rows where no asset trades (holidays) are removed, then assets with any
+    missing return are dropped, like for the monthly estimation window.
+    """
+    window = returns_window(panels, start_month.start_time, end_month.end_time, ids)
+    window = window.dropna(axis=0, how="all")
+    return window.dropna(axis=1, how="any")
+
+
+# -------------------- Rebalance scheduler --------------------
+def composition_change_months(composition: pd.DataFrame) -> pd.PeriodIndex:
+    """
+    Months whose list of constituents differs from the previous month's
+    (index reconstitutions / additions / deletions).
+    """
+    months = composition.columns.sort_values()
+    members = [frozenset(composition[m].dropna().map(normalize_id).dropna()) for m in months]
+    changed = [months[i] for i in range(1, len(months)) if members[i] != members[i - 1]]
+    return pd.PeriodIndex(changed, freq="M")
+
+
+def _window_rows(index, starts, ends):
+    """
+    Integer row bounds [i0, i1) of the windows starts[k]..ends[k] (inclusive)
+    in a sorted index, for all windows at once.
+    """
+    return np.stack([index.searchsorted(starts, side="left"),
+                     index.searchsorted(ends, side="right")], axis=1)
+
+
+def build_rebalance_schedule(config: PortfolioConfig,
+                             returns_index: pd.PeriodIndex,
+                             composition: Optional[pd.DataFrame] = None,
+                             panel_indexes=None) -> pd.DataFrame:
+    """
+    All rebalance dates of a backtest with their estimation and test windows.
+
+    returns_index : monthly index of the (equity) returns panel
+    composition : index composition panel, needed for event-driven schedules
+    panel_indexes : indexes of the returns panels that will be sliced
+                    (default: [returns_index])
+
+    Returns:
+        DataFrame, one row per rebalance, with the months Rebalance_Month,
+        Candidates_Period, Est_Start, Est_End, Test_Start, Test_End, the
+        holding length Hold_Months, and Est_Rows / Test_Rows: one (i0, i1)
+        row slice per panel, for returns_window(..., rows=...).
+    """
+    columns = ["Rebalance_Month", "Candidates_Period", "Est_Start", "Est_End",
+               "Test_Start", "Test_End", "Hold_Months", "Est_Rows", "Test_Rows"]
+
+    est_months = config.est_months
+    rebalancing = config.rebalancing
+    mode = config.rebalance_schedule
+
+    if mode not in ("periodic", "calendar", "events", "mixed"):
+        raise ValueError(f"Unknown rebalance_schedule: {mode}")
+
+    backtest_start_date = config.today_date - relativedelta(years=config.investment_horizon_years)
+    start_month = backtest_start_date.to_period("M")
+
+    ret_min, ret_max = returns_index.min(), returns_index.max()
+
+    # need est_months of history BEFORE each rebalance
+    earliest_rebalance = max(start_month, ret_min + est_months)
+
+    if mode == "periodic":
+        # need rebalancing-months of forward returns for each test window
+        latest_rebalance = ret_max - (rebalancing - 1)
+        if earliest_rebalance > latest_rebalance:
+            return pd.DataFrame(columns=columns)
+        month_list = pd.period_range(earliest_rebalance, latest_rebalance, freq="M")
+        rebalance_months = month_list[::rebalancing]
+        test_ends = rebalance_months + (rebalancing - 1)
+    else:
+        if earliest_rebalance > ret_max:
+            return pd.DataFrame(columns=columns)
+        month_list = pd.period_range(earliest_rebalance, ret_max, freq="M")
+
+        # the first feasible month always invests
+        keep = np.zeros(len(month_list), dtype=bool)
+        keep[0] = True
+
+        if mode in ("calendar", "mixed"):
+            cal_months = config.rebalance_calendar_months or [3, 6, 9, 12]
+            if any(m not in range(1, 13) for m in cal_months):
+                raise ValueError(f"rebalance_calendar_months must be in 1..12, got {cal_months}")
+            keep |= month_list.month.isin(cal_months)
+
+        if mode in ("events", "mixed"):
+            if composition is None:
+                raise ValueError("Event-driven rebalance schedule needs the composition panel.")
+            # rebalance once the new composition is the candidates period
+            keep |= month_list.isin(composition_change_months(composition) + 1)
+
+        rebalance_months = month_list[keep]
+        test_ends = pd.PeriodIndex(list(rebalance_months[1:] - 1) + [ret_max], freq="M")
+
+    est_ends = rebalance_months - 1
+    est_starts = rebalance_months - est_months
+
+    if panel_indexes is None:
+        panel_indexes = [returns_index]
+    est_rows = np.stack([_window_rows(ix, est_starts, est_ends) for ix in panel_indexes], axis=1)
+    test_rows = np.stack([_window_rows(ix, rebalance_months, test_ends) for ix in panel_indexes], axis=1)
+
+    schedule = pd.DataFrame({
+        "Rebalance_Month": rebalance_months,
+        "Candidates_Period": est_ends,  # previous month for composition
+        "Est_Start": est_starts,
+        "Est_End": est_ends,
+        "Test_Start": rebalance_months,
+        "Test_End": test_ends,
+        "Hold_Months": test_ends.asi8 - rebalance_months.asi8 + 1,
+        "Est_Rows": [tuple(map(tuple, r)) for r in est_rows.tolist()],
+        "Test_Rows": [tuple(map(tuple, r)) for r in test_rows.tolist()],
+    })
+
+    return schedule[columns]
+
+
+def _backtest_universe(config: PortfolioConfig, data: dict) -> Dict[str, Any]:
+    """
+    Panels of the chosen equity universe + other asset classes, as used by
+    run_backtest and prepare_backtest_artifacts.
     """
 
     # -------------------- Select equity universe --------------------
@@ -141,8 +569,9 @@ def run_backtest(config: PortfolioConfig, data: dict):
     returns_other = data["returns"]["Other"]
     metadata_other = data["metadata"]["Other"]
 
-    # Combine equity + other asset classes
-    returns_all = pd.concat([returns_equity, returns_other], axis=1).sort_index()
+    # Combine equity + other asset classes (returns are sliced per window)
+    returns_panels = [returns_equity, returns_other]
+    returns_ids = returns_equity.columns.union(returns_other.columns)
     metadata_all = pd.concat([metadata_equity, metadata_other], axis=0)
 
     # -------------------- Select other assets according to config --------------------
@@ -152,104 +581,425 @@ def run_backtest(config: PortfolioConfig, data: dict):
         keep_ids_by_class=config.keep_ids_by_class,
     )
 
-    # -------------------- Time grid for backtest --------------------
-    portfolio_returns = []
-    all_weights_summary = []
-    debug_weights_rows = []
-    prev_weights_end = None
+    # Daily / weekly panels for estimation (None = monthly)
+    hf_panels = estimation_panels(config, data)
 
-    today_date = config.today_date
-    investment_horizon_years = config.investment_horizon_years
-    est_months = config.est_months
-    rebalancing = config.rebalancing
-    gamma = config.gamma
-    mgmt_fee_annual = management_fee_from_wealth(config.initial_wealth)
-    mgmt_fee_month = mgmt_fee_annual / 12.0
+    return {
+        "returns_equity": returns_equity,
+        "composition_equity": composition_equity,
+        "metadata_equity": metadata_equity,
+        "esg_equity": esg_equity,
+        "returns_panels": returns_panels,
+        "returns_ids": returns_ids,
+        "metadata_all": metadata_all,
+        "other_ids_selected": other_ids_selected,
+        "hf_panels": hf_panels,
+    }
 
-    # backtest start
-    backtest_start_date = today_date - relativedelta(years=investment_horizon_years)
-    start_month = backtest_start_date.to_period("M")
 
-    # data bounds based on equity returns
-    ret_min, ret_max = returns_equity.index.min(), returns_equity.index.max()
+def _rebalance_universe_ids(config: PortfolioConfig, universe: Dict[str, Any], sched):
+    """
+    Investable IDs of one rebalance before the missing-returns filter:
+    filtered index candidates + selected other assets (sorted).
+    None when there are no equity candidates (skip).
+    """
+    candidates_period = sched.Candidates_Period
+    other_ids_selected = universe["other_ids_selected"]
+    returns_ids = universe["returns_ids"]
 
-    # constraint 1: need est_months of history BEFORE each rebalance
-    earliest_by_history = ret_min + est_months
+    # ---------- Build equity candidates ----------
+    raw_candidates = (
+        universe["composition_equity"][candidates_period]
+        .dropna()
+        .map(normalize_id)
+        .dropna()
+        .tolist()
+    )
 
-    # constraint 2: need rebalancing-months of forward returns for the test window
-    latest_by_future = ret_max - (rebalancing - 1)
+    filtered_candidates = filter_equity_candidates(
+        raw_candidates=raw_candidates,
+        candidates_period=candidates_period,
+        metadata_equity=universe["metadata_equity"],
+        esg_equity=universe["esg_equity"],
+        keep_sectors=config.keep_sectors,
+        keep_esg=config.keep_esg,
+    )
 
-    # final allowed interval for rebalances
-    earliest_rebalance = max(start_month, earliest_by_history)
-    latest_rebalance = latest_by_future
+    if len(filtered_candidates) == 0:
+        # No candidates – skip this rebalance
+        return None
 
-    if earliest_rebalance <= latest_rebalance:
-        month_list = pd.period_range(earliest_rebalance, latest_rebalance, freq="M")
-        rebalance_months = month_list[::rebalancing]
-    else:
-        rebalance_months = pd.PeriodIndex([], freq="M")
+    # Combine equity IDs + other asset IDs into the universe
+    equity_ids = filtered_candidates
+    universe_ids = pd.Index(equity_ids).append(other_ids_selected)
+    universe_ids = pd.Index(sorted(set(universe_ids)))
 
-    # -------------------- Main rebalance loop --------------------
-    for rebalance_month in rebalance_months:
-        # 1) Date for candidates picking (index composition)
-        candidates_period = rebalance_month - 1  # previous month for composition
-
-        # 2) Estimation window dates (e.g. 12 months)
-        estimation_end = candidates_period
-        estimation_start = estimation_end - (est_months - 1)
-
-        # 3) Test window dates
-        test_start = rebalance_month
-        test_end = test_start + (rebalancing - 1)
-
-        # ---------- Build equity candidates ----------
-        raw_candidates = (
-            composition_equity[candidates_period]
-            .dropna()
-            .map(normalize_id)
-            .dropna()
-            .tolist()
+    # Check that all IDs exist in the returns panels
+    missing = sorted(set(universe_ids) - set(returns_ids))
+    if missing:
+        raise ValueError(
+            f"{len(missing)} universe IDs are missing in returns_all. "
+            f"First few: {missing[:20]}"
         )
 
-        filtered_candidates = filter_equity_candidates(
-            raw_candidates=raw_candidates,
-            candidates_period=candidates_period,
-            metadata_equity=metadata_equity,
-            esg_equity=esg_equity,
-            keep_sectors=config.keep_sectors,
-            keep_esg=config.keep_esg,
+    return universe_ids
+
+
+def _rebalance_estimation_window(config: PortfolioConfig, universe: Dict[str, Any], sched):
+    """
+    Estimation window of one rebalance (one row of build_rebalance_schedule):
+    filtered index candidates + selected other assets, minus assets with
+    missing returns. None when there is nothing to invest in (skip).
+    """
+    estimation_start, estimation_end = sched.Est_Start, sched.Est_End
+    hf_panels = universe["hf_panels"]
+
+    universe_ids = _rebalance_universe_ids(config, universe, sched)
+    if universe_ids is None:
+        return None
+
+    # Estimation window of returns for ALL assets
+    estimation_window = returns_window(universe["returns_panels"], estimation_start, estimation_end,
+                                       universe_ids, rows=sched.Est_Rows)
+
+    # Drop assets with any NaN over this estimation window
+    bad = estimation_window.columns[estimation_window.isna().any()].tolist()
+    if bad:
+        # Optional: you can log or collect info here
+        estimation_window = estimation_window.dropna(axis=1, how="any")
+
+    # Daily / weekly estimation: same assets, higher-frequency returns
+    if hf_panels is not None:
+        estimation_window = high_frequency_window(
+            hf_panels, estimation_start, estimation_end, estimation_window.columns
         )
 
-        if len(filtered_candidates) == 0:
-            # No candidates – skip this rebalance
+    # If everything got dropped, skip this rebalance
+    if estimation_window.shape[1] == 0:
+        return None
+
+    return estimation_window
+
+
+# Fields that determine the estimation windows of a backtest (not the constraints)
+ARTIFACT_FIELDS = ("today_date", "investment_horizon_years", "est_months", "rebalancing",
+                   "universe_choice", "keep_sectors", "keep_esg", "selected_asset_classes_other",
+                   "keep_ids_by_class", "estimation_frequency", "rebalance_schedule",
+                   "rebalance_calendar_months", "covariance_estimator", "covariance_halflife_months")
+
+
+def backtest_artifacts_key(config: PortfolioConfig) -> str:
+    """
+    Identifies the constraint-independent work of a backtest.
+    """
+    spec = {name: getattr(config, name) for name in ARTIFACT_FIELDS}
+    return json.dumps(spec, sort_keys=True, default=str)
+
+
+def prepare_backtest_artifacts(config: PortfolioConfig,
+                               data: dict,
+                               max_moment_bytes: int = 256 * 1024 * 1024,
+                               cancel_event=None) -> Optional[Dict[str, Any]]:
+    """
+    The constraint-independent part of run_backtest, done ahead of time
+    (e.g. in a background thread while the user edits the constraints):
+    per rebalance, the estimation window and its (mu, Sigma) estimates.
+
+    Windows and their moments are kept while together they fit in
+    `max_moment_bytes`; the covariance matrices (config.covariance_estimator)
+    of the kept windows are estimated in batches (estimators.iter_covariances).
+    Later rebalances are not sliced here: their entry is None and run_backtest
+    slices their window when it gets there. If `cancel_event`
+    (threading.Event) is set, the preparation stops and returns None.
+
+    Returns:
+        dict with 'key' (backtest_artifacts_key) and 'windows':
+        {rebalance_month: (estimation_window or None, (mu, Sigma) or None),
+         or None when not prepared}
+    """
+    universe = _backtest_universe(config, data)
+    schedule = build_rebalance_schedule(
+        config,
+        universe["returns_equity"].index,
+        universe["composition_equity"],
+        panel_indexes=[p.index for p in universe["returns_panels"]],
+    )
+
+    estimation_windows = {}
+    not_prepared = []
+    budget = max_moment_bytes
+    for sched in schedule.itertuples(index=False):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        if budget is None:
+            not_prepared.append(sched.Rebalance_Month)
             continue
 
-        # Combine equity IDs + other asset IDs into the universe
-        equity_ids = filtered_candidates
-        universe_ids = pd.Index(equity_ids).append(other_ids_selected)
-        universe_ids = pd.Index(sorted(set(universe_ids)))
-
-        # Check that all IDs exist in returns_all
-        missing = sorted(set(universe_ids) - set(returns_all.columns))
-        if missing:
-            raise ValueError(
-                f"{len(missing)} universe IDs are missing in returns_all. "
-                f"First few: {missing[:20]}"
-            )
+        estimation_window = _rebalance_estimation_window(config, universe, sched)
+        if estimation_window is not None:
+            n = estimation_window.shape[1]
+            cost = 8 * estimation_window.size + 8 * n * (n + 1)
+            if cost > budget:
+                # budget spent: this and all later windows are sliced by run_backtest
+                budget = None
+                not_prepared.append(sched.Rebalance_Month)
+                continue
+            budget -= cost
+        estimation_windows[sched.Rebalance_Month] = estimation_window
+
+    artifacts = _artifacts_from_windows(config, estimation_windows, max_moment_bytes, cancel_event)
+    if artifacts is not None:
+        artifacts["windows"].update(dict.fromkeys(not_prepared))
+    return artifacts
+
+
+def _artifacts_from_windows(config: PortfolioConfig,
+                            estimation_windows: Dict[Any, Optional[pd.DataFrame]],
+                            max_moment_bytes: int = 256 * 1024 * 1024,
+                            cancel_event=None) -> Optional[Dict[str, Any]]:
+    """
+    prepare_backtest_artifacts output for given estimation windows
+    ({rebalance_month: estimation_window or None}): (mu, Sigma) of the
+    windows that fit in `max_moment_bytes`, estimated in batches.
+    """
+    # rebalances whose (mu, Sigma) fit in the budget, in order
+    months = []
+    budget = max_moment_bytes
+    for month, estimation_window in estimation_windows.items():
+        if estimation_window is not None:
+            n = estimation_window.shape[1]
+            if 8 * n * (n + 1) <= budget:
+                months.append(month)
+                budget -= 8 * n * (n + 1)
+
+    moments = {}
+    if months:
+        frames = [estimation_windows[m] for m in months]
+        # half-lives per window: row densities differ between windows
+        sigmas = iter_covariances(frames, method=config.covariance_estimator,
+                                  halflife=[_covariance_halflife(config, f) for f in frames])
+        for month, estimation_window, sigma_hat in zip(months, frames, sigmas):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            mu_hat = estimation_window.mean(axis=0).values.astype(float)
+            moments[month] = (mu_hat, sigma_hat)
+
+    windows = {month: (estimation_window, moments.get(month))
+               for month, estimation_window in estimation_windows.items()}
+
+    return {"key": backtest_artifacts_key(config), "windows": windows}
+
+
+def _periods_per_month(config: PortfolioConfig, estimation_window: pd.DataFrame) -> int:
+    """
+    Rows of the estimation window per month (1 for monthly estimation).
+    """
+    return max(int(round(len(estimation_window) / config.est_months)), 1)
+
+
+def _covariance_halflife(config: PortfolioConfig, estimation_window: pd.DataFrame) -> float:
+    """
+    EWMA covariance half-life in rows of the window.
+    """
+    return config.covariance_halflife_months * _periods_per_month(config, estimation_window)
+
+
+def _window_moments(config: PortfolioConfig, estimation_window: pd.DataFrame):
+    """
+    (mu, Sigma) of one window with the config's covariance estimator.
+    """
+    return estimate_moments(estimation_window, covariance_estimator=config.covariance_estimator,
+                            halflife=_covariance_halflife(config, estimation_window))
+
+
+def _mean_estimator_options(config: PortfolioConfig, estimation_window: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Keyword arguments of estimators.expected_returns(_batch) for this config
+    (EWMA half-life converted from months to rows of the window).
+    """
+    return {
+        "halflife": config.mean_halflife_months * _periods_per_month(config, estimation_window),
+        "risk_aversion": config.bl_risk_aversion,
+        "tau": config.bl_tau,
+        "covariance_method": config.covariance_estimator,
+        "covariance_halflife": _covariance_halflife(config, estimation_window),
+    }
+
+
+def _expected_returns_by_rebalance(config: PortfolioConfig, windows) -> Dict[Any, np.ndarray]:
+    """
+    Expected returns of every rebalance with config.mean_estimator, estimated
+    for all windows at once.
+
+    windows : {rebalance_month: (estimation_window or None, (mu, Sigma) or None)}
+              as in prepare_backtest_artifacts (the Sigma are reused; entries
+              that were not prepared are skipped)
+
+    Returns:
+        {rebalance_month: mu aligned with the window's columns}
+    """
+    months = [m for m, entry in windows.items() if entry is not None and entry[0] is not None]
+    if not months:
+        return {}
+
+    frames = [windows[m][0] for m in months]
+    covariances = [None if windows[m][1] is None else windows[m][1][1] for m in months]
+    # half-lives per window: row densities differ between windows
+    options = _mean_estimator_options(config, frames[0])
+    options["halflife"] = [_mean_estimator_options(config, f)["halflife"] for f in frames]
+    options["covariance_halflife"] = [_covariance_halflife(config, f) for f in frames]
+    mus = expected_returns_batch(frames, method=config.mean_estimator, covariances=covariances, **options)
+    return dict(zip(months, mus))
+
+
+ATTRIBUTION_DIMENSIONS = ("SECTOR", "ESG", "ASSET_CLASS")
+
+
+def _cvar_scenario_matrix(config: PortfolioConfig, estimation_window: pd.DataFrame):
+    """
+    Bootstrapped one-month scenarios for the mean_cvar allocator, or None
+    (the allocator then uses the rows of the estimation window).
+    """
+    if config.allocator != "mean_cvar" or config.cvar_scenarios is None:
+        return None
+    return cvar_scenarios(estimation_window, n_scenarios=config.cvar_scenarios,
+                          block=_periods_per_month(config, estimation_window), seed=0)
+
+
+def _allocator_moments(config: PortfolioConfig, estimation_window: pd.DataFrame, moments):
+    """
+    (mu, Sigma) handed to the allocator. Bootstrapped mean_cvar scenarios are
+    compounded over one month of rows, so the per-row expected returns are
+    scaled to one month as well (otherwise, with daily / weekly estimation,
+    monthly CVaR would be traded against a daily / weekly mean).
+    """
+    if moments is None or config.allocator != "mean_cvar" or config.cvar_scenarios is None:
+        return moments
+    mu_hat, sigma_hat = moments
+    return mu_hat * _periods_per_month(config, estimation_window), sigma_hat
+
+
+def run_backtest(config: PortfolioConfig,
+                 data: dict,
+                 artifacts: Optional[Dict[str, Any]] = None,
+                 attribution: bool = False,
+                 ledger_path: Optional[str] = None):
+    """
+    Run the full backtest given a configuration and pre-loaded data.
 
-        # Estimation window of returns for ALL assets
-        estimation_window = returns_all.loc[estimation_start:estimation_end, universe_ids]
+    Returns:
+        perf : DataFrame with columns ['Rp', 'Growth'], index = Date
+        summary_df : DataFrame with Top1/Top2/Top3/Top3_Total/Num_Assets/Rebalanced per rebalance
+        weights_history : WeightsHistory of the held weights of each rebalance
+            (weights_history.to_frame(): one row per position with metadata), with columns
+            'Return_Contribution' : buy-and-hold return contribution over the holding
+                                    period (sums to the gross holding-period return)
+            'Risk_Contribution' : share of the variance of the gross monthly returns
+                                  of the whole backtest (sums to 1 over all rows)
+        attribution_df (only if attribution=True) : Brinson attribution of every
+            holding period against the equally weighted investable universe, one row
+            per (Rebalance_Month, Dimension, Group), Dimension in SECTOR / ESG / ASSET_CLASS
+
+    artifacts : optional output of prepare_backtest_artifacts for the same
+                universe / window settings (ignored if they differ)
+    ledger_path : if given, the month-by-month holdings, drifted weights, trades
+                  and costs are streamed to this Parquet file (see ledger.py)
+    """
+    if ledger_path is None:
+        return _simulate_backtest(config, data, artifacts, attribution, ledger=None)
+
+    with HoldingsLedger(ledger_path) as ledger:
+        return _simulate_backtest(config, data, artifacts, attribution, ledger=ledger)
+
+
+def _simulate_backtest(config, data, artifacts, attribution, ledger):
+    """
+    Body of run_backtest; positions are written to `ledger` if not None.
+    """
+
+    # -------------------- Universe (equity + other asset classes) --------------------
+    universe = _backtest_universe(config, data)
+    returns_equity = universe["returns_equity"]
+    composition_equity = universe["composition_equity"]
+    esg_equity = universe["esg_equity"]
+    returns_panels = universe["returns_panels"]
+    metadata_all = universe["metadata_all"]
+
+    # Estimation windows / moments prepared ahead (prepare_backtest_artifacts)
+    windows = None
+    if artifacts is not None and artifacts.get("key") == backtest_artifacts_key(config):
+        windows = artifacts["windows"]
+
+    if config.rebalance_trigger not in ("calendar", "band"):
+        raise ValueError(f"Unknown rebalance_trigger: {config.rebalance_trigger}")
+    if config.allocator not in ALLOCATORS:
+        raise ValueError(f"Unknown allocator: {config.allocator}")
+    if config.mean_estimator not in EXPECTED_RETURN_ESTIMATORS:
+        raise ValueError(f"Unknown mean_estimator: {config.mean_estimator}")
+    if config.covariance_estimator not in COVARIANCE_ESTIMATORS:
+        raise ValueError(f"Unknown covariance_estimator: {config.covariance_estimator}")
+
+    # -------------------- Time grid for backtest --------------------
+    portfolio_returns = []
+    all_weights_summary = []
+    history = WeightsHistory(universe["returns_ids"], metadata=metadata_all)
+    attribution_rows = []
+    contribution_sums = []  # per rebalance: (sum_t c_ti, sum_t c_ti * Rp_t) by held asset
+    prev_weights_end = None
+    last_target = None  # weights of the last optimization (band trigger)
+
+    est_months = config.est_months
+    gamma = config.gamma
+    mgmt_fee_annual = management_fee_from_wealth(config.initial_wealth)
+    mgmt_fee_month = mgmt_fee_annual / 12.0
+
+    # All rebalance dates and their windows (row slices precomputed per panel)
+    schedule = build_rebalance_schedule(
+        config,
+        returns_equity.index,
+        composition_equity,
+        panel_indexes=[p.index for p in returns_panels],
+    )
 
-        # Drop assets with any NaN over this estimation window
-        bad = estimation_window.columns[estimation_window.isna().any()].tolist()
-        if bad:
-            # Optional: you can log or collect info here
-            estimation_window = estimation_window.dropna(axis=1, how="any")
+    # Estimation windows and their (mu, Sigma) of every rebalance, estimated in
+    # batches ahead of the loop (or taken from `artifacts`)
+    if windows is None:
+        windows = prepare_backtest_artifacts(config, data)["windows"]
+
+    # Expected returns of every rebalance at once (estimators other than the sample mean)
+    expected = None
+    if config.mean_estimator != "sample":
+        expected = _expected_returns_by_rebalance(config, windows)
+
+    # -------------------- Main rebalance loop --------------------
+    for sched in schedule.itertuples(index=False):
+        rebalance_month = sched.Rebalance_Month
+        candidates_period = sched.Candidates_Period  # previous month for composition
+        estimation_start, estimation_end = sched.Est_Start, sched.Est_End
+        hold_months = sched.Hold_Months
+
+        # ---------- Estimation window and (mu, Sigma) (precomputed above) ----------
+        if windows[rebalance_month] is None:
+            # beyond the memory budget of prepare_backtest_artifacts: sliced now
+            estimation_window, moments = _rebalance_estimation_window(config, universe, sched), None
+        else:
+            estimation_window, moments = windows[rebalance_month]
 
-        # If everything got dropped, skip this rebalance
-        if estimation_window.shape[1] == 0:
+        # No candidates / everything dropped: skip this rebalance
+        if estimation_window is None:
             continue
 
+        # beyond the memory budget of prepare_backtest_artifacts
+        if moments is None:
+            moments = _window_moments(config, estimation_window)
+
+        if expected is not None:
+            mu_hat = expected.get(rebalance_month)
+            if mu_hat is None:
+                mu_hat = expected_returns(estimation_window, config.mean_estimator, covariance=moments[1],
+                                          **_mean_estimator_options(config, estimation_window))
+            moments = (mu_hat, moments[1])
+
         # Sector / ESG / asset class vectors for ALL assets
         sector_for_assets = metadata_all["SECTOR"].reindex(estimation_window.columns)
 
@@ -260,41 +1010,102 @@ def run_backtest(config: PortfolioConfig, data: dict):
 
         asset_class_for_assets = metadata_all["ASSET_CLASS"].reindex(estimation_window.columns)
 
-        # Feasibility checks
-        check_sector_constraints_feasibility(
-            estimation_window.columns,
-            metadata_all,
-            config.sector_constraints,
-        )
-        check_esg_constraints_feasibility(
-            esg_for_assets,
-            config.esg_constraints,
-        )
-        check_asset_class_constraints_feasibility(
-            estimation_window.columns,
-            metadata_all,
-            config.asset_class_constraints,
-        )
+        # TURNOVER & FEES AT THIS REBALANCE
+        tc_rate = config.transaction_cost_bps / 10_000.0
 
-        # ---------- Optimization ----------
-        weights_t0 = markowitz_long_only(
-            estimation_window,
-            gamma=gamma,
-            max_weight_per_asset=config.max_weight_per_asset,
-            asset_class_for_assets=asset_class_for_assets,
-            sector_for_assets=sector_for_assets,
-            sector_constraints=config.sector_constraints,
-            esg_for_assets=esg_for_assets,
-            esg_constraints=config.esg_constraints,
-            asset_class_constraints=config.asset_class_constraints,
-        )
+        # cost of trading spread over the months held, per estimation period (mu units)
+        periods_per_month = len(estimation_window) / est_months
+        turnover_cost = config.turnover_aversion * tc_rate / (hold_months * periods_per_month)
+
+        # ---------- Rebalance trigger ----------
+        trade = True
+        if config.rebalance_trigger == "band" and last_target is not None:
+            held = prev_weights_end[prev_weights_end > 1e-6]
+
+            # last target on the current universe: targets that left it are
+            # dropped and the rest renormalized, so only current assets count
+            target = last_target.reindex(estimation_window.columns).fillna(0.0)
+
+            # held assets that left the universe (or lost their data) force a trade
+            if held.index.isin(estimation_window.columns).all() and target.sum() > 1e-6:
+                target = target / target.sum()
+                drifted = held.reindex(estimation_window.columns).fillna(0.0)
+                drift = drifted.sub(target).abs().max()
+
+                if drift <= config.rebalance_band and config.allocator != "mean_variance":
+                    # no utility to compare for the other allocators: the band decides
+                    trade = False
+                elif drift <= config.rebalance_band:
+                    # inside the band: trade only if going back to the target is
+                    # worth its cost under the new estimates
+                    candidates = pd.DataFrame({"drifted": drifted, "target": target})
+                    utility = mean_variance_objective(estimation_window, candidates, gamma, moments=moments)
+                    gain = utility["drifted"] - utility["target"]
+                    cost = gamma * tc_rate * 0.5 * float(
+                        candidates["target"].sub(candidates["drifted"], fill_value=0.0).abs().sum()
+                    ) / (hold_months * periods_per_month)
+                    trade = gain > cost
+
+        if trade:
+            # Feasibility checks
+            check_sector_constraints_feasibility(
+                estimation_window.columns,
+                metadata_all,
+                config.sector_constraints,
+            )
+            check_esg_constraints_feasibility(
+                esg_for_assets,
+                config.esg_constraints,
+            )
+            check_asset_class_constraints_feasibility(
+                estimation_window.columns,
+                metadata_all,
+                config.asset_class_constraints,
+            )
+            # all constraints together (LP, milliseconds): names the binding group
+            check_constraints_feasibility_lp(
+                estimation_window.columns,
+                max_weight_per_asset=config.max_weight_per_asset,
+                asset_class_for_assets=asset_class_for_assets,
+                sector_for_assets=sector_for_assets,
+                sector_constraints=config.sector_constraints,
+                esg_for_assets=esg_for_assets,
+                esg_constraints=config.esg_constraints,
+                asset_class_constraints=config.asset_class_constraints,
+                prev_weights=prev_weights_end,
+                max_turnover=config.max_turnover,
+            )
+
+            # ---------- Optimization ----------
+            weights_t0 = allocate_portfolio(
+                estimation_window,
+                allocator=config.allocator,
+                gamma=gamma,
+                max_weight_per_asset=config.max_weight_per_asset,
+                asset_class_for_assets=asset_class_for_assets,
+                sector_for_assets=sector_for_assets,
+                sector_constraints=config.sector_constraints,
+                esg_for_assets=esg_for_assets,
+                esg_constraints=config.esg_constraints,
+                asset_class_constraints=config.asset_class_constraints,
+                moments=_allocator_moments(config, estimation_window, moments),
+                prev_weights=prev_weights_end,
+                turnover_cost=turnover_cost,
+                turnover_penalty_quadratic=config.turnover_penalty_quadratic,
+                max_turnover=config.max_turnover,
+                cvar_alpha=config.cvar_alpha,
+                scenarios=_cvar_scenario_matrix(config, estimation_window),
+                max_positions=config.max_positions,
+                min_position_weight=config.min_position_weight,
+            )
+            last_target = weights_t0.copy()
+        else:
+            # No trade: carry the drifted weights forward
+            weights_t0 = held / held.sum()
 
         weights_t0.name = str(rebalance_month)
         w_initial = weights_t0.values
 
-        # TURNOVER & FEES AT THIS REBALANCE
-        tc_rate = config.transaction_cost_bps / 10_000.0
-
         if prev_weights_end is None:
             # First rebalance: we start from cash (weights = 0) → trades = w_new
             prev_aligned = pd.Series(0.0, index=weights_t0.index)
@@ -312,29 +1123,8 @@ def run_backtest(config: PortfolioConfig, data: dict):
         top3_weights = np.sort(w_initial)[-3:][::-1]  # largest 3, descending
         top3_sum = top3_weights.sum()
 
-        # ---------- Debug weights with metadata ----------
-        weights_df = pd.DataFrame({
-            "ID": weights_t0.index,
-            "Weight": weights_t0.values,
-        })
-
-        # Drop tiny weights if desired
-        weights_df = weights_df[weights_df["Weight"].abs() > 1e-6]
-
-        meta_subset = metadata_all.reindex(weights_df["ID"])
-        weights_df["NAME"] = meta_subset["NAME"].values if "NAME" in meta_subset.columns else np.nan
-        weights_df["SECTOR"] = meta_subset["SECTOR"].values
-        weights_df["ASSET_CLASS"] = meta_subset["ASSET_CLASS"].values
-
-        if candidates_period in esg_equity.index:
-            esg_row = esg_equity.loc[candidates_period]
-            weights_df["ESG"] = esg_row.reindex(weights_df["ID"]).values
-        else:
-            weights_df["ESG"] = np.nan
-
-        weights_df["Rebalance_Month"] = rebalance_month
-
-        debug_weights_rows.append(weights_df)
+        # Positions kept in the weights history (tiny weights dropped)
+        held_mask = np.abs(w_initial) > 1e-6
 
         # ---------- Summary row ----------
         all_weights_summary.append({
@@ -344,20 +1134,37 @@ def run_backtest(config: PortfolioConfig, data: dict):
             "Top3": top3_weights[2],
             "Top3_Total": top3_sum,
             "Num_Assets": len(w_initial),
+            "Rebalanced": trade,
         })
 
         # ---------- Performance evaluation ----------
-        test_window = returns_all.loc[test_start:test_end, weights_t0.index]
-        rtw_sorted = test_window.sort_index()
-        w_aligned = weights_t0.reindex(rtw_sorted.columns).fillna(0.0).astype(float)
+        # whole investable universe: the portfolio's assets plus the attribution benchmark
+        universe_window = returns_window(returns_panels, sched.Test_Start, sched.Test_End,
+                                         estimation_window.columns, rows=sched.Test_Rows)
+        universe_adj = universe_window.sort_index().fillna(0.0)
+        rtw_adj = universe_adj[weights_t0.index]
+        w_aligned = weights_t0.reindex(rtw_adj.columns).fillna(0.0).astype(float)
         w = w_aligned / w_aligned.sum()
-        rtw_adj = rtw_sorted.fillna(0.0)
+        w_start = w.copy()
+
+        # accumulated in the holding loop: buy-and-hold growth of every asset,
+        # start-of-month weights and gross portfolio returns (contributions
+        # are computed from them after the loop)
+        growth = np.ones(universe_adj.shape[1])
+        universe_values = universe_adj.to_numpy(dtype=float)
+        weights_start, rp_gross_months = [], []
+        ledger_end = []
 
         for k, (dt, r_vec) in enumerate(rtw_adj.iterrows()):
             r_vec = r_vec.astype(float)
 
             # Gross portfolio return for this month
-            Rp_gross = float((w * r_vec).sum())
+            contrib = w * r_vec
+            Rp_gross = float(contrib.sum())
+
+            weights_start.append(w.values)
+            rp_gross_months.append(Rp_gross)
+            growth *= 1.0 + universe_values[k]
 
             # Transaction cost only at the first month after rebalance
             if k == 0:
@@ -386,10 +1193,70 @@ def run_backtest(config: PortfolioConfig, data: dict):
             w = w * (1.0 + r_vec)
             w = w / (1.0 + Rp_gross)
 
+            if ledger is not None:
+                ledger_end.append(w.values)
+
+        # Per-asset return contributions c_ti = w_ti * r_ti of the period (months x assets):
+        # sum_t c_ti and sum_t c_ti * Rp_t
+        if weights_start:
+            contrib_months = np.vstack(weights_start) * rtw_adj.to_numpy(dtype=float)
+            contrib_sum = contrib_months.sum(axis=0)
+            contrib_cross = np.asarray(rp_gross_months) @ contrib_months
+        else:
+            contrib_sum = np.zeros(len(w))
+            contrib_cross = np.zeros(len(w))
+
+        # ---------- Holdings ledger: this period's positions and trades ----------
+        if ledger is not None and weights_start:
+            # positions that left the universe are sold at the rebalance (no cost charged)
+            if prev_weights_end is None:
+                sold = pd.Series(dtype=float)
+            else:
+                sold = prev_weights_end.drop(rtw_adj.columns, errors="ignore")
+            n_sold = len(sold)
+            ledger.write_period(
+                rebalance_month,
+                rtw_adj.index,
+                rtw_adj.columns.append(sold.index),
+                np.pad(np.vstack(weights_start), ((0, 0), (0, n_sold))),
+                np.pad(np.vstack(ledger_end), ((0, 0), (0, n_sold))),
+                trades=np.concatenate([diff.reindex(rtw_adj.columns).values, -sold.values]),
+                trade_costs=np.concatenate([0.5 * tc_rate * diff.abs().reindex(rtw_adj.columns).values,
+                                            np.zeros(n_sold)]),
+            )
+
         # Save end-of-period weights for next turnover calculation
         prev_weights_end = w.copy()
         prev_weights_end.index = rtw_adj.columns
 
+        # ---------- Contributions / attribution of this holding period ----------
+        asset_returns = pd.Series(growth - 1.0, index=universe_adj.columns)
+        held_returns = asset_returns[rtw_adj.columns]
+
+        # ---------- Weights history (metadata joined only on export) ----------
+        history.append(
+            rebalance_month,
+            weights_t0[held_mask],
+            esg=esg_for_assets.reindex(weights_t0.index[held_mask]),
+            Return_Contribution=(w_start.values * held_returns.values)[held_mask],
+        )
+        contribution_sums.append((contrib_sum[held_mask], contrib_cross[held_mask]))
+
+        if attribution and len(universe_adj):
+            benchmark_weights = pd.Series(1.0 / universe_adj.shape[1], index=universe_adj.columns)
+            groups = {
+                "SECTOR": sector_for_assets,
+                "ESG": esg_for_assets,
+                "ASSET_CLASS": asset_class_for_assets,
+            }
+            for dimension in ATTRIBUTION_DIMENSIONS:
+                table = brinson_attribution(w_start, benchmark_weights, asset_returns, groups[dimension])
+                table.index.name = "Group"
+                table = table.reset_index()
+                table.insert(0, "Dimension", dimension)
+                table.insert(0, "Rebalance_Month", rebalance_month)
+                attribution_rows.append(table)
+
     # -------------------- Build outputs --------------------
     if portfolio_returns:
         perf = pd.DataFrame(portfolio_returns).set_index("Date").sort_index()
@@ -413,50 +1280,45 @@ def run_backtest(config: PortfolioConfig, data: dict):
         summary_df = pd.DataFrame(all_weights_summary)
         summary_df["Year"] = summary_df["Rebalance_Month"].dt.year
         summary_df = summary_df[
-            ["Year", "Rebalance_Month", "Top1", "Top2", "Top3", "Top3_Total", "Num_Assets"]
+            ["Year", "Rebalance_Month", "Top1", "Top2", "Top3", "Top3_Total", "Num_Assets", "Rebalanced"]
         ]
     else:
         summary_df = pd.DataFrame(
-            columns=["Year", "Rebalance_Month", "Top1", "Top2", "Top3", "Top3_Total", "Num_Assets"]
+            columns=["Year", "Rebalance_Month", "Top1", "Top2", "Top3", "Top3_Total", "Num_Assets",
+                     "Rebalanced"]
         )
 
-    if debug_weights_rows:
-        debug_weights_df = pd.concat(debug_weights_rows, ignore_index=True)
+    if not history.empty:
+        # Risk contributions: cov(c_i, Rp) / var(Rp) over the whole backtest,
+        # split by holding period, from the sums accumulated in the holding loop
+        rp_gross = perf["Rp_gross"].to_numpy(dtype=float)
+        rp_mean = rp_gross.mean()
+        total_var = float(((rp_gross - rp_mean) ** 2).sum())
+        if total_var <= 0:
+            total_var = np.nan
+
+        sum_c = np.concatenate([c for c, _ in contribution_sums])
+        sum_cr = np.concatenate([cr for _, cr in contribution_sums])
+        history.set_column("Risk_Contribution", (sum_cr - rp_mean * sum_c) / total_var)
+
+    if not attribution:
+        return perf, summary_df, history
+
+    attribution_columns = ["Rebalance_Month", "Dimension", "Group", "Portfolio_Weight",
+                           "Benchmark_Weight", "Portfolio_Return", "Benchmark_Return",
+                           "Allocation", "Selection", "Interaction", "Total"]
+    if attribution_rows:
+        attribution_df = pd.concat(attribution_rows, ignore_index=True)[attribution_columns]
     else:
-        debug_weights_df = pd.DataFrame(
-            columns=["ID", "Weight", "NAME", "SECTOR", "ASSET_CLASS", "ESG", "Rebalance_Month"]
-        )
-
-    return perf, summary_df, debug_weights_df
+        attribution_df = pd.DataFrame(columns=attribution_columns)
 
-# engine.py (continue)
-from typing import Dict, Any
-import pandas as pd
-import numpy as np
+    return perf, summary_df, history, attribution_df
 
-from functions import (
-    normalize_id,
-    filter_equity_candidates,
-    select_other_assets,
-    check_sector_constraints_feasibility,
-    check_esg_constraints_feasibility,
-    check_asset_class_constraints_feasibility,
-    markowitz_long_only,
-)
 
-def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any]:
+def _prepare_today(config: PortfolioConfig, data: dict) -> Dict[str, Any]:
     """
-    One-shot optimization as of the latest month where we have both
-    composition and returns.
-
-    Returns a dict with:
-        - 'candidates_period' : Period[M] used as "today"
-        - 'weights' : DataFrame with ID, Weight, NAME, SECTOR, ASSET_CLASS, ESG
-        - 'top5' : DataFrame of top 5 positions
-        - 'alloc_by_asset_class' : Series
-        - 'sector_in_equity' : Series (shares within equity slice)
-        - 'esg_in_equity' : Series (shares within equity slice)
-        - 'within_non_equity_classes' : dict[asset_class -> Series]
+    Everything of today's optimization that does not depend on gamma:
+    universe, estimation window, metadata vectors and feasibility checks.
     """
 
     # -------------------- Select equity universe --------------------
@@ -477,8 +1339,9 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
     returns_other = data["returns"]["Other"]
     metadata_other = data["metadata"]["Other"]
 
-    # Combine equity + other asset classes
-    returns_all = pd.concat([returns_equity, returns_other], axis=1).sort_index()
+    # Combine equity + other asset classes (returns are sliced per window)
+    returns_panels = [returns_equity, returns_other]
+    returns_ids = returns_equity.columns.union(returns_other.columns)
     metadata_all = pd.concat([metadata_equity, metadata_other], axis=0)
 
     # -------------------- Select other assets --------------------
@@ -491,11 +1354,10 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
     # -------------------- Determine "today" month --------------------
     # Last month where we have both composition and returns
     comp_max = composition_equity.columns.max()      # Period[M]
-    ret_max_all = returns_all.index.max()            # Period[M]
+    ret_max_all = max(returns_equity.index.max(), returns_other.index.max())  # Period[M]
     candidates_period_today = min(comp_max, ret_max_all)
 
     est_months = config.est_months
-    gamma = config.gamma
 
     estimation_end_today = candidates_period_today
     estimation_start_today = estimation_end_today - (est_months - 1)
@@ -528,7 +1390,7 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
     universe_ids_today = pd.Index(equity_ids_today).append(other_ids_selected)
     universe_ids_today = pd.Index(sorted(set(universe_ids_today)))
 
-    missing_today = sorted(set(universe_ids_today) - set(returns_all.columns))
+    missing_today = sorted(set(universe_ids_today) - set(returns_ids))
     if missing_today:
         raise ValueError(
             f"[Today optimization] {len(missing_today)} universe IDs are missing in returns_all. "
@@ -536,13 +1398,25 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
         )
 
     # Estimation window of returns for ALL assets (today)
-    estimation_window_today = returns_all.loc[estimation_start_today:estimation_end_today, universe_ids_today]
+    estimation_window_today = returns_window(
+        returns_panels, estimation_start_today, estimation_end_today, universe_ids_today
+    )
 
     bad_today = estimation_window_today.columns[estimation_window_today.isna().any()].tolist()
     if bad_today:
         # Optional logging; we just drop them
         estimation_window_today = estimation_window_today.dropna(axis=1, how="any")
 
+    # Daily / weekly estimation: same assets, higher-frequency returns
+    # (the monthly window is kept for monthly simulations of the portfolio)
+    monthly_window_today = estimation_window_today
+    hf_panels = estimation_panels(config, data)
+    if hf_panels is not None:
+        estimation_window_today = high_frequency_window(
+            hf_panels, estimation_start_today, estimation_end_today, estimation_window_today.columns
+        )
+        monthly_window_today = monthly_window_today[estimation_window_today.columns]
+
     if estimation_window_today.shape[1] == 0:
         raise ValueError("[Today optimization] All assets dropped due to NaNs in estimation window.")
 
@@ -571,18 +1445,79 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
         metadata_all,
         config.asset_class_constraints,
     )
+    check_constraints_feasibility_lp(
+        estimation_window_today.columns,
+        max_weight_per_asset=config.max_weight_per_asset,
+        asset_class_for_assets=asset_class_for_assets_today,
+        sector_for_assets=sector_for_assets_today,
+        sector_constraints=config.sector_constraints,
+        esg_for_assets=esg_for_assets_today,
+        esg_constraints=config.esg_constraints,
+        asset_class_constraints=config.asset_class_constraints,
+    )
+
+    # -------------------- Moments (configured estimators) --------------------
+    mu_today, sigma_today = _window_moments(config, estimation_window_today)
+    if config.mean_estimator != "sample":
+        mu_today = expected_returns(estimation_window_today, config.mean_estimator, covariance=sigma_today,
+                                    **_mean_estimator_options(config, estimation_window_today))
+
+    return {
+        "candidates_period": candidates_period_today,
+        "estimation_window": estimation_window_today,
+        "monthly_window": monthly_window_today,
+        "moments": (mu_today, sigma_today),
+        "sector_for_assets": sector_for_assets_today,
+        "esg_for_assets": esg_for_assets_today,
+        "asset_class_for_assets": asset_class_for_assets_today,
+        "metadata_all": metadata_all,
+        "esg_equity": esg_equity,
+    }
+
+
+def _monthly_moments(config: PortfolioConfig, estimation_window: pd.DataFrame, moments):
+    """
+    (mu, Sigma) estimated for today's portfolio, scaled from rows of the
+    estimation window to one month (i.i.d. rows), as a Series / DataFrame
+    on the window's assets: the model of simulate_portfolio_wealth.
+    """
+    mu_hat, sigma_hat = moments
+    p = _periods_per_month(config, estimation_window)
+    assets = estimation_window.columns
+    return (pd.Series(np.asarray(mu_hat, dtype=float) * p, index=assets),
+            pd.DataFrame(np.asarray(sigma_hat, dtype=float) * p, index=assets, columns=assets))
+
+
+def _solve_today(config: PortfolioConfig,
+                 prepared: Dict[str, Any],
+                 gamma: float,
+                 initial_weights: Optional[pd.Series] = None) -> Dict[str, Any]:
+    """
+    Optimize today's portfolio for one gamma on the output of _prepare_today.
+    """
+    candidates_period_today = prepared["candidates_period"]
+    estimation_window_today = prepared["estimation_window"]
+    metadata_all = prepared["metadata_all"]
+    esg_equity = prepared["esg_equity"]
 
     # -------------------- Optimize --------------------
-    weights_today = markowitz_long_only(
+    weights_today = allocate_portfolio(
         estimation_window_today,
+        allocator=config.allocator,
         gamma=gamma,
         max_weight_per_asset=config.max_weight_per_asset,
-        asset_class_for_assets=asset_class_for_assets_today,
-        sector_for_assets=sector_for_assets_today,
+        asset_class_for_assets=prepared["asset_class_for_assets"],
+        sector_for_assets=prepared["sector_for_assets"],
         sector_constraints=config.sector_constraints,
-        esg_for_assets=esg_for_assets_today,
+        esg_for_assets=prepared["esg_for_assets"],
         esg_constraints=config.esg_constraints,
         asset_class_constraints=config.asset_class_constraints,
+        initial_weights=initial_weights,
+        moments=_allocator_moments(config, estimation_window_today, prepared["moments"]),
+        cvar_alpha=config.cvar_alpha,
+        scenarios=_cvar_scenario_matrix(config, estimation_window_today),
+        max_positions=config.max_positions,
+        min_position_weight=config.min_position_weight,
     )
 
     weights_today.name = f"Today_{candidates_period_today}"
@@ -653,6 +1588,257 @@ def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any
         "sector_in_equity": sector_in_equity_today,
         "esg_in_equity": esg_in_equity_today,
         "within_non_equity_classes": within_class_allocations_today,
+        "estimation_window": estimation_window_today,
+        "monthly_window": prepared["monthly_window"],
+        "monthly_moments": _monthly_moments(config, estimation_window_today, prepared["moments"]),
     }
 
 
+def run_today_optimization(config: PortfolioConfig, data: dict) -> Dict[str, Any]:
+    """
+    One-shot optimization as of the latest month where we have both
+    composition and returns.
+
+    Returns a dict with:
+        - 'candidates_period' : Period[M] used as "today"
+        - 'weights' : DataFrame with ID, Weight, NAME, SECTOR, ASSET_CLASS, ESG
+        - 'top5' : DataFrame of top 5 positions
+        - 'alloc_by_asset_class' : Series
+        - 'sector_in_equity' : Series (shares within equity slice)
+        - 'esg_in_equity' : Series (shares within equity slice)
+        - 'within_non_equity_classes' : dict[asset_class -> Series]
+        - 'estimation_window' : DataFrame of returns used for the estimation
+        - 'monthly_window' : monthly returns of the same assets and months
+        - 'monthly_moments' : (mu, Sigma) of the optimization, scaled to one month
+    """
+    return _solve_today(config, _prepare_today(config, data), config.gamma)
+
+
+# Risk aversion levels of the questionnaire: gamma = 0.5 + 0.15 * (S - 10),
+# S = sum of ten answers in 1..5
+QUESTIONNAIRE_GAMMAS = [round(0.5 + 0.15 * (S - 10), 2) for S in range(10, 51)]
+
+
+def run_today_optimization_path(config: PortfolioConfig,
+                                data: dict,
+                                gammas=QUESTIONNAIRE_GAMMAS) -> Dict[float, Dict[str, Any]]:
+    """
+    run_today_optimization for several gammas (config.gamma is ignored).
+
+    The universe, estimation window and checks are done once; the solves
+    follow increasing gamma, each one warm-started from the previous
+    solution (neighbouring gammas have close optimal portfolios).
+
+    Returns:
+        dict gamma -> result dict of run_today_optimization
+    """
+    prepared = _prepare_today(config, data)
+
+    if config.allocator not in GAMMA_ALLOCATORS:
+        # gamma plays no role: one solve serves every gamma
+        res = _solve_today(config, prepared, config.gamma)
+        return {gamma: res for gamma in gammas}
+
+    results = {}
+    w_start = None
+    for gamma in sorted(gammas):
+        res = _solve_today(config, prepared, gamma, initial_weights=w_start)
+        w_start = res["weights"].set_index("ID")["Weight"]
+        results[gamma] = res
+
+    return results
+
+
+# -------------------- Block-bootstrap robustness --------------------
+def _bootstrap_rows(n_rows, block_size, rng):
+    """
+    Moving-block bootstrap: row positions of one resampled panel of n_rows,
+    built from contiguous blocks of `block_size` rows.
+    """
+    b = max(1, min(int(block_size), n_rows))
+    n_blocks = -(-n_rows // b)  # ceil
+    starts = rng.integers(0, n_rows - b + 1, size=n_blocks)
+    return (starts[:, None] + np.arange(b)).ravel()[:n_rows]
+
+
+def _bootstrap_window_plan(config: PortfolioConfig, data_template: dict, returns_all: pd.DataFrame):
+    """
+    What every replication shares: per rebalance month, the investable IDs
+    (as column positions of `returns_all`) and the row bounds of the
+    estimation window. Only the returns inside the windows differ between
+    replications, so they are gathered per replication from this plan.
+
+    data_template : data dict whose returns panels are `returns_all` split
+                    into equity / other (same index and columns as every
+                    resampled panel)
+
+    Returns:
+        list of (rebalance_month, universe_ids or None, column positions, (i0, i1))
+    """
+    universe = _backtest_universe(config, data_template)
+    schedule = build_rebalance_schedule(
+        config,
+        universe["returns_equity"].index,
+        universe["composition_equity"],
+        panel_indexes=[p.index for p in universe["returns_panels"]],
+    )
+
+    plan = []
+    for sched in schedule.itertuples(index=False):
+        universe_ids = _rebalance_universe_ids(config, universe, sched)
+        pos = None if universe_ids is None else returns_all.columns.get_indexer(universe_ids)
+        # every panel shares the index of returns_all: one pair of row bounds
+        plan.append((sched.Rebalance_Month, universe_ids, pos, sched.Est_Rows[0]))
+
+    return plan
+
+
+def _run_bootstrap_chunk(config, data_slim, returns_all, equity_cols, other_cols, plan, rows_chunk):
+    """
+    Worker: run the full backtest on each resampled panel of one chunk.
+
+    `returns_all` is the combined (equity + other) panel; its values are
+    memory-mapped by joblib and shared by all workers, only the row
+    positions travel with each task. The estimation windows of a
+    replication are gathered from `plan` (see _bootstrap_window_plan) and
+    handed to run_backtest as its artifacts.
+
+    Returns:
+        list of (rep_id, net returns or None, error message or None)
+    """
+    values = returns_all.to_numpy()
+    out = []
+
+    for rep_id, rows in rows_chunk:
+        try:
+            resampled = pd.DataFrame(values[rows], index=returns_all.index, columns=returns_all.columns)
+
+            data_rep = dict(data_slim)
+            data_rep["returns"] = {
+                config.universe_choice: resampled[equity_cols],
+                "Other": resampled[other_cols],
+            }
+
+            estimation_windows = {}
+            for month, universe_ids, pos, (i0, i1) in plan:
+                if universe_ids is None:
+                    estimation_windows[month] = None
+                    continue
+                window = pd.DataFrame(values[rows[i0:i1]][:, pos],
+                                      index=returns_all.index[i0:i1], columns=universe_ids)
+                # drop assets with any NaN over this window (as run_backtest does)
+                window = window.loc[:, window.notna().all().to_numpy()]
+                estimation_windows[month] = window if window.shape[1] > 0 else None
+
+            artifacts = _artifacts_from_windows(config, estimation_windows)
+            perf, _, _ = run_backtest(config, data_rep, artifacts=artifacts)
+        except Exception as e:
+            # infeasible / failed solve on this resample: recorded, the other
+            # replications go on
+            out.append((rep_id, None, f"{type(e).__name__}: {e}"))
+            continue
+
+        if perf.empty:
+            out.append((rep_id, None, "no rebalance with an investable universe"))
+        else:
+            out.append((rep_id, perf["Rp"], None))
+
+    return out
+
+
+def run_bootstrap_backtests(config: PortfolioConfig,
+                            data: dict,
+                            n_replications: int = 200,
+                            block_size: int = 6,
+                            n_jobs: int = -1,
+                            seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Robustness mode: re-run the whole rebalance / optimization pipeline on
+    block-bootstrapped resamples of the combined returns panel.
+
+    Rows (months) of the equity + other returns panel are resampled jointly
+    in blocks of `block_size` months, so cross-asset correlation and short-term
+    autocorrelation are kept, while dates, compositions and ESG labels stay as
+    in the historical data. Replications run in parallel joblib workers.
+
+    Returns a dict with:
+        - 'returns' : DataFrame of net monthly returns, one column per replication
+        - 'stats' : DataFrame of compute_backtest_stats_matrix, one row per replication
+        - 'summary' : quantiles (5/25/50/75/95%) of the main statistics
+        - 'n_failed' : number of replications where the optimizer failed
+        - 'failures' : {replication: error message} of those replications
+    """
+
+    if config.universe_choice not in ("SP500", "MSCI"):
+        raise ValueError(f"Unknown universe_choice: {config.universe_choice}")
+
+    if config.estimation_frequency != "M":
+        raise ValueError("Bootstrap robustness mode resamples monthly returns: use estimation_frequency='M'.")
+
+    # resampling needs the whole panel in memory (stores are read fully here)
+    returns_equity = data["returns"][config.universe_choice]
+    returns_other = data["returns"]["Other"]
+    returns_equity = returns_equity.to_frame() if hasattr(returns_equity, "window") else returns_equity
+    returns_other = returns_other.to_frame() if hasattr(returns_other, "window") else returns_other
+    returns_all = pd.concat([returns_equity, returns_other], axis=1).sort_index()
+
+    # only what run_backtest reads for this universe
+    data_slim = {
+        "composition": {config.universe_choice: data["composition"][config.universe_choice]},
+        "metadata": {
+            config.universe_choice: data["metadata"][config.universe_choice],
+            "Other": data["metadata"]["Other"],
+        },
+        "esg_labels": {config.universe_choice: data["esg_labels"][config.universe_choice]},
+    }
+
+    # schedule and universes do not depend on the returns: planned once
+    data_template = dict(data_slim)
+    data_template["returns"] = {
+        config.universe_choice: returns_all[returns_equity.columns],
+        "Other": returns_all[returns_other.columns],
+    }
+    plan = _bootstrap_window_plan(config, data_template, returns_all)
+
+    rng = np.random.default_rng(seed)
+    n_rows = len(returns_all)
+    all_rows = [(k, _bootstrap_rows(n_rows, block_size, rng)) for k in range(n_replications)]
+
+    # a few chunks per worker: amortizes task overhead, keeps load balanced
+    n_workers = joblib.effective_n_jobs(n_jobs)
+    n_chunks = max(1, min(n_replications, 4 * n_workers))
+    chunks = [all_rows[i::n_chunks] for i in range(n_chunks)]
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_run_bootstrap_chunk)(
+            config, data_slim, returns_all,
+            list(returns_equity.columns), list(returns_other.columns), plan, chunk,
+        )
+        for chunk in chunks
+    )
+
+    rp_by_rep = {rep_id: rp for chunk in results for rep_id, rp, _ in chunk if rp is not None}
+    failures = {rep_id: error for chunk in results for rep_id, _, error in chunk if error is not None}
+    n_failed = n_replications - len(rp_by_rep)
+
+    if rp_by_rep:
+        returns_rep = pd.DataFrame({k: rp_by_rep[k] for k in sorted(rp_by_rep)})
+    else:
+        returns_rep = pd.DataFrame()
+
+    stats_rep = compute_backtest_stats_matrix(returns_rep)
+
+    summary_cols = ["annualised_avg_return", "annualised_volatility", "annualised_cum_return",
+                    "max_drawdown", "sharpe_ratio"]
+    if stats_rep.empty:
+        summary = pd.DataFrame(columns=summary_cols)
+    else:
+        summary = stats_rep[summary_cols].astype(float).quantile([0.05, 0.25, 0.5, 0.75, 0.95])
+
+    return {
+        "returns": returns_rep,
+        "stats": stats_rep,
+        "summary": summary,
+        "n_failed": n_failed,
+        "failures": dict(sorted(failures.items())),
+    }
@@ -0,0 +1,392 @@
+# estimators.py
+"""
+Expected-return and covariance estimators for the optimizers.
+
+The raw sample mean of a short estimation window is noisy and makes the
+optimal weights jump between rebalances. The expected-return estimators
+trade some bias for much less noise:
+    sample          : sample mean of the window (what estimate_moments uses)
+    ewma            : exponentially weighted mean (recent months count more)
+    james_stein     : sample means shrunk towards their cross-sectional average,
+                      positive-part James-Stein intensity
+    black_litterman : equilibrium returns implied by benchmark weights
+                      (prior), updated with the sample means as views
+
+Covariance estimators (COVARIANCE_ESTIMATORS):
+    ledoit_wolf          : shrinkage towards a scaled identity (Ledoit-Wolf 2004,
+                           same estimate as sklearn's LedoitWolf)
+    oas                  : Oracle Approximating Shrinkage (Chen et al. 2010,
+                           same estimate as sklearn's OAS)
+    ewma                 : exponentially weighted covariance (RiskMetrics style)
+    constant_correlation : shrinkage towards a constant-correlation matrix
+                           (Ledoit-Wolf, "Honey, I shrunk the sample covariance matrix")
+    sample               : unbiased sample covariance
+
+Windows are stacked into (window x row x asset) arrays, so the statistics
+of many rebalances are computed in one batched pass; batches of windows are
+sized to a memory budget (window_batches). Only Black-Litterman needs one
+covariance solve per window.
+"""
+import numpy as np
+import pandas as pd
+
+EXPECTED_RETURN_ESTIMATORS = ("sample", "ewma", "james_stein", "black_litterman")
+COVARIANCE_ESTIMATORS = ("ledoit_wolf", "oas", "ewma", "constant_correlation", "sample")
+
+# memory for the stacked arrays of one batch of windows
+MEANS_BATCH_BYTES = 64 * 1024 * 1024
+COVARIANCE_BATCH_BYTES = 64 * 1024 * 1024
+
+
+def stack_windows(windows):
+    """
+    Stack estimation windows (DataFrames, rows = periods, columns = assets)
+    into one array aligned on their last row.
+
+    Returns:
+        (X, columns): X of shape (windows x longest window x union of assets),
+        NaN where a window has no row / asset; columns = the union of assets
+    """
+    columns = pd.Index([])
+    for window in windows:
+        columns = columns.union(window.columns)
+
+    k_max = max((len(window) for window in windows), default=0)
+    X = np.full((len(windows), k_max, len(columns)), np.nan)
+    for i, window in enumerate(windows):
+        pos = columns.get_indexer(window.columns)
+        X[i, k_max - len(window):, pos] = window.to_numpy(dtype=float).T
+    return X, columns
+
+
+def window_batches(windows, bytes_per_window, max_bytes):
+    """
+    Split windows into consecutive batches whose stacked arrays fit in
+    `max_bytes` (at least one window per batch).
+
+    bytes_per_window : function (rows, assets) -> bytes used per window of a
+                       stack with that many rows / union of assets
+
+    Yields:
+        (i, j): the batch is windows[i:j]
+    """
+    i = 0
+    while i < len(windows):
+        columns = pd.Index(windows[i].columns)
+        k_max = len(windows[i])
+        j = i + 1
+        while j < len(windows):
+            grown = columns.union(windows[j].columns)
+            k_grown = max(k_max, len(windows[j]))
+            if (j - i + 1) * bytes_per_window(k_grown, len(grown)) > max_bytes:
+                break
+            columns, k_max = grown, k_grown
+            j += 1
+        yield i, j
+        i = j
+
+
+def _batch_halflife(halflife, i, j):
+    """
+    Half-life(s) of windows[i:j]: `halflife` is None, one value for every
+    window, or a sequence with one value per window.
+    """
+    if halflife is None or np.ndim(halflife) == 0:
+        return halflife
+    return np.asarray(halflife, dtype=float)[i:j]
+
+
+def _row_weights(valid_rows, halflife):
+    """
+    (windows x rows) weights: 1 on the rows of each window, or exponential
+    weights halving every `halflife` rows back from the last row
+    (`halflife`: one value, or one per window).
+    """
+    k = valid_rows.shape[1]
+    if halflife is None:
+        return valid_rows.astype(float)
+    halflife = np.asarray(halflife, dtype=float).reshape(-1, 1)
+    if (halflife <= 0).any():
+        raise ValueError(f"halflife must be positive, got {halflife.ravel()}.")
+    return valid_rows * 0.5 ** (np.arange(k)[::-1][None, :] / halflife)
+
+
+def window_means(X, halflife=None):
+    """
+    Means and squared standard errors of every stacked window (stack_windows).
+
+    halflife : None for equal weights, else exponential weights halving every
+               `halflife` rows back from the last row of the window (one
+               value, or one per window)
+
+    Returns:
+        (means, standard_errors2, present): (windows x assets) arrays;
+        present marks the assets of each window
+    """
+    valid = ~np.isnan(X)
+    X0 = np.where(valid, X, 0.0)
+    W = valid * _row_weights(valid.any(axis=2), halflife)[:, :, None]
+
+    sum_w = W.sum(axis=1)
+    present = sum_w > 0
+    sum_w = np.where(present, sum_w, 1.0)
+    means = (W * X0).sum(axis=1) / sum_w
+
+    # weighted variance with the effective number of observations
+    n_eff = sum_w ** 2 / np.where(present, (W ** 2).sum(axis=1), 1.0)
+    dev2 = (W * (X0 - means[:, None, :]) ** 2).sum(axis=1) / sum_w
+    var = dev2 * n_eff / np.maximum(n_eff - 1.0, 1.0)
+    standard_errors2 = var / n_eff
+
+    means[~present] = np.nan
+    standard_errors2[~present] = np.nan
+    return means, standard_errors2, present
+
+
+def james_stein_means(means, standard_errors2, present):
+    """
+    Positive-part James-Stein shrinkage of each window's means (rows) towards
+    their cross-sectional average:
+        mu = m_bar + (1 - c) (m - m_bar),
+        c = min(1, (n - 3) * avg standard error^2 / sum (m - m_bar)^2)
+
+    Returns:
+        (windows x assets) array of shrunk means
+    """
+    n = present.sum(axis=1)
+    m0 = np.where(present, means, 0.0)
+    grand = m0.sum(axis=1) / np.maximum(n, 1)
+    dev = np.where(present, means - grand[:, None], 0.0)
+
+    avg_se2 = np.where(present, standard_errors2, 0.0).sum(axis=1) / np.maximum(n, 1)
+    dispersion = (dev ** 2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = np.where(dispersion > 0, (n - 3) * avg_se2 / dispersion, 1.0)
+    c = np.clip(c, 0.0, 1.0)
+
+    shrunk = grand[:, None] + (1.0 - c[:, None]) * dev
+    shrunk[~present] = np.nan
+    return shrunk
+
+
+def black_litterman_mean(sigma, views, view_variances, benchmark_weights=None,
+                         risk_aversion=2.5, tau=0.05):
+    """
+    Black-Litterman posterior mean of one window, with one absolute view per
+    asset (its sample mean, uncertainty = squared standard error):
+        pi = risk_aversion * Sigma w_bench           (equilibrium prior)
+        mu = pi + tau Sigma (tau Sigma + Omega)^-1 (views - pi)
+
+    benchmark_weights : default equal weights
+
+    Returns:
+        np.ndarray of posterior means
+    """
+    n = len(views)
+    if benchmark_weights is None:
+        benchmark_weights = np.full(n, 1.0 / n)
+    if tau <= 0:
+        raise ValueError(f"Black-Litterman tau must be positive, got {tau}.")
+
+    prior = risk_aversion * (sigma @ benchmark_weights)
+    tau_sigma = tau * sigma
+    gap = np.linalg.solve(tau_sigma + np.diag(view_variances), views - prior)
+    return prior + tau_sigma @ gap
+
+
+def expected_returns_batch(windows,
+                           method="sample",
+                           halflife=None,
+                           covariances=None,
+                           benchmark_weights=None,
+                           risk_aversion=2.5,
+                           tau=0.05,
+                           covariance_method="ledoit_wolf",
+                           covariance_halflife=None,
+                           max_bytes=MEANS_BATCH_BYTES):
+    """
+    Expected returns of several estimation windows at once.
+
+    method : one of EXPECTED_RETURN_ESTIMATORS
+    halflife : EWMA half-life in rows of the windows ('ewma' only): one
+               value, or one per window (windows of different row densities)
+    covariances : Black-Litterman only: covariance matrix of each window;
+                  entries None are estimated with `covariance_method`
+                  (and `covariance_halflife`, one value or one per window)
+    benchmark_weights : Black-Litterman only: one pd.Series per window
+                  (missing assets count as 0), default equal weights
+    risk_aversion, tau : Black-Litterman prior scale and uncertainty
+    max_bytes : memory budget of one batch of stacked windows
+
+    Returns:
+        list of np.ndarray, one per window, aligned with its columns
+    """
+    if method not in EXPECTED_RETURN_ESTIMATORS:
+        raise ValueError(f"Unknown expected-return estimator: {method} "
+                         f"(expected one of {', '.join(EXPECTED_RETURN_ESTIMATORS)}).")
+    if not windows:
+        return []
+
+    out = []
+    # window_means keeps about six (window x row x asset) arrays alive
+    for i, j in window_batches(windows, lambda k, n: 6 * 8 * k * n, max_bytes):
+        batch = windows[i:j]
+        X, columns = stack_windows(batch)
+        means, se2, present = window_means(
+            X, halflife=_batch_halflife(halflife, i, j) if method == "ewma" else None)
+        if method == "james_stein":
+            means = james_stein_means(means, se2, present)
+
+        for b, window in enumerate(batch):
+            pos = columns.get_indexer(window.columns)
+            mu = means[b, pos]
+
+            if method == "black_litterman":
+                sigma = None if covariances is None else covariances[i + b]
+                if sigma is None:
+                    sigma = covariance(window, covariance_method,
+                                       halflife=_batch_halflife(covariance_halflife, i + b, i + b + 1))
+                w_bench = None
+                if benchmark_weights is not None and benchmark_weights[i + b] is not None:
+                    w_bench = benchmark_weights[i + b].reindex(window.columns).fillna(0.0).to_numpy(dtype=float)
+                mu = black_litterman_mean(sigma, mu, se2[b, pos], w_bench,
+                                          risk_aversion=risk_aversion, tau=tau)
+
+            out.append(np.asarray(mu, dtype=float))
+    return out
+
+
+def expected_returns(window, method="sample", covariance=None, **kwargs):
+    """
+    Expected returns of one estimation window (see expected_returns_batch).
+
+    Returns:
+        np.ndarray aligned with window.columns
+    """
+    return expected_returns_batch([window], method=method, covariances=[covariance], **kwargs)[0]
+
+
+def _shrink_to_identity(S, shrinkage, trace_over_p):
+    """
+    (1 - s) S + s mu I for every window of the batch.
+    """
+    out = (1.0 - shrinkage)[:, None, None] * S
+    diag = np.arange(S.shape[1])
+    out[:, diag, diag] += (shrinkage * trace_over_p)[:, None]
+    return out
+
+
+def covariance_stack(X, method="ledoit_wolf", halflife=None):
+    """
+    Covariance matrices of every stacked window (stack_windows), over the
+    union of assets (rows / columns of absent assets are 0).
+
+    method : one of COVARIANCE_ESTIMATORS
+    halflife : EWMA half-life in rows ('ewma' only), one value or one per window
+
+    Returns:
+        (windows x assets x assets) array
+    """
+    if method not in COVARIANCE_ESTIMATORS:
+        raise ValueError(f"Unknown covariance estimator: {method} "
+                         f"(expected one of {', '.join(COVARIANCE_ESTIMATORS)}).")
+
+    valid = ~np.isnan(X)
+    present = valid.any(axis=1)                     # assets of each window
+    rows = valid.any(axis=2)                        # rows of each window
+    p = np.maximum(present.sum(axis=1), 1).astype(float)
+    n = np.maximum(rows.sum(axis=1), 1).astype(float)
+
+    w = _row_weights(rows, halflife if method == "ewma" else None)
+    sum_w = np.maximum(w.sum(axis=1), 1e-300)
+    X0 = np.where(valid, X, 0.0)
+    mean = np.einsum("mk,mkn->mn", w, X0) / sum_w[:, None]
+    Y = np.where(valid, X0 - mean[:, None, :], 0.0)
+
+    if method == "ewma":
+        Yw = Y * np.sqrt(w)[:, :, None]
+        return np.matmul(Yw.transpose(0, 2, 1), Yw) / sum_w[:, None, None]
+
+    # biased empirical covariance (as in sklearn / the shrinkage papers)
+    S = np.matmul(Y.transpose(0, 2, 1), Y) / n[:, None, None]
+    if method == "sample":
+        return S * (n / np.maximum(n - 1.0, 1.0))[:, None, None]
+
+    s_diag = np.diagonal(S, axis1=1, axis2=2)
+    trace = s_diag.sum(axis=1)
+    mu = trace / p
+    frob2 = (S ** 2).sum(axis=(1, 2))
+
+    if method == "ledoit_wolf":
+        Y2 = Y ** 2
+        beta_ = (Y2.sum(axis=2) ** 2).sum(axis=1)
+        beta = (beta_ / n - frob2) / (p * n)
+        delta = (frob2 - 2.0 * mu * trace + p * mu ** 2) / p
+        beta = np.minimum(beta, delta)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shrinkage = np.where(beta == 0, 0.0, beta / delta)
+        shrinkage = np.where(p > 1, shrinkage, 0.0)
+        return _shrink_to_identity(S, shrinkage, mu)
+
+    if method == "oas":
+        alpha = frob2 / p ** 2
+        num = alpha + mu ** 2
+        den = (n + 1.0) * (alpha - mu ** 2 / p)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shrinkage = np.where(den == 0, 1.0, np.minimum(num / den, 1.0))
+        shrinkage = np.where(p > 1, shrinkage, 0.0)
+        return _shrink_to_identity(S, shrinkage, mu)
+
+    # constant_correlation: target F = rbar * sd_i * sd_j off the diagonal, s_ii on it
+    sd = np.sqrt(s_diag)
+    inv_sd = np.where(sd > 0, 1.0 / np.where(sd > 0, sd, 1.0), 0.0)
+    corr = S * inv_sd[:, :, None] * inv_sd[:, None, :]
+    corr_sum = corr.sum(axis=(1, 2)) - (sd > 0).sum(axis=1)
+    rbar = corr_sum / np.maximum(p * (p - 1.0), 1.0)
+    F = rbar[:, None, None] * sd[:, :, None] * sd[:, None, :]
+    diag = np.arange(S.shape[1])
+    F[:, diag, diag] = s_diag
+
+    # pi: sum of the asymptotic variances of sqrt(T) s_ij
+    Y2 = Y ** 2
+    pi = ((Y2.sum(axis=2) ** 2).sum(axis=1)) / n - frob2
+    pi_diag = ((Y2 ** 2).sum(axis=1) / n[:, None] - s_diag ** 2).sum(axis=1)
+    # rho: theta_ii,ij = 1/T sum_t (y_ti^2 - s_ii)(y_ti y_tj - s_ij)
+    theta = np.matmul((Y2 * Y).transpose(0, 2, 1), Y) / n[:, None, None] - s_diag[:, :, None] * S
+    rho = pi_diag + rbar * (np.einsum("mi,mij,mj->m", inv_sd, theta, sd) - pi_diag)
+    gamma = ((F - S) ** 2).sum(axis=(1, 2))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kappa = np.where(gamma > 0, (pi - rho) / gamma, 0.0)
+    shrinkage = np.clip(kappa / n, 0.0, 1.0)
+    return shrinkage[:, None, None] * F + (1.0 - shrinkage)[:, None, None] * S
+
+
+def iter_covariances(windows, method="ledoit_wolf", halflife=None, max_bytes=COVARIANCE_BATCH_BYTES):
+    """
+    Covariance matrix of each estimation window, in order, computed in
+    batches of windows whose stacked arrays fit in `max_bytes`.
+
+    halflife : EWMA half-life in rows ('ewma' only), one value or one per window
+
+    Yields:
+        np.ndarray aligned with the columns of each window
+    """
+    # (window x asset x asset) results / temporaries plus the stacked rows
+    for i, j in window_batches(windows, lambda k, n: 4 * 8 * n * n + 5 * 8 * k * n, max_bytes):
+        batch = windows[i:j]
+        X, columns = stack_windows(batch)
+        covs = covariance_stack(X, method=method, halflife=_batch_halflife(halflife, i, j))
+        for b, window in enumerate(batch):
+            pos = columns.get_indexer(window.columns)
+            yield covs[b][np.ix_(pos, pos)]
+
+
+def covariance(window, method="ledoit_wolf", halflife=None):
+    """
+    Covariance matrix of one estimation window (see covariance_stack).
+
+    Returns:
+        np.ndarray aligned with window.columns
+    """
+    return next(iter_covariances([window], method=method, halflife=halflife))
@@ -4,15 +4,26 @@ import numpy as np
 import os
 import pickle
 import itertools
+import json
+import hashlib
+import time
 from datetime import datetime
-from scipy.optimize import minimize
+from scipy.optimize import minimize, linprog
+from scipy.linalg import cho_factor, cho_solve
+from scipy import sparse
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.ticker as mticker
 from dateutil.relativedelta import relativedelta
-from sklearn.covariance import LedoitWolf
+from estimators import covariance
 
 
+# LLM commentary cache (shared on disk by every app process / user)
+COMMENTARY_CACHE_DIR = os.path.join(".cache", "llm_commentary")
+COMMENTARY_CACHE_TTL_SECONDS = 7 * 24 * 3600   # one week
+COMMENTARY_CACHE_MAX_ENTRIES = 500
+COMMENTARY_CACHE_MAX_BYTES = 20 * 1024 * 1024  # 20 MB
+
 def normalize_id(x):
     """
     function to normalize every cell to consistent ID format
@@ -37,14 +48,17 @@ def to_month_period(c):
         return c
 
 
-def load_price_panel(excel_path, sheet_name=None):
+def load_price_panel(excel_path, sheet_name=None, freq="M"):
     """
-    Reads a monthly price file from a given sheet in an Excel workbook.
+    Reads a price file from a given sheet in an Excel workbook.
     First column = ID, others = dates.
 
+    freq : 'M' for monthly prices (index = Period[M]),
+           'D' for daily prices (index = DatetimeIndex of trading days)
+
     Returns:
-        prices: DataFrame (index = Date as Period[M], columns = asset IDs)
-        returns: DataFrame (same shape, monthly returns)
+        prices: DataFrame (index = Date, columns = asset IDs)
+        returns: DataFrame (same shape, returns at the panel frequency)
     """
 
     df = pd.read_excel(excel_path,sheet_name=sheet_name)
@@ -54,20 +68,66 @@ def load_price_panel(excel_path, sheet_name=None):
     df['id'] = df['id'].map(normalize_id)
     df = df.set_index('id')
 
-    # columns -> monthly PeriodIndex
-    df.columns = pd.to_datetime(df.columns).to_period('M')
+    if freq == "M":
+        # columns -> monthly PeriodIndex
+        df.columns = pd.to_datetime(df.columns).to_period('M')
+    elif freq == "D":
+        df.columns = pd.to_datetime(df.columns)
+        df = df.sort_index(axis=1)
+    else:
+        raise ValueError(f"load_price_panel: unknown freq {freq!r} (expected 'M' or 'D').")
 
     # prices with Date as index
     prices = df.T
     prices.index.name = 'Date'
 
     # compute returns: r_t = P_{t+1}/P_t - 1
-    returns = prices.shift(-1).divide(prices) - 1
-    returns = returns.iloc[:-1]
+    # (one output array; no shifted copy / intermediate ratio frame)
+    values = prices.to_numpy(dtype=float)
+    ret_values = np.empty((max(len(values) - 1, 0), values.shape[1]), dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(values[1:], values[:-1], out=ret_values)
+    ret_values -= 1.0
+    returns = pd.DataFrame(ret_values, index=prices.index[:-1], columns=prices.columns)
 
     return prices, returns
 
 
+def resample_returns(returns, freq="M"):
+    """
+    Compound higher-frequency returns (daily / weekly) into lower-frequency ones.
+
+    Same labelling as the monthly panels: r_t = P_{t+1}/P_t - 1 is dated t,
+    and a week / month gathers the returns dated inside it. Compounding is
+    done for all assets at once: prod(1 + r) - 1 = expm1(sum(log1p(r))).
+    A period where an asset has no return at all stays NaN.
+
+    freq : 'W' -> DatetimeIndex of week ends (Sundays), 'M' -> Period[M] index
+
+    Weeks are labelled by their last day, so a window cut at a month end
+    only contains the weeks that are complete by then (a week straddling
+    two months belongs to the later one, no look-ahead).
+    """
+    idx = returns.index
+    ts = idx.to_timestamp() if isinstance(idx, pd.PeriodIndex) else pd.DatetimeIndex(idx)
+
+    if freq == "M":
+        labels = ts.to_period("M")
+    elif freq == "W":
+        labels = ts.to_period("W")
+    else:
+        raise ValueError(f"resample_returns: unknown freq {freq!r} (expected 'W' or 'M').")
+
+    log_growth = np.log1p(returns)
+    out = np.expm1(log_growth.groupby(labels).sum(min_count=1))
+
+    if freq == "W":
+        out.index = out.index.end_time.normalize()
+    out.index.name = "Date"
+
+    return out
+
+
 def load_composition_panel(excel_path, sheet_name=None):
     """
     Reads a composition file (or sheet) with columns = months, rows = assets.
@@ -231,6 +291,22 @@ def filter_equity_candidates(raw_candidates,
     return list(filtered_ids)
 
 
+def estimate_moments(estimation_window, covariance_estimator="ledoit_wolf", halflife=None):
+    """
+    Estimates used by markowitz_long_only: sample mean and covariance of the
+    estimation window (Ledoit-Wolf unless another of
+    estimators.COVARIANCE_ESTIMATORS is given).
+
+    halflife : EWMA half-life in rows ('ewma' covariance only)
+
+    Returns:
+        (mu_hat, sigma_hat) as numpy arrays
+    """
+    mu_hat = estimation_window.mean(axis=0).values.astype(float)
+    sigma_hat = covariance(estimation_window, method=covariance_estimator, halflife=halflife)
+    return mu_hat, sigma_hat
+
+
 def markowitz_long_only(estimation_window,
                         gamma=None,
                         max_weight_per_asset=0.05,
@@ -239,7 +315,13 @@ def markowitz_long_only(estimation_window,
                         sector_constraints=None,
                         esg_for_assets=None,
                         esg_constraints=None,
-                        asset_class_constraints=None):
+                        asset_class_constraints=None,
+                        prev_weights=None,
+                        turnover_cost=0.0,
+                        turnover_penalty_quadratic=0.0,
+                        max_turnover=None,
+                        initial_weights=None,
+                        moments=None):
     """
     estimation_window : DataFrame of returns, columns = assets, rows = months
     gamma : risk aversion parameter (must be > 0)
@@ -258,6 +340,24 @@ def markowitz_long_only(estimation_window,
             'Equity': {'min': 0.7},
             'Fixed Income': {'max': 0.2},
         }
+    prev_weights : pd.Series indexed by asset ID, current (drifted) weights;
+        assets not in it count as 0. Needed by the three turnover options:
+    turnover_cost : cost per unit of one-way turnover, in the units of mu
+        (e.g. transaction cost rate / months held); it enters the objective
+        like the expected return: + gamma * turnover_cost * 0.5 * sum|w - w_prev|
+    turnover_penalty_quadratic : q, adds 0.5 * q * sum (w - w_prev)^2
+    max_turnover : cap on the one-way turnover 0.5 * sum|w - w_prev|; it is
+        raised if needed to the turnover forced by assets that left the
+        universe (their weight has to be reinvested)
+
+    The linear cost and the cap are handled with split variables
+    w = w_prev + buy - sell (buy, sell >= 0), which keeps the problem a
+    smooth QP. With prev_weights, the solver also starts from w_prev.
+
+    initial_weights : optional pd.Series, starting point of the solver
+        (warm start, e.g. the solution for a neighbouring gamma)
+    moments : optional (mu_hat, sigma_hat) from estimate_moments(estimation_window),
+        computed ahead of time
     """
 
     # ------------------ Basic sanity checks ------------------
@@ -276,11 +376,7 @@ def markowitz_long_only(estimation_window,
         )
 
     # ------------------ Estimate mu and Sigma ------------------
-    mu_hat = estimation_window.mean(axis=0).values.astype(float)
-
-    X = estimation_window.values  # rows=months, cols=assets
-    lw = LedoitWolf().fit(X)
-    sigma_hat = lw.covariance_.astype(float)
+    mu_hat, sigma_hat = estimate_moments(estimation_window) if moments is None else moments
 
     # Safety: enforce positive definiteness by clipping eigenvalues
     #eigvals, eigvecs = np.linalg.eigh(sigma_hat)
@@ -290,6 +386,11 @@ def markowitz_long_only(estimation_window,
 
     # ------------------ Initial guess ------------------
     x0 = np.ones(n, dtype=float) / n
+    if initial_weights is not None:
+        w_init = np.clip(initial_weights.reindex(assets).fillna(0.0).to_numpy(dtype=float),
+                         0.0, max_weight_per_asset)
+        if w_init.sum() > 0:
+            x0 = w_init / w_init.sum()
 
     # ------------------ Equity mask (for relative constraints) ------------------
     if asset_class_for_assets is not None:
@@ -427,21 +528,120 @@ def markowitz_long_only(estimation_window,
     # ------------------ Bounds ------------------
     bounds = [(0.0, max_weight_per_asset)] * n
 
-    res = minimize(
-        obj_f,
-        x0,
-        args=(sigma_hat, mu_hat, gamma),
-        method='SLSQP',
-        jac=f_obj_grad,
-        bounds=bounds,
-        constraints=constraints_list,
-        options={'maxiter': 150, 'ftol': 1e-6, 'disp': False}
+    # ------------------ Turnover-aware variant ------------------
+    use_turnover = prev_weights is not None and (
+        turnover_cost > 0 or turnover_penalty_quadratic > 0 or max_turnover is not None
     )
 
+    if not use_turnover:
+        res = minimize(
+            obj_f,
+            x0,
+            args=(sigma_hat, mu_hat, gamma),
+            method='SLSQP',
+            jac=f_obj_grad,
+            bounds=bounds,
+            constraints=constraints_list,
+            options={'maxiter': 150, 'ftol': 1e-6, 'disp': False}
+        )
+        x_opt = res.x
+    else:
+        if turnover_cost < 0 or turnover_penalty_quadratic < 0:
+            raise ValueError("markowitz_long_only: turnover penalties must be non-negative.")
+        if max_turnover is not None and max_turnover < 0:
+            raise ValueError(f"markowitz_long_only: max_turnover must be >= 0, got {max_turnover}.")
+
+        w_prev = prev_weights.reindex(assets).fillna(0.0).to_numpy(dtype=float)
+        q = float(turnover_penalty_quadratic)
+
+        # Warm start: previous weights (clipped to the bounds) when they are invested
+        if w_prev.sum() > 0:
+            x0 = np.clip(w_prev, 0.0, max_weight_per_asset)
+            x0 = x0 / x0.sum() if x0.sum() > 0 else np.ones(n, dtype=float) / n
+
+        if turnover_cost == 0 and max_turnover is None:
+            # Quadratic penalty only: no split variables needed
+            def obj_q(w):
+                d = w - w_prev
+                return obj_f(w, sigma_hat, mu_hat, gamma) + 0.5 * q * (d @ d)
+
+            def grad_q(w):
+                return f_obj_grad(w, sigma_hat, mu_hat, gamma) + q * (w - w_prev)
+
+            res = minimize(
+                obj_q,
+                x0,
+                method='SLSQP',
+                jac=grad_q,
+                bounds=bounds,
+                constraints=constraints_list,
+                options={'maxiter': 150, 'ftol': 1e-6, 'disp': False}
+            )
+            x_opt = res.x
+        else:
+            # Split variables z = [buy, sell], w = w_prev + buy - sell.
+            # Box bounds on buy / sell keep w within [0, max_weight_per_asset]:
+            #   buy  in [0, max(cap - w_prev, 0)],  sell in [max(w_prev - cap, 0), w_prev]
+            kappa = gamma * float(turnover_cost) * 0.5
+
+            def to_w(z):
+                return w_prev + z[:n] - z[n:]
+
+            def obj_z(z):
+                w, d = to_w(z), z[:n] - z[n:]
+                return obj_f(w, sigma_hat, mu_hat, gamma) + kappa * z.sum() + 0.5 * q * (d @ d)
+
+            def grad_z(z):
+                w, d = to_w(z), z[:n] - z[n:]
+                g = f_obj_grad(w, sigma_hat, mu_hat, gamma) + q * d
+                return np.concatenate([g + kappa, -g + kappa])
+
+            # existing constraints are on w: chain rule dw/dz = [I, -I]
+            constraints_z = [
+                {
+                    'type': c['type'],
+                    'fun': lambda z, f=c['fun']: f(to_w(z)),
+                    'jac': lambda z, j=c['jac']: np.concatenate([j(to_w(z)), -j(to_w(z))]),
+                }
+                for c in constraints_list
+            ]
+            if max_turnover is not None:
+                forced = 0.5 * max(1.0 - w_prev.sum(), 0.0)
+                max_turnover = max(float(max_turnover), forced + 1e-9)
+                cap_grad = -0.5 * np.ones(2 * n)
+                constraints_z.append({
+                    'type': 'ineq',
+                    'fun': lambda z, c=max_turnover: c - 0.5 * z.sum(),
+                    'jac': lambda z: cap_grad,
+                })
+
+            buy_max = np.maximum(max_weight_per_asset - w_prev, 0.0)
+            sell_min = np.maximum(w_prev - max_weight_per_asset, 0.0)
+            bounds_z = list(zip(np.zeros(n), buy_max)) + list(zip(sell_min, w_prev))
+
+            d0 = x0 - w_prev
+            z0 = np.concatenate([np.clip(d0, 0.0, buy_max), np.clip(-d0, sell_min, w_prev)])
+
+            res = minimize(
+                obj_z,
+                z0,
+                method='SLSQP',
+                jac=grad_z,
+                bounds=bounds_z,
+                constraints=constraints_z,
+                options={'maxiter': 300, 'ftol': 1e-6, 'disp': False}
+            )
+            x_opt = to_w(res.x)
+
     if not res.success:
+        if use_turnover and max_turnover is not None:
+            raise ValueError(
+                f"Optimization failed under max_turnover={max_turnover:.1%} "
+                f"(the constraints may require more trading): {res.message}"
+            )
         raise ValueError(f"Optimization failed: {res.message}")
 
-    w_opt = res.x.astype(float)
+    w_opt = x_opt.astype(float)
 
     # Numerical cleanup: clip tiny negatives to 0, renormalize
     w_opt = np.where(w_opt < 0, 0.0, w_opt)
@@ -452,6 +652,676 @@ def markowitz_long_only(estimation_window,
 
     return pd.Series(w_opt, index=assets, name="weights_opt")
 
+def mean_variance_objective(estimation_window, weights, gamma, moments=None):
+    """
+    Objective minimized by markowitz_long_only, 0.5 * w' Sigma w - gamma * mu' w,
+    evaluated with the same estimates (estimate_moments, or the given moments).
+
+    weights : pd.Series indexed by asset ID, or DataFrame with one column per
+              portfolio (assets missing from it count as 0)
+    moments : optional (mu_hat, sigma_hat) from estimate_moments
+
+    Returns:
+        float (Series input) or pd.Series (one value per portfolio)
+    """
+    assets = estimation_window.columns
+    mu_hat, sigma_hat = estimate_moments(estimation_window) if moments is None else moments
+
+    W = weights.reindex(assets).fillna(0.0)
+    X = W.to_numpy(dtype=float).reshape(len(assets), -1)
+    values = 0.5 * np.einsum("ip,ij,jp->p", X, sigma_hat, X) - gamma * (mu_hat @ X)
+
+    if isinstance(weights, pd.DataFrame):
+        return pd.Series(values, index=weights.columns)
+    return float(values[0])
+
+
+# Alternative allocators: same constraints as markowitz_long_only (budget, max
+# weight per asset, sector / ESG shares of equity, asset-class bounds), taken from
+# linear_constraint_rows; only the objective differs.
+ALLOCATORS = ("mean_variance", "min_variance", "risk_parity", "max_diversification", "mean_cvar")
+
+# allocators whose solution depends on gamma
+GAMMA_ALLOCATORS = ("mean_variance", "mean_cvar")
+
+
+def _allocator_problem(assets,
+                       max_weight_per_asset,
+                       asset_class_for_assets,
+                       sector_for_assets,
+                       sector_constraints,
+                       esg_for_assets,
+                       esg_constraints,
+                       asset_class_constraints):
+    """
+    Bounds and linear constraints A @ w <= b of an allocator (the budget
+    sum w = 1 is added by _solve_allocator).
+
+    Returns:
+        bounds, A, b
+    """
+    n = len(assets)
+
+    if max_weight_per_asset <= 0 or max_weight_per_asset > 1:
+        raise ValueError(f"max_weight_per_asset should be in (0,1], got {max_weight_per_asset}.")
+
+    if (sector_constraints or esg_constraints) and asset_class_for_assets is not None:
+        if not (asset_class_for_assets.reindex(assets) == 'Equity').any():
+            raise ValueError(
+                "Sector/ESG constraints specified but no asset is labeled as 'Equity' "
+                "in asset_class_for_assets."
+            )
+
+    A, b, _ = linear_constraint_rows(
+        assets,
+        asset_class_for_assets=asset_class_for_assets,
+        sector_for_assets=sector_for_assets,
+        sector_constraints=sector_constraints,
+        esg_for_assets=esg_for_assets,
+        esg_constraints=esg_constraints,
+        asset_class_constraints=asset_class_constraints,
+    )
+
+    return [(0.0, max_weight_per_asset)] * n, A, b
+
+
+def _solve_allocator(objective, gradient, x0, bounds, A, b, name, tol=1e-9, max_outer=60,
+                     budget=True):
+    """
+    min objective(w) s.t. sum w = 1, A @ w <= b and the bounds, by an
+    augmented Lagrangian on the budget and the rows of A, each subproblem
+    being bound-constrained and solved by L-BFGS-B. Memory is O(n) besides
+    A (dense or scipy.sparse), and each step costs one gradient (one
+    Sigma @ w), which keeps large universes fast where SLSQP's dense O(n^3)
+    steps do not.
+
+    budget : False drops the sum w = 1 constraint (risk_parity_long_only
+             normalizes its solution itself); the result is then returned
+             as solved, only clipped at 0
+
+    The weights are then cleaned up like in markowitz_long_only (clip, renormalize).
+    """
+    lam = np.zeros(len(b))   # multipliers of A @ w <= b
+    nu = 0.0                 # multiplier of the budget
+    rho = 10.0
+    w = np.clip(x0, [lo for lo, _ in bounds], [hi for _, hi in bounds])
+    viol_prev = np.inf
+
+    for _ in range(max_outer):
+        def lagrangian(x, nu=nu, lam=lam, rho=rho):
+            r = x.sum() - 1.0 if budget else 0.0
+            p = np.maximum(0.0, lam + rho * (A @ x - b))
+            value = objective(x) + nu * r + 0.5 * rho * r * r + (p @ p - lam @ lam) / (2.0 * rho)
+            return value, gradient(x) + (nu + rho * r) + A.T @ p
+
+        res = minimize(lagrangian, w, jac=True, method="L-BFGS-B", bounds=bounds,
+                       options={"maxiter": 5000, "ftol": 1e-15, "gtol": 1e-10})
+        step = np.max(np.abs(res.x - w))
+        w = res.x
+
+        r = w.sum() - 1.0 if budget else 0.0
+        slack = A @ w - b
+        viol = max(abs(r), slack.max(initial=0.0))
+        nu += rho * r
+        lam = np.maximum(0.0, lam + rho * slack)
+
+        if viol <= tol and step <= 1e-7:
+            break
+        if viol > 0.25 * viol_prev:
+            rho = min(rho * 10.0, 1e10)
+        viol_prev = viol
+
+    if viol > 1e-6:
+        raise ValueError(f"Optimization failed ({name}): constraints violated by {viol:.1e}.")
+
+    w = np.where(w < 0, 0.0, w)
+    if not budget:
+        return w
+    if w.sum() <= 0:
+        raise ValueError("Optimization returned non-positive total weight.")
+    return w / w.sum()
+
+
+def cvar_scenarios(estimation_window, n_scenarios=None, block=1, seed=0):
+    """
+    Scenario matrix (scenarios x assets) for mean_cvar_long_only.
+
+    n_scenarios None : the rows of the estimation window
+    otherwise : n_scenarios block-bootstrapped returns, each compounded over
+        `block` consecutive rows from a random start (wrapping around), e.g.
+        block = 21 turns daily estimation data into monthly scenarios
+
+    Returns:
+        numpy array
+    """
+    R = estimation_window.to_numpy(dtype=float)
+    if n_scenarios is None:
+        return R
+
+    T = R.shape[0]
+    block = max(int(block), 1)
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, T, size=int(n_scenarios))
+    rows = (starts[:, None] + np.arange(block)[None, :]) % T
+
+    # compounded over the block: prod(1 + r) - 1, via sums of log1p
+    return np.expm1(np.log1p(R)[rows].sum(axis=1))
+
+
+def mean_cvar_long_only(estimation_window,
+                        gamma=None,
+                        cvar_alpha=0.95,
+                        scenarios=None,
+                        max_weight_per_asset=0.05,
+                        asset_class_for_assets=None,
+                        sector_for_assets=None,
+                        sector_constraints=None,
+                        esg_for_assets=None,
+                        esg_constraints=None,
+                        asset_class_constraints=None,
+                        moments=None):
+    """
+    Mean-CVaR portfolio: min CVaR_alpha(loss) - gamma * mean return, with the
+    constraints of markowitz_long_only, as the Rockafellar-Uryasev LP
+
+        min  -gamma * mu' w + a + 1 / ((1 - alpha) S) * sum_s u_s
+        s.t. u_s >= -r_s' w - a,  u_s >= 0     (s = 1..S scenarios)
+
+    solved by HiGHS (scipy linprog) with a sparse constraint matrix.
+
+    cvar_alpha : confidence level of the CVaR (0.95 = mean of the worst 5%)
+    scenarios : optional scenario matrix (S x assets, e.g. from cvar_scenarios);
+                default: the rows of the estimation window
+    moments : optional (mu_hat, sigma_hat); mu_hat replaces the scenario mean
+              as expected return (e.g. a shrunk estimate)
+    """
+    if gamma is None or gamma < 0:
+        raise ValueError(f"mean_cvar: gamma must be non-negative, got {gamma}.")
+    if not 0 < cvar_alpha < 1:
+        raise ValueError(f"mean_cvar: cvar_alpha must be in (0, 1), got {cvar_alpha}.")
+
+    assets = list(estimation_window.columns)
+    n = len(assets)
+    bounds_w, A, b = _allocator_problem(
+        assets, max_weight_per_asset, asset_class_for_assets, sector_for_assets,
+        sector_constraints, esg_for_assets, esg_constraints, asset_class_constraints,
+    )
+
+    R = estimation_window.to_numpy(dtype=float) if scenarios is None else np.asarray(scenarios, dtype=float)
+    S = R.shape[0]
+    mu = R.mean(axis=0) if moments is None else np.asarray(moments[0], dtype=float)
+
+    # variables x = [w (n), a (1), u (S)]
+    c = np.concatenate([-gamma * mu, [1.0], np.full(S, 1.0 / ((1.0 - cvar_alpha) * S))])
+
+    # -R w - a - u <= 0, then the group rows A w <= b
+    A_ub = sparse.vstack([
+        sparse.hstack([sparse.csr_matrix(-R), sparse.csr_matrix(-np.ones((S, 1))), -sparse.identity(S, format="csr")]),
+        sparse.hstack([sparse.csr_matrix(A), sparse.csr_matrix((len(b), 1 + S))]),
+    ], format="csr")
+    b_ub = np.concatenate([np.zeros(S), b])
+
+    A_eq = sparse.csr_matrix(np.concatenate([np.ones(n), np.zeros(1 + S)])[None, :])
+    bounds = bounds_w + [(None, None)] + [(0.0, None)] * S
+
+    res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[1.0], bounds=bounds, method="highs")
+    if res.status != 0:
+        raise ValueError(f"Optimization failed (mean_cvar): {res.message}")
+
+    w = np.where(res.x[:n] < 0, 0.0, res.x[:n])
+    return pd.Series(w / w.sum(), index=assets, name="weights_opt")
+
+
+def _initial_point(assets, initial_weights, max_weight_per_asset):
+    """
+    Equal weights, or `initial_weights` clipped to the bounds (warm start).
+    """
+    n = len(assets)
+    x0 = np.ones(n, dtype=float) / n
+    if initial_weights is not None:
+        w_init = np.clip(initial_weights.reindex(assets).fillna(0.0).to_numpy(dtype=float),
+                         0.0, max_weight_per_asset)
+        if w_init.sum() > 0:
+            x0 = w_init / w_init.sum()
+    return x0
+
+
+def positive_definite_covariance(sigma, ridge=1e-3):
+    """
+    sigma itself if positive definite, else sigma + ridge * mean variance * I
+    (sample / EWMA covariances are singular when the window has fewer rows
+    than assets; the risk-based allocators need a positive definite matrix).
+    """
+    try:
+        cho_factor(sigma)
+        return sigma
+    except np.linalg.LinAlgError:
+        return sigma + ridge * max(float(np.mean(np.diag(sigma))), 1e-12) * np.eye(len(sigma))
+
+
+def risk_parity_newton(sigma, budgets=None, tol=1e-10, max_iter=100):
+    """
+    Unconstrained risk-budgeting portfolio: Newton's method on the convex
+    problem min 0.5 y' Sigma y - b' log(y), y > 0, then w = y / sum y.
+
+    Gradient Sigma y - b / y, Hessian Sigma + diag(b / y^2) (positive
+    definite, solved by Cholesky); steps are damped to keep y > 0 and to
+    decrease the objective, so convergence is quadratic near the solution.
+
+    Returns:
+        weights as a numpy array (risk contributions proportional to budgets)
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    n = sigma.shape[0]
+    b = np.full(n, 1.0 / n) if budgets is None else np.asarray(budgets, dtype=float) / np.sum(budgets)
+
+    def objective(y):
+        return 0.5 * (y @ sigma @ y) - b @ np.log(y)
+
+    # start: inverse-volatility weights, scaled to unit variance
+    y = b / np.sqrt(np.diag(sigma))
+    y /= np.sqrt(y @ sigma @ y)
+    f = objective(y)
+
+    for _ in range(max_iter):
+        s = sigma @ y
+        # at the optimum y_i (Sigma y)_i = b_i for every asset
+        if np.max(np.abs(y * s - b)) <= tol * b.max():
+            break
+
+        grad = s - b / y
+        hess = sigma + np.diag(b / (y * y))
+        try:
+            step = -cho_solve(cho_factor(hess, overwrite_a=True), grad)
+        except np.linalg.LinAlgError:
+            step = -grad
+
+        # damping: stay in y > 0, then backtrack until the objective decreases
+        neg = step < 0
+        t = min(1.0, 0.99 * np.min(-y[neg] / step[neg])) if neg.any() else 1.0
+        while t > 1e-12:
+            y_new = y + t * step
+            f_new = objective(y_new)
+            if f_new <= f + 1e-4 * t * (grad @ step):
+                break
+            t *= 0.5
+        y, f = y_new, f_new
+
+    return y / y.sum()
+
+
+def min_variance_long_only(estimation_window,
+                           max_weight_per_asset=0.05,
+                           asset_class_for_assets=None,
+                           sector_for_assets=None,
+                           sector_constraints=None,
+                           esg_for_assets=None,
+                           esg_constraints=None,
+                           asset_class_constraints=None,
+                           initial_weights=None,
+                           moments=None):
+    """
+    Global minimum-variance portfolio (estimate_moments covariance) under the
+    constraints of markowitz_long_only.
+    """
+    assets = list(estimation_window.columns)
+    n = len(assets)
+    bounds, A, b = _allocator_problem(
+        assets, max_weight_per_asset, asset_class_for_assets, sector_for_assets,
+        sector_constraints, esg_for_assets, esg_constraints, asset_class_constraints,
+    )
+    _, sigma_hat = estimate_moments(estimation_window) if moments is None else moments
+
+    # variance relative to the equally weighted portfolio's: O(1) objective
+    S = sigma_hat / (np.sum(sigma_hat) / (n * n))
+    x0 = _initial_point(assets, initial_weights, max_weight_per_asset)
+
+    w = _solve_allocator(lambda w: 0.5 * (w @ S @ w), lambda w: S @ w,
+                         x0, bounds, A, b, "min_variance")
+    return pd.Series(w, index=assets, name="weights_opt")
+
+
+def risk_parity_long_only(estimation_window,
+                          max_weight_per_asset=0.05,
+                          asset_class_for_assets=None,
+                          sector_for_assets=None,
+                          sector_constraints=None,
+                          esg_for_assets=None,
+                          esg_constraints=None,
+                          asset_class_constraints=None,
+                          initial_weights=None,
+                          moments=None):
+    """
+    Equal-risk-contribution portfolio (estimate_moments covariance).
+
+    The unconstrained solution (risk_parity_newton) is kept when it satisfies
+    the constraints. Otherwise this is the constrained risk-budgeting
+    portfolio (Richard & Roncalli): y minimizes the convex log-barrier
+    problem 0.5 y' Sigma y - sum_i log(y_i) / n with no budget, over the
+    constraints written homogeneously (y_i <= m * sum y, A y <= b * sum y),
+    and w = y / sum y. Without binding constraints this is w_erc itself;
+    the risk contributions stay equal for the assets whose constraints do
+    not bind. Solved by _solve_allocator (augmented Lagrangian, L-BFGS-B
+    subproblems) starting from w_erc clipped to the bounds.
+    """
+    assets = list(estimation_window.columns)
+    n = len(assets)
+    bounds, A, b = _allocator_problem(
+        assets, max_weight_per_asset, asset_class_for_assets, sector_for_assets,
+        sector_constraints, esg_for_assets, esg_constraints, asset_class_constraints,
+    )
+    _, sigma_hat = estimate_moments(estimation_window) if moments is None else moments
+    sigma_hat = positive_definite_covariance(sigma_hat)
+
+    w_erc = risk_parity_newton(sigma_hat)
+    feasible = w_erc.max() <= max_weight_per_asset + 1e-9 and (
+        not len(b) or np.all(A @ w_erc <= b + 1e-9)
+    )
+    if feasible:
+        return pd.Series(w_erc, index=assets, name="weights_opt")
+
+    # unit risk of the unconstrained solution: y and the objective are O(1)
+    S = sigma_hat / float(w_erc @ sigma_hat @ w_erc)
+
+    # variables x = [y (n), s = sum y]; rows y_i - m s <= 0, the group rows
+    # (A - b 1') y <= 0 and s = sum y (two rows), all sparse but the groups
+    m = max_weight_per_asset
+    ones = sparse.csr_matrix(np.ones((1, n)))
+    A_h = sparse.vstack([
+        sparse.hstack([sparse.identity(n, format="csr"), sparse.csr_matrix(np.full((n, 1), -m))]),
+        sparse.hstack([sparse.csr_matrix(A - b[:, None]), sparse.csr_matrix((len(b), 1))]),
+        sparse.hstack([ones, sparse.csr_matrix([[-1.0]])]),
+        sparse.hstack([-ones, sparse.csr_matrix([[1.0]])]),
+    ], format="csr")
+    b_h = np.zeros(A_h.shape[0])
+
+    def objective(x):
+        y = x[:n]
+        return 0.5 * (y @ S @ y) - np.mean(np.log(y))
+
+    def gradient(x):
+        y = x[:n]
+        return np.append(S @ y - 1.0 / (n * y), 0.0)
+
+    # log barrier: keep the weights strictly positive
+    y0 = np.clip(w_erc, 1e-10, max_weight_per_asset)
+    y0 = y0 / y0.sum()
+    x = _solve_allocator(objective, gradient, np.append(y0, 1.0),
+                         [(1e-10, np.inf)] * n + [(0.0, np.inf)], A_h, b_h, "risk_parity", budget=False)
+    y = x[:n]
+    return pd.Series(y / y.sum(), index=assets, name="weights_opt")
+
+
+def max_diversification_long_only(estimation_window,
+                                  max_weight_per_asset=0.05,
+                                  asset_class_for_assets=None,
+                                  sector_for_assets=None,
+                                  sector_constraints=None,
+                                  esg_for_assets=None,
+                                  esg_constraints=None,
+                                  asset_class_constraints=None,
+                                  initial_weights=None,
+                                  moments=None):
+    """
+    Maximum-diversification portfolio: maximizes sigma' w / sqrt(w' Sigma w)
+    (estimate_moments covariance), solved as min 0.5 log(w' Sigma w) - log(sigma' w)
+    under the constraints of markowitz_long_only.
+    """
+    assets = list(estimation_window.columns)
+    bounds, A, b = _allocator_problem(
+        assets, max_weight_per_asset, asset_class_for_assets, sector_for_assets,
+        sector_constraints, esg_for_assets, esg_constraints, asset_class_constraints,
+    )
+    _, sigma_hat = estimate_moments(estimation_window) if moments is None else moments
+    sigma_hat = positive_definite_covariance(sigma_hat)
+    vol = np.sqrt(np.diag(sigma_hat))
+
+    def objective(w):
+        return 0.5 * np.log(w @ sigma_hat @ w) - np.log(vol @ w)
+
+    def gradient(w):
+        s = sigma_hat @ w
+        return s / (w @ s) - vol / (vol @ w)
+
+    x0 = _initial_point(assets, initial_weights, max_weight_per_asset)
+    w = _solve_allocator(objective, gradient, x0, bounds, A, b, "max_diversification")
+    return pd.Series(w, index=assets, name="weights_opt")
+
+
+def allocate_portfolio(estimation_window,
+                       allocator="mean_variance",
+                       gamma=None,
+                       max_weight_per_asset=0.05,
+                       asset_class_for_assets=None,
+                       sector_for_assets=None,
+                       sector_constraints=None,
+                       esg_for_assets=None,
+                       esg_constraints=None,
+                       asset_class_constraints=None,
+                       prev_weights=None,
+                       turnover_cost=0.0,
+                       turnover_penalty_quadratic=0.0,
+                       max_turnover=None,
+                       initial_weights=None,
+                       moments=None,
+                       cvar_alpha=0.95,
+                       scenarios=None,
+                       max_positions=None,
+                       min_position_weight=0.0):
+    """
+    Portfolio weights from the chosen allocator (one of ALLOCATORS):
+        'mean_variance'       : markowitz_long_only (uses gamma and the turnover options)
+        'min_variance'        : min_variance_long_only
+        'risk_parity'         : risk_parity_long_only
+        'max_diversification' : max_diversification_long_only
+        'mean_cvar'           : mean_cvar_long_only (uses gamma, cvar_alpha, scenarios)
+    All allocators share the same constraints; see markowitz_long_only.
+
+    max_positions : optional cap on the number of held assets
+    min_position_weight : smallest allowed non-zero weight (0 = no minimum)
+    Both are handled by limit_positions around the chosen allocator.
+
+    Returns:
+        pd.Series of weights indexed by asset ID
+    """
+    if max_positions is not None or min_position_weight > 0:
+        def solve(window, window_moments, window_scenarios, start):
+            return allocate_portfolio(
+                window,
+                allocator=allocator,
+                gamma=gamma,
+                max_weight_per_asset=max_weight_per_asset,
+                asset_class_for_assets=asset_class_for_assets,
+                sector_for_assets=sector_for_assets,
+                sector_constraints=sector_constraints,
+                esg_for_assets=esg_for_assets,
+                esg_constraints=esg_constraints,
+                asset_class_constraints=asset_class_constraints,
+                prev_weights=prev_weights,
+                turnover_cost=turnover_cost,
+                turnover_penalty_quadratic=turnover_penalty_quadratic,
+                max_turnover=max_turnover,
+                initial_weights=start,
+                moments=window_moments,
+                cvar_alpha=cvar_alpha,
+                scenarios=window_scenarios,
+            )
+
+        return limit_positions(
+            solve,
+            estimation_window,
+            max_positions=max_positions,
+            min_position_weight=min_position_weight,
+            max_weight_per_asset=max_weight_per_asset,
+            initial_weights=initial_weights,
+            moments=moments,
+            scenarios=scenarios,
+        )
+
+    if allocator == "mean_variance":
+        return markowitz_long_only(
+            estimation_window,
+            gamma=gamma,
+            max_weight_per_asset=max_weight_per_asset,
+            asset_class_for_assets=asset_class_for_assets,
+            sector_for_assets=sector_for_assets,
+            sector_constraints=sector_constraints,
+            esg_for_assets=esg_for_assets,
+            esg_constraints=esg_constraints,
+            asset_class_constraints=asset_class_constraints,
+            prev_weights=prev_weights,
+            turnover_cost=turnover_cost,
+            turnover_penalty_quadratic=turnover_penalty_quadratic,
+            max_turnover=max_turnover,
+            initial_weights=initial_weights,
+            moments=moments,
+        )
+
+    solvers = {
+        "mean_cvar": mean_cvar_long_only,
+        "min_variance": min_variance_long_only,
+        "risk_parity": risk_parity_long_only,
+        "max_diversification": max_diversification_long_only,
+    }
+    if allocator not in solvers:
+        raise ValueError(f"Unknown allocator: {allocator} (expected one of {', '.join(ALLOCATORS)}).")
+
+    if turnover_cost > 0 or turnover_penalty_quadratic > 0 or max_turnover is not None:
+        raise ValueError(f"Turnover controls are only available with the mean-variance allocator, "
+                         f"not '{allocator}'.")
+
+    if estimation_window is None or estimation_window.shape[1] == 0:
+        raise ValueError(f"{allocator}: estimation_window has no assets (0 columns).")
+
+    if allocator == "mean_cvar":
+        return mean_cvar_long_only(
+            estimation_window,
+            gamma=gamma,
+            cvar_alpha=cvar_alpha,
+            scenarios=scenarios,
+            max_weight_per_asset=max_weight_per_asset,
+            asset_class_for_assets=asset_class_for_assets,
+            sector_for_assets=sector_for_assets,
+            sector_constraints=sector_constraints,
+            esg_for_assets=esg_for_assets,
+            esg_constraints=esg_constraints,
+            asset_class_constraints=asset_class_constraints,
+            moments=moments,
+        )
+
+    return solvers[allocator](
+        estimation_window,
+        max_weight_per_asset=max_weight_per_asset,
+        asset_class_for_assets=asset_class_for_assets,
+        sector_for_assets=sector_for_assets,
+        sector_constraints=sector_constraints,
+        esg_for_assets=esg_for_assets,
+        esg_constraints=esg_constraints,
+        asset_class_constraints=asset_class_constraints,
+        initial_weights=initial_weights,
+        moments=moments,
+    )
+
+
+# weights at or below this count as not held (as in the backtest summaries)
+HELD_WEIGHT_TOL = 1e-6
+
+
+def limit_positions(solve,
+                    estimation_window,
+                    max_positions=None,
+                    min_position_weight=0.0,
+                    max_weight_per_asset=0.05,
+                    initial_weights=None,
+                    moments=None,
+                    scenarios=None):
+    """
+    Greedy pruning for cardinality / minimum-size limits: solve on the full
+    universe, then repeatedly drop the smallest positions and re-solve on the
+    remaining assets, warm-started from the previous weights, until at most
+    `max_positions` assets are held and none is below `min_position_weight`.
+
+    Each step removes at most half of the held assets (the ones above the
+    limits first), so reaching K names out of N takes about log2(N / K)
+    re-solves, each on a smaller problem. If a step makes the constraints
+    infeasible, fewer assets are dropped.
+
+    solve : function (window, moments, scenarios, initial_weights) -> weights,
+            e.g. one allocator of allocate_portfolio with fixed constraints
+    moments / scenarios : optional inputs of the full universe (estimate_moments
+            output / scenario matrix), restricted to the kept assets
+
+    Returns:
+        pd.Series of weights indexed by the columns of estimation_window
+    """
+    assets = pd.Index(estimation_window.columns)
+    n_min = int(np.ceil(1.0 / max_weight_per_asset - 1e-9))
+
+    if max_positions is not None:
+        if max_positions < 1:
+            raise ValueError(f"max_positions must be at least 1, got {max_positions}.")
+        if max_positions < n_min:
+            raise ValueError(
+                f"max_positions={max_positions} cannot be fully invested with at most "
+                f"{max_weight_per_asset:.1%} per asset (needs at least {n_min} positions)."
+            )
+    if not 0 <= min_position_weight <= max_weight_per_asset:
+        raise ValueError(
+            f"min_position_weight must be between 0 and max_weight_per_asset "
+            f"({max_weight_per_asset:.1%}), got {min_position_weight}."
+        )
+
+    def solve_on(keep, start):
+        pos = assets.get_indexer(keep)
+        sub_moments = None if moments is None else (moments[0][pos], moments[1][np.ix_(pos, pos)])
+        sub_scenarios = None if scenarios is None else np.asarray(scenarios, dtype=float)[:, pos]
+        return solve(estimation_window[keep], sub_moments, sub_scenarios, start)
+
+    w = solve_on(assets, initial_weights)
+
+    while True:
+        held = w[w > HELD_WEIGHT_TOL].sort_values(ascending=False)
+        n_held = len(held)
+        n_small = int((held < min_position_weight).sum())
+        if (max_positions is None or n_held <= max_positions) and n_small == 0:
+            break
+
+        # target size for this step: drop the small positions and the excess
+        # over max_positions, but at most half of the portfolio at once
+        n_target = n_held - n_small
+        if max_positions is not None:
+            n_target = min(n_target, max_positions)
+        n_keep = max(n_target, (n_held + 1) // 2, n_min)
+        if n_keep >= n_held:
+            raise ValueError(
+                f"Cannot reduce the portfolio below {n_held} positions with weights of at least "
+                f"{min_position_weight:.2%} under the current constraints."
+            )
+
+        while True:
+            keep = held.index[:n_keep]
+            try:
+                w_keep = solve_on(keep, held.loc[keep] / held.loc[keep].sum())
+                break
+            except ValueError:
+                # constraints infeasible on this subset: keep more assets
+                if n_keep >= n_held - 1:
+                    raise ValueError(
+                        f"No portfolio with at most {n_held - 1} positions satisfies the "
+                        f"constraints (max_positions={max_positions}, "
+                        f"min_position_weight={min_position_weight:.2%})."
+                    )
+                n_keep = (n_keep + n_held) // 2
+
+        w = w_keep.reindex(assets).fillna(0.0)
+
+    w = w.reindex(assets).fillna(0.0)
+    w[w <= HELD_WEIGHT_TOL] = 0.0
+    w = w / w.sum()
+    w.name = "weights_opt"
+    return w
+
+
 def check_sector_constraints_feasibility(assets, metadata_equity, sector_constraints):
     if sector_constraints is None:
         return
@@ -602,6 +1472,175 @@ def check_asset_class_constraints_feasibility(assets, metadata_all, asset_class_
                 )
 
 
+def linear_constraint_rows(assets,
+                           asset_class_for_assets=None,
+                           sector_for_assets=None,
+                           sector_constraints=None,
+                           esg_for_assets=None,
+                           esg_constraints=None,
+                           asset_class_constraints=None):
+    """
+    Sector / ESG / asset-class constraints of markowitz_long_only as linear
+    rows A @ w <= b (sector and ESG shares are relative to the equity weight).
+
+    Returns:
+        A : array (m x n), b : array (m,), labels : list of m group names
+    """
+    assets = list(assets)
+    n = len(assets)
+    rows, rhs, labels = [], [], []
+
+    if asset_class_for_assets is not None:
+        asset_class_for_assets = asset_class_for_assets.reindex(assets)
+        equity_mask = (asset_class_for_assets == 'Equity').astype(float).values
+    else:
+        equity_mask = np.ones(n, dtype=float)
+
+    relative_groups = [
+        ("Sector", sector_for_assets, sector_constraints),
+        ("ESG", esg_for_assets, esg_constraints),
+    ]
+    for group, labels_for_assets, constraints in relative_groups:
+        if labels_for_assets is None or constraints is None:
+            continue
+        labels_for_assets = labels_for_assets.reindex(assets)
+
+        for name, cons in constraints.items():
+            if cons is None:
+                continue
+            mask = (labels_for_assets == name).astype(float).values
+            if mask.sum() == 0:
+                continue
+
+            # share <= cap  =>  mask.w - cap * equity.w <= 0
+            if cons.get('max') is not None:
+                rows.append(mask - float(cons['max']) * equity_mask)
+                rhs.append(0.0)
+                labels.append(f"{group} '{name}' max {float(cons['max']):.0%}")
+
+            # share >= floor  =>  floor * equity.w - mask.w <= 0
+            if cons.get('min') is not None:
+                rows.append(float(cons['min']) * equity_mask - mask)
+                rhs.append(0.0)
+                labels.append(f"{group} '{name}' min {float(cons['min']):.0%}")
+
+    if asset_class_for_assets is not None and asset_class_constraints is not None:
+        for ac_name, cons in asset_class_constraints.items():
+            if cons is None:
+                continue
+            mask = (asset_class_for_assets == ac_name).astype(float).values
+            if mask.sum() == 0:
+                continue
+
+            if cons.get('max') is not None:
+                rows.append(mask)
+                rhs.append(float(cons['max']))
+                labels.append(f"Asset class '{ac_name}' max {float(cons['max']):.0%}")
+
+            if cons.get('min') is not None:
+                rows.append(-mask)
+                rhs.append(-float(cons['min']))
+                labels.append(f"Asset class '{ac_name}' min {float(cons['min']):.0%}")
+
+    A = np.array(rows, dtype=float).reshape(len(rows), n)
+    return A, np.array(rhs, dtype=float), labels
+
+
+def check_constraints_feasibility_lp(assets,
+                                     max_weight_per_asset=0.05,
+                                     asset_class_for_assets=None,
+                                     sector_for_assets=None,
+                                     sector_constraints=None,
+                                     esg_for_assets=None,
+                                     esg_constraints=None,
+                                     asset_class_constraints=None,
+                                     prev_weights=None,
+                                     max_turnover=None):
+    """
+    LP pre-check (scipy linprog / HiGHS) that some long-only portfolio
+    satisfies all constraints together: budget, max weight per asset, sector /
+    ESG / asset-class bounds and, with prev_weights, the turnover cap.
+    Catches interactions the per-group checks miss (e.g. a minimum share
+    larger than the bucket can hold under max_weight_per_asset).
+
+    If the constraints are infeasible, an elastic LP (every constraint may be
+    violated at a cost) finds which constraint groups have to give way, and a
+    ValueError naming them is raised.
+    """
+    assets = list(assets)
+    n = len(assets)
+    if n == 0:
+        raise ValueError("No assets available for the optimization.")
+
+    A, b, labels = linear_constraint_rows(
+        assets,
+        asset_class_for_assets=asset_class_for_assets,
+        sector_for_assets=sector_for_assets,
+        sector_constraints=sector_constraints,
+        esg_for_assets=esg_for_assets,
+        esg_constraints=esg_constraints,
+        asset_class_constraints=asset_class_constraints,
+    )
+    m = len(b)
+
+    # budget: sum w = 1
+    A_eq = np.ones((1, n))
+    b_eq = np.ones(1)
+    eq_labels = [f"Budget (100% invested, at most {max_weight_per_asset:.0%} per asset)"]
+    bounds = [(0.0, max_weight_per_asset)] * n
+
+    # turnover cap with split variables: w - buy + sell = w_prev, 0.5 * sum(buy + sell) <= cap
+    if prev_weights is not None and max_turnover is not None:
+        w_prev = prev_weights.reindex(assets).fillna(0.0).to_numpy(dtype=float)
+        cap = max(float(max_turnover), 0.5 * max(1.0 - w_prev.sum(), 0.0) + 1e-9)
+        eye = np.eye(n)
+        A = np.hstack([A, np.zeros((m, 2 * n))])
+        A = np.vstack([A, np.concatenate([np.zeros(n), 0.5 * np.ones(2 * n)])])
+        b = np.append(b, cap)
+        labels = labels + [f"Turnover cap {float(max_turnover):.0%}"]
+        A_eq = np.vstack([np.hstack([A_eq, np.zeros((1, 2 * n))]), np.hstack([eye, -eye, eye])])
+        b_eq = np.append(b_eq, w_prev)
+        eq_labels = eq_labels + ["Turnover cap (holdings)"] * n
+        bounds = bounds + [(0.0, None)] * (2 * n)
+        m += 1
+
+    n_vars = A_eq.shape[1]
+    A_ub = A if m else None
+    b_ub = b if m else None
+
+    res = linprog(np.zeros(n_vars), A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq,
+                  bounds=bounds, method="highs")
+    if res.status == 0:
+        return
+    if res.status != 2:
+        # iteration limit / numerical trouble: leave the verdict to the optimizer
+        return
+
+    # ---- Elastic LP: minimize total violation to find the binding groups ----
+    n_eq = len(b_eq)
+    c = np.concatenate([np.zeros(n_vars), np.ones(m + 2 * n_eq)])
+    A_ub_el = np.hstack([A, -np.eye(m), np.zeros((m, 2 * n_eq))]) if m else None
+    A_eq_el = np.hstack([A_eq, np.zeros((n_eq, m)), np.eye(n_eq), -np.eye(n_eq)])
+    bounds_el = bounds + [(0.0, None)] * (m + 2 * n_eq)
+
+    el = linprog(c, A_ub=A_ub_el, b_ub=b_ub, A_eq=A_eq_el, b_eq=b_eq,
+                 bounds=bounds_el, method="highs")
+
+    if el.status != 0:
+        raise ValueError("The constraints cannot be satisfied together.")
+
+    slack_ub = el.x[n_vars:n_vars + m]
+    slack_eq = el.x[n_vars + m:n_vars + m + n_eq] + el.x[n_vars + m + n_eq:]
+
+    violated = {}
+    for label, v in zip(labels + eq_labels, np.concatenate([slack_ub, slack_eq])):
+        if v > 1e-7:
+            violated[label] = violated.get(label, 0.0) + v
+
+    details = ", ".join(f"{k} (short by {v:.1%})" for k, v in violated.items())
+    raise ValueError(f"The constraints cannot be satisfied together; binding: {details}.")
+
+
 def validate_constraints(
     sector_constraints: dict | None,
     esg_constraints: dict | None,
@@ -676,6 +1715,148 @@ def validate_constraints(
     return errors
 
 
+def compute_backtest_stats_matrix(returns,
+                                  index=None,
+                                  names=None,
+                                  periods_per_year: int = 12,
+                                  rf_annual: float = 0.0) -> pd.DataFrame:
+    """
+    Vectorized performance statistics for many return series at once
+    (portfolio, gross portfolio, benchmarks, scenarios of a sweep, ...).
+
+    returns : DataFrame (rows = periods, columns = series) or 2-D array T x N.
+              NaNs are treated as missing observations (e.g. a benchmark that
+              starts later); they are skipped exactly like r.dropna() would.
+    index : period labels of the rows (only needed if `returns` is an array)
+    names : series names (only needed if `returns` is an array)
+    periods_per_year : 12 for monthly returns
+    rf_annual : annual risk-free rate used in Sharpe / Sortino
+
+    Returns:
+        DataFrame indexed by series name with the columns of
+        compute_backtest_stats plus 'sharpe_ratio', 'sortino_ratio',
+        'calmar_ratio' and 'n_periods'.
+    """
+
+    if isinstance(returns, pd.DataFrame):
+        index = returns.index if index is None else index
+        names = list(returns.columns) if names is None else names
+        R = returns.to_numpy(dtype=float)
+    else:
+        R = np.asarray(returns, dtype=float)
+        if R.ndim == 1:
+            R = R[:, None]
+
+    T, N = R.shape
+    if index is None:
+        index = pd.RangeIndex(T)
+    if names is None:
+        names = list(range(N))
+
+    columns = ["annualised_avg_return", "annualised_volatility", "annualised_cum_return",
+               "min_monthly_return", "max_monthly_return",
+               "max_drawdown", "max_drawdown_start", "max_drawdown_end",
+               "max_drawdown_duration_months",
+               "sharpe_ratio", "sortino_ratio", "calmar_ratio", "n_periods"]
+
+    if T == 0 or N == 0:
+        return pd.DataFrame(columns=columns, index=pd.Index(names))
+
+    valid = ~np.isnan(R)
+    n = valid.sum(axis=0)                        # observations per series
+    n_safe = np.where(n > 0, n, 1)
+    R0 = np.where(valid, R, 0.0)                 # missing -> 0 return (wealth unchanged)
+
+    # --- Annualised average return (arithmetic) ---
+    avg_m = R0.sum(axis=0) / n_safe
+    avg_y = avg_m * periods_per_year
+
+    # --- Annualised volatility (ddof=1) ---
+    dev = np.where(valid, R - avg_m, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vol_m = np.sqrt((dev ** 2).sum(axis=0) / (n - 1))
+    vol_y = vol_m * np.sqrt(periods_per_year)
+
+    # --- Min / max period return ---
+    min_ret = np.where(valid, R, np.inf).min(axis=0)
+    max_ret = np.where(valid, R, -np.inf).max(axis=0)
+
+    # --- Wealth paths, annualised cumulative return (geometric) ---
+    wealth = np.cumprod(1.0 + R0, axis=0)
+    total_return = wealth[-1] - 1.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ann_cum = (1.0 + total_return) ** (periods_per_year / n_safe) - 1.0
+
+    # --- Drawdowns ---
+    # rows before a series' first observation do not count as peaks
+    started = np.logical_or.accumulate(valid, axis=0)
+    wealth_obs = np.where(started, wealth, 0.0)
+    running_max = np.maximum.accumulate(wealth_obs, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drawdown = np.where(started, (running_max - wealth) / running_max, 0.0)
+
+    max_dd = drawdown.max(axis=0)
+    dd_end_pos = drawdown.argmax(axis=0)         # first occurrence, like idxmax
+
+    # position of the latest *strict* new high -> first time the peak was reached
+    prev_max = np.vstack([np.zeros((1, N)), running_max[:-1]])
+    is_new_high = wealth_obs > prev_max
+    peak_pos = np.maximum.accumulate(
+        np.where(is_new_high, np.arange(T)[:, None], 0), axis=0
+    )
+    cols = np.arange(N)
+    dd_start_pos = peak_pos[dd_end_pos, cols]
+
+    # duration = number of observed periods between peak and trough
+    obs_count = np.cumsum(valid, axis=0)
+    dd_duration = obs_count[dd_end_pos, cols] - obs_count[dd_start_pos, cols]
+
+    first_pos = valid.argmax(axis=0)
+    no_dd = ~(max_dd > 0)
+    dd_start_pos = np.where(no_dd, first_pos, dd_start_pos)
+    dd_end_pos = np.where(no_dd, first_pos, dd_end_pos)
+    dd_duration = np.where(no_dd, 0, dd_duration)
+
+    # --- Risk-adjusted ratios ---
+    rf_m = rf_annual / periods_per_year
+    downside = np.where(valid, np.minimum(R - rf_m, 0.0), 0.0)
+    downside_dev_y = np.sqrt((downside ** 2).sum(axis=0) / n_safe) * np.sqrt(periods_per_year)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe = np.where(vol_y > 0, (avg_y - rf_annual) / vol_y, np.nan)
+        sortino = np.where(downside_dev_y > 0, (avg_y - rf_annual) / downside_dev_y, np.nan)
+        calmar = np.where(max_dd > 0, ann_cum / max_dd, np.nan)
+
+    # Convert dates to Timestamp for display (nice in Streamlit)
+    if isinstance(index, pd.PeriodIndex):
+        dates = index.to_timestamp()
+    elif isinstance(index, pd.DatetimeIndex):
+        dates = index
+    else:
+        dates = pd.Index(index)
+
+    results = pd.DataFrame({
+        "annualised_avg_return": avg_y,
+        "annualised_volatility": vol_y,
+        "annualised_cum_return": ann_cum,
+        "min_monthly_return": min_ret,
+        "max_monthly_return": max_ret,
+        "max_drawdown": max_dd,
+        "max_drawdown_start": dates[dd_start_pos],
+        "max_drawdown_end": dates[dd_end_pos],
+        "max_drawdown_duration_months": dd_duration.astype(int),
+        "sharpe_ratio": sharpe,
+        "sortino_ratio": sortino,
+        "calmar_ratio": calmar,
+        "n_periods": n.astype(int),
+    }, index=pd.Index(names))
+
+    # series without a single observation carry no statistics
+    results.loc[n == 0, [c for c in columns if c != "n_periods"]] = np.nan
+
+    return results
+
+
 def compute_backtest_stats(perf: pd.DataFrame) -> dict:
     """
     Compute key performance statistics from the backtest result `perf`.
@@ -687,66 +1868,186 @@ def compute_backtest_stats(perf: pd.DataFrame) -> dict:
     if perf.empty or "Rp" not in perf.columns:
         return {}
 
-    r = perf["Rp"].dropna().copy()
+    r = perf["Rp"].dropna()
 
     if r.empty:
         return {}
 
-    # --- Annualised average return (arithmetic) ---
-    avg_return_m = r.mean()
-    avg_return_y = avg_return_m * 12.0
+    stats = compute_backtest_stats_matrix(r.to_frame()).iloc[0].to_dict()
+    stats["max_drawdown_duration_months"] = int(stats["max_drawdown_duration_months"])
+    stats["n_periods"] = int(stats["n_periods"])
 
-    # --- Annualised volatility ---
-    vol_m = r.std(ddof=1)
-    vol_y = vol_m * np.sqrt(12.0)
+    return stats
 
-    # --- Annualised cumulative return (geometric) ---
-    T = len(r)
-    total_return = (1.0 + r).prod() - 1.0
-    annualised_cum_return = (1.0 + total_return) ** (12.0 / T) - 1.0
+def _rolling_window_sum(X, window):
+    """
+    Trailing sums over `window` rows of a T x N array via one cumulative sum:
+    S_t = C_t - C_{t-window}. NaN for the first window-1 rows.
+    """
+    T = X.shape[0]
+    out = np.full(X.shape, np.nan, dtype=float)
+    if window > T:
+        return out
+    C = np.cumsum(X, axis=0)
+    out[window - 1] = C[window - 1]
+    out[window:] = C[window:] - C[:-window]
+    return out
 
-    # --- Min / max monthly return ---
-    min_return = r.min()
-    max_return = r.max()
 
-    # --- Max drawdown, start, end, duration ---
-    wealth = (1.0 + r).cumprod()
-    running_max = wealth.cummax()
-    drawdown = (running_max - wealth) / running_max  # 0 … +X%
+def brinson_attribution(weights, benchmark_weights, asset_returns, groups):
+    """
+    Brinson-Hood-Beebower attribution of one holding period.
 
-    max_dd = drawdown.max()
+    weights, benchmark_weights : start-of-period weights (pd.Series by asset ID;
+                                 assets missing from one of them count as 0)
+    asset_returns : pd.Series of buy-and-hold returns of the assets over the period
+    groups : pd.Series asset ID -> group label (NaN = 'Unclassified')
 
-    if pd.isna(max_dd) or max_dd == 0:
-        # no drawdown
-        dd_end = dd_start = r.index[0]
-        dd_duration = 0
-    else:
-        dd_end = drawdown.idxmax()                      # period of worst drawdown
-        dd_start = wealth.loc[:dd_end].idxmax()         # previous peak
-        # duration in months = number of periods between start and end
-        dd_duration = len(wealth.loc[dd_start:dd_end]) - 1
+    Within a group held by the portfolio, the portfolio return is the
+    weighted return of its holdings; in a group it does not hold, it is set
+    to the benchmark return (no selection effect). The effects of all groups
+    add up to portfolio minus benchmark return.
 
-    # Convert dates to Timestamp for display (nice in Streamlit)
-    def to_ts(idx):
-        if isinstance(idx, pd.Period):
-            return idx.to_timestamp()
-        return pd.to_datetime(idx)
+    Returns:
+        DataFrame indexed by group with columns
+            'Portfolio_Weight', 'Benchmark_Weight', 'Portfolio_Return',
+            'Benchmark_Return', 'Allocation', 'Selection', 'Interaction', 'Total'
+    """
+    assets = asset_returns.index
+    wp = weights.reindex(assets).fillna(0.0).to_numpy(dtype=float)
+    wb = benchmark_weights.reindex(assets).fillna(0.0).to_numpy(dtype=float)
+    r = asset_returns.to_numpy(dtype=float)
+    labels = groups.reindex(assets).fillna("Unclassified").to_numpy(dtype=object)
+
+    frame = pd.DataFrame({"wp": wp, "wb": wb, "cp": wp * r, "cb": wb * r}, index=assets)
+    g = frame.groupby(labels, sort=True).sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rb_g = np.where(g["wb"] > 0, g["cb"] / g["wb"], 0.0)
+        Rp_g = np.where(g["wp"] > 0, g["cp"] / g["wp"], Rb_g)
+
+    Rb = float(g["cb"].sum())
+    allocation = (g["wp"] - g["wb"]) * (Rb_g - Rb)
+    selection = g["wb"] * (Rp_g - Rb_g)
+    interaction = (g["wp"] - g["wb"]) * (Rp_g - Rb_g)
+
+    return pd.DataFrame({
+        "Portfolio_Weight": g["wp"],
+        "Benchmark_Weight": g["wb"],
+        "Portfolio_Return": Rp_g,
+        "Benchmark_Return": Rb_g,
+        "Allocation": allocation,
+        "Selection": selection,
+        "Interaction": interaction,
+        "Total": allocation + selection + interaction,
+    }, index=g.index)
+
+
+def compute_rolling_analytics(perf: pd.DataFrame,
+                              benchmarks: pd.DataFrame = None,
+                              windows=(12, 36),
+                              periods_per_year: int = 12,
+                              rf_annual: float = 0.0) -> dict:
+    """
+    Rolling risk analytics of the backtest, computed in O(T) per window with
+    cumulative-sum recurrences (no .rolling().apply).
 
+    perf : backtest output with column 'Rp' (net monthly returns)
+    benchmarks : DataFrame of benchmark returns (e.g. data["benchmarks"]),
+                 reindexed on perf.index
+    windows : rolling window lengths in months
 
+    Returns:
+        dict window -> DataFrame indexed like perf, with columns
+            'Volatility', 'Sharpe' (annualised) and, for every benchmark B,
+            'Beta vs B', 'Tracking error vs B' (annualised) and 'Correlation vs B'.
+        A window is NaN until it holds `window` valid observations.
+    """
 
-    results = {
-        "annualised_avg_return": avg_return_y,
-        "annualised_volatility": vol_y,
-        "annualised_cum_return": annualised_cum_return,
-        "min_monthly_return": min_return,
-        "max_monthly_return": max_return,
-        "max_drawdown": max_dd,
-        "max_drawdown_start": to_ts(dd_start),
-        "max_drawdown_end": to_ts(dd_end),
-        "max_drawdown_duration_months": int(dd_duration),
-    }
+    if perf.empty or "Rp" not in perf.columns:
+        return {}
+
+    r = perf["Rp"].to_numpy(dtype=float)
+    valid_r = ~np.isnan(r)
+    r0 = np.where(valid_r, r, 0.0)
+
+    if benchmarks is not None and not benchmarks.empty:
+        bench = benchmarks.reindex(perf.index)
+        B = bench.to_numpy(dtype=float)
+        bench_names = list(bench.columns)
+    else:
+        B = np.empty((len(r), 0))
+        bench_names = []
+
+    valid_b = ~np.isnan(B) & valid_r[:, None]
+    B0 = np.where(valid_b, B, 0.0)
+    rb0 = np.where(valid_b, r0[:, None], 0.0)  # portfolio return on rows where the benchmark exists
+
+    rf_m = rf_annual / periods_per_year
+    ann = np.sqrt(periods_per_year)
+
+    # all first and second moments needed by every metric, stacked column-wise
+    stacked = np.column_stack([
+        valid_r, r0, r0 ** 2,                  # portfolio alone
+        valid_b, rb0, rb0 ** 2, B0, B0 ** 2, rb0 * B0,  # portfolio vs each benchmark
+    ]).astype(float)
+
+    k = len(bench_names)
+    out = {}
+
+    for w in windows:
+        S = _rolling_window_sum(stacked, w)
+
+        n_r, s_r, s_rr = S[:, 0], S[:, 1], S[:, 2]
+        n_b = S[:, 3:3 + k]
+        s_x = S[:, 3 + k:3 + 2 * k]
+        s_xx = S[:, 3 + 2 * k:3 + 3 * k]
+        s_y = S[:, 3 + 3 * k:3 + 4 * k]
+        s_yy = S[:, 3 + 4 * k:3 + 5 * k]
+        s_xy = S[:, 3 + 5 * k:3 + 6 * k]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            full_r = n_r == w
+            mean_r = s_r / w
+            var_r = np.maximum(s_rr - w * mean_r ** 2, 0.0) / (w - 1)
+            vol_y = np.where(full_r, np.sqrt(var_r) * ann, np.nan)
+            sharpe = np.where(full_r & (vol_y > 0),
+                              (mean_r - rf_m) * periods_per_year / vol_y, np.nan)
+
+            frame = pd.DataFrame({"Volatility": vol_y, "Sharpe": sharpe}, index=perf.index)
+
+            full_b = n_b == w
+            cov_xy = (s_xy - s_x * s_y / w) / (w - 1)
+            var_x = np.maximum(s_xx - s_x ** 2 / w, 0.0) / (w - 1)
+            var_y = np.maximum(s_yy - s_y ** 2 / w, 0.0) / (w - 1)
+            # active return a = r - b: Var(a) = Var(r) + Var(b) - 2 Cov(r, b)
+            var_active = np.maximum(var_x + var_y - 2.0 * cov_xy, 0.0)
+
+            beta = np.where(full_b & (var_y > 0), cov_xy / var_y, np.nan)
+            te = np.where(full_b, np.sqrt(var_active) * ann, np.nan)
+            corr = np.where(full_b & (var_x > 0) & (var_y > 0),
+                            cov_xy / np.sqrt(var_x * var_y), np.nan)
+
+        for j, name in enumerate(bench_names):
+            frame[f"Beta vs {name}"] = beta[:, j]
+            frame[f"Tracking error vs {name}"] = te[:, j]
+            frame[f"Correlation vs {name}"] = corr[:, j]
+
+        out[w] = frame
+
+    return out
+
+
+# Management fee schedule: (wealth strictly below this bound, annual fee)
+MGMT_FEE_TIERS = [
+    (10_000_000, 0.005),     # below 10m (also below the 1m min ticket)
+    (20_000_000, 0.0045),
+    (30_000_000, 0.0040),
+    (50_000_000, 0.0035),
+    (100_000_000, 0.003),
+    (np.inf, 0.0025),
+]
 
-    return results
 
 def management_fee_from_wealth(initial_wealth: float) -> float:
     """
@@ -764,22 +2065,116 @@ def management_fee_from_wealth(initial_wealth: float) -> float:
 
     w = float(initial_wealth)
 
-    if w < 1_000_000:
-        # below min ticket, still charge 0.50% for simplicity
-        return 0.005
-
-    if w < 10_000_000:
-        return 0.005  # 0.50%
-    elif w < 20_000_000:
-        return 0.0045  # 0.45%
-    elif w < 30_000_000:
-        return 0.0040  # 0.40%
-    elif w < 50_000_000:
-        return 0.0035  # 0.35%
-    elif w < 100_000_000:
-        return 0.003  # 0.30%
+    # below min ticket, still charge 0.50% for simplicity
+    for bound, fee in MGMT_FEE_TIERS:
+        if w < bound:
+            return fee
+
+    return MGMT_FEE_TIERS[-1][1]
+
+
+def management_fee_from_wealth_array(wealth) -> np.ndarray:
+    """
+    Vectorized management_fee_from_wealth: annual fee for every entry of `wealth`.
+    """
+    bounds = np.array([bound for bound, _ in MGMT_FEE_TIERS[:-1]], dtype=float)
+    fees = np.array([fee for _, fee in MGMT_FEE_TIERS], dtype=float)
+    return fees[np.searchsorted(bounds, np.asarray(wealth, dtype=float), side="right")]
+
+
+def _simulation_weights(weights: pd.Series, assets) -> np.ndarray:
+    """
+    Portfolio weights on `assets` (missing = 0), rescaled to sum to one.
+    """
+    w = weights.reindex(assets).fillna(0.0).to_numpy(dtype=float)
+    if w.sum() <= 0:
+        raise ValueError("simulate_portfolio_wealth: no portfolio weight on the estimation window assets.")
+    return w / w.sum()
+
+
+def simulate_portfolio_wealth(weights: pd.Series,
+                              estimation_window: pd.DataFrame,
+                              horizon_months: int,
+                              initial_wealth: float,
+                              n_paths: int = 10_000,
+                              method: str = "normal",
+                              block_size: int = 6,
+                              quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+                              seed=None,
+                              mu: pd.Series = None,
+                              sigma: pd.DataFrame = None) -> dict:
+    """
+    Monte Carlo distribution of wealth over the horizon for a fixed portfolio.
+
+    The portfolio is assumed to be rebalanced back to `weights` every month,
+    so its return is w'r: each path only needs a scalar return per month,
+    drawn either from N(w'mu, w'Sigma w) with the monthly `mu` / `sigma`
+    the portfolio was optimized with (run_today_optimization's
+    'monthly_moments') ('normal'), or by block-bootstrapping the historical
+    monthly portfolio returns of `estimation_window` ('bootstrap').
+    All paths are simulated at once (n_paths x horizon_months arrays).
+
+    The management fee follows MGMT_FEE_TIERS on each path's current
+    wealth and is charged monthly, as in run_backtest.
+
+    Returns a dict with:
+        - 'quantiles' : DataFrame, index = month 0..horizon, columns = quantile levels
+        - 'final_wealth' : array of terminal wealth per path
+        - 'expected_final_wealth', 'prob_loss' : floats
+        - 'mu_p', 'sigma_p' : monthly mean / vol of the portfolio return
+    """
+
+    if horizon_months <= 0:
+        raise ValueError(f"simulate_portfolio_wealth: horizon_months must be positive, got {horizon_months}.")
+
+    rng = np.random.default_rng(seed)
+
+    # ---------- Monthly portfolio returns, n_paths x horizon ----------
+    if method == "normal":
+        if mu is None or sigma is None:
+            raise ValueError("simulate_portfolio_wealth: method='normal' needs the estimated mu and sigma.")
+        w = _simulation_weights(weights, mu.index)
+        sigma_w = sigma.reindex(index=mu.index, columns=mu.index).to_numpy(dtype=float)
+        mu_p = float(w @ mu.to_numpy(dtype=float))
+        sigma_p = float(np.sqrt(max(w @ sigma_w @ w, 0.0)))
+        R = mu_p + sigma_p * rng.standard_normal((n_paths, horizon_months))
+
+    elif method == "bootstrap":
+        w = _simulation_weights(weights, estimation_window.columns)
+        hist = estimation_window.to_numpy(dtype=float) @ w
+        T = len(hist)
+        b = max(1, min(int(block_size), T))
+        n_blocks = -(-horizon_months // b)  # ceil
+        starts = rng.integers(0, T - b + 1, size=(n_paths, n_blocks))
+        idx = (starts[:, :, None] + np.arange(b)).reshape(n_paths, n_blocks * b)[:, :horizon_months]
+        R = hist[idx]
+        mu_p = float(hist.mean())
+        sigma_p = float(hist.std(ddof=1)) if T > 1 else 0.0
+
     else:
-        return 0.0025  # 0.25%
+        raise ValueError(f"Unknown simulation method: {method}")
+
+    # ---------- Wealth recursion with wealth-dependent fee ----------
+    W = np.empty((n_paths, horizon_months + 1))
+    W[:, 0] = initial_wealth
+    for t in range(horizon_months):
+        fee_m = management_fee_from_wealth_array(W[:, t]) / 12.0
+        W[:, t + 1] = W[:, t] * (1.0 + R[:, t]) * (1.0 - fee_m)
+
+    q = np.quantile(W, quantiles, axis=0)  # len(quantiles) x (horizon + 1)
+    quantile_df = pd.DataFrame(q.T, index=pd.RangeIndex(horizon_months + 1, name="Month"),
+                               columns=list(quantiles))
+
+    final_wealth = W[:, -1]
+
+    return {
+        "quantiles": quantile_df,
+        "final_wealth": final_wealth,
+        "expected_final_wealth": float(final_wealth.mean()),
+        "prob_loss": float((final_wealth < initial_wealth).mean()),
+        "mu_p": mu_p,
+        "sigma_p": sigma_p,
+    }
 
 
 def build_backtest_context_text(
@@ -881,3 +2276,98 @@ def build_backtest_context_text(
         """.strip()
 
     return context
+
+
+def commentary_cache_key(context_text, system_prompt, model=None):
+    """
+    Fingerprint of one LLM commentary request.
+
+    build_backtest_context_text is deterministic, so two identical backtests
+    (same stats + same client configuration) give the same key, whoever runs them.
+    """
+    h = hashlib.sha256()
+    for part in (model or "", system_prompt, context_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")  # separator, so ("ab", "c") != ("a", "bc")
+    return h.hexdigest()
+
+
+def load_cached_commentary(key,
+                           cache_dir=COMMENTARY_CACHE_DIR,
+                           ttl_seconds=COMMENTARY_CACHE_TTL_SECONDS):
+    """
+    Return the cached commentary for `key`, or None if missing / expired.
+
+    Expired entries are deleted on read. A hit refreshes the file mtime,
+    so size-based eviction drops the least recently used entries first.
+    """
+    path = os.path.join(cache_dir, f"{key}.json")
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if ttl_seconds is not None and time.time() - entry.get("created", 0) > ttl_seconds:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return entry.get("commentary")
+
+
+def store_cached_commentary(key,
+                            commentary,
+                            cache_dir=COMMENTARY_CACHE_DIR,
+                            max_entries=COMMENTARY_CACHE_MAX_ENTRIES,
+                            max_bytes=COMMENTARY_CACHE_MAX_BYTES):
+    """
+    Persist one commentary under `key`, then evict least recently used
+    entries until the cache holds at most `max_entries` files and `max_bytes`.
+
+    The file is written to a temp name and renamed, so concurrent app
+    processes never read a half-written entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "commentary": commentary}, f)
+    os.replace(tmp_path, path)
+
+    # ---------- Size-based eviction (oldest mtime first) ----------
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".json"):
+            continue
+        try:
+            info = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append((info.st_mtime, info.st_size, name))
+
+    entries.sort()
+    n_files = len(entries)
+    total_bytes = sum(size for _, size, _ in entries)
+
+    for _, size, name in entries:
+        if n_files <= max_entries and total_bytes <= max_bytes:
+            break
+        if name == f"{key}.json":
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        n_files -= 1
+        total_bytes -= size
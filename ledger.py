@@ -0,0 +1,131 @@
+# ledger.py
+"""
+Month-by-month holdings ledger of a backtest, streamed to Parquet.
+
+One row per (month, position):
+    Date             : month of the return (YYYY-MM)
+    Rebalance_Month  : rebalance the position belongs to
+    ID               : asset ID, dictionary-encoded
+    Weight           : weight at the start of the month, after trading
+    Drifted_Weight   : weight at the end of the month, after the month's returns
+    Trade            : weight traded at the start of the month (first month of a
+                       holding period only; positions sold out have Weight 0)
+    Trade_Cost       : trading cost charged by the backtest, as a fraction of
+                       portfolio value (positions leaving the universe are
+                       liquidated at no cost, as in run_backtest)
+
+Each holding period is written as one Parquet row group as soon as it is
+simulated, so the ledger of a long backtest never sits in memory. The file
+is written under a temporary name and renamed when complete.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+LEDGER_SCHEMA = pa.schema([
+    ("Date", pa.string()),
+    ("Rebalance_Month", pa.string()),
+    ("ID", pa.dictionary(pa.int32(), pa.string())),
+    ("Weight", pa.float64()),
+    ("Drifted_Weight", pa.float64()),
+    ("Trade", pa.float64()),
+    ("Trade_Cost", pa.float64()),
+])
+
+# positions whose weight and trade are both below this are not recorded
+LEDGER_MIN_WEIGHT = 1e-6
+
+
+class HoldingsLedger:
+    """
+    Streaming writer of the holdings ledger (use as a context manager).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        self._writer = pq.ParquetWriter(self._tmp_path, LEDGER_SCHEMA, compression="zstd")
+
+    def write_period(self, rebalance_month, dates, ids, weights, drifted_weights, trades, trade_costs):
+        """
+        Append one holding period.
+
+        dates : months of the period (k)
+        ids : asset IDs of the positions (n)
+        weights, drifted_weights : (k x n) start / end of month weights
+        trades, trade_costs : (n) trades and their costs at the start of the period
+        """
+        weights = np.asarray(weights, dtype=float)
+        drifted_weights = np.asarray(drifted_weights, dtype=float)
+        k, n = weights.shape
+
+        trade_rows = np.zeros((k, n))
+        cost_rows = np.zeros((k, n))
+        if k:
+            trade_rows[0] = trades
+            cost_rows[0] = trade_costs
+
+        keep = (np.abs(weights) > LEDGER_MIN_WEIGHT) | (np.abs(trade_rows) > LEDGER_MIN_WEIGHT)
+        month_pos, asset_pos = np.nonzero(keep)
+        month_labels = np.array([str(d) for d in dates], dtype=object)
+        id_dictionary = pa.array([str(i) for i in ids], type=pa.string())
+
+        table = pa.table({
+            "Date": pa.array(month_labels[month_pos], type=pa.string()),
+            "Rebalance_Month": pa.array(np.full(len(month_pos), str(rebalance_month), dtype=object),
+                                        type=pa.string()),
+            "ID": pa.DictionaryArray.from_arrays(pa.array(asset_pos, type=pa.int32()), id_dictionary),
+            "Weight": weights[month_pos, asset_pos],
+            "Drifted_Weight": drifted_weights[month_pos, asset_pos],
+            "Trade": trade_rows[month_pos, asset_pos],
+            "Trade_Cost": cost_rows[month_pos, asset_pos],
+        }, schema=LEDGER_SCHEMA)
+
+        self._writer.write_table(table)
+
+    def close(self):
+        """
+        Finish the file and move it to its final path.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def read_ledger(path, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Read a holdings ledger (optionally only `columns` / row `filters`, see
+    pyarrow.parquet.read_table) with Date / Rebalance_Month as monthly periods
+    and ID as a categorical.
+    """
+    df = pq.read_table(path, columns=columns, filters=filters).to_pandas()
+    for col in ("Date", "Rebalance_Month"):
+        if col in df.columns:
+            df[col] = pd.PeriodIndex(df[col], freq="M")
+    return df
@@ -32,10 +32,8 @@ config = PortfolioConfig(
     },
 )
 
-perf, summary_df, debug_weights_df = run_backtest(config, data)
-
 # Backtest results
-perf, summary_df, debug_weights_df = run_backtest(config, data)
+perf, summary_df, weights_history = run_backtest(config, data)
 
 # Today's portfolio
 today_res = run_today_optimization(config, data)
@@ -48,5 +46,6 @@ alloc_by_ac = today_res["alloc_by_asset_class"]
 print("Top 5 positions:\n", top5_today)
 print("\nAllocation by asset class:\n", alloc_by_ac)
 
+# For many client profiles at once, see batch.py (headless, parallel, resumable).
 # If you want, you can still write to Excel:
 today_df.to_excel("today_portfolio_weights.xlsx", index=False)
@@ -0,0 +1,161 @@
+# returns_store.py
+"""
+On-disk, memory-mapped monthly returns panel for long histories / large universes.
+
+A store is a folder with
+    returns.npy : float64 matrix, rows = months, columns = assets (C order)
+    index.json  : sidecar with the month labels, the asset IDs and the shape
+
+Rows are contiguous on disk, so ReturnsStore.window(start, end, ids) only
+touches the pages of the requested months; run_backtest and
+run_today_optimization accept a ReturnsStore wherever they accept a returns
+DataFrame in data["returns"].
+
+The data plane (data_plane.py) writes one store per monthly panel inside
+the plane folder, so stores follow the source fingerprint of the plane.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+VALUES_NAME = "returns.npy"
+INDEX_NAME = "index.json"
+
+
+def write_returns_store(prices: pd.DataFrame, store_dir, chunk_size=1024, fingerprint=None):
+    """
+    Compute r_t = P_{t+1}/P_t - 1 from a price panel (index = Period[M],
+    columns = asset IDs) straight into a new store, `chunk_size` assets at
+    a time: no full-size intermediate copy of the panel is created.
+
+    fingerprint : source fingerprint the prices were read from, recorded in
+                  the sidecar (see open_returns_stores)
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    T, N = prices.shape
+    n_rows = max(T - 1, 0)
+
+    values = np.lib.format.open_memmap(os.path.join(store_dir, VALUES_NAME), mode="w+",
+                                       dtype=np.float64, shape=(n_rows, N))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for j in range(0, N, chunk_size):
+            p = prices.iloc[:, j:j + chunk_size].to_numpy(dtype=np.float64)
+            out = values[:, j:j + chunk_size]
+            np.divide(p[1:], p[:-1], out=out)
+            out -= 1.0
+
+    values.flush()
+    del values
+
+    sidecar = {
+        "freq": "M",
+        "index": [str(p) for p in prices.index[:n_rows]],
+        "columns": [str(c) for c in prices.columns],
+        "shape": [n_rows, N],
+        "fingerprint": fingerprint,
+    }
+    with open(os.path.join(store_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(sidecar, f)
+
+    return store_dir
+
+
+class ReturnsStore:
+    """
+    Read-only view on a returns store; nothing is loaded until sliced.
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+
+        self.store_dir = store_dir
+        self.index = pd.PeriodIndex(sidecar["index"], freq=sidecar["freq"], name="Date")
+        self.columns = pd.Index(sidecar["columns"])
+        self.fingerprint = sidecar.get("fingerprint")
+        self._values = np.load(os.path.join(store_dir, VALUES_NAME), mmap_mode="r")
+
+        if self._values.shape != tuple(sidecar["shape"]):
+            raise ValueError(
+                f"Returns store {store_dir}: data shape {self._values.shape} "
+                f"does not match its index {tuple(sidecar['shape'])}."
+            )
+
+    @property
+    def shape(self):
+        return self._values.shape
+
+    @property
+    def empty(self):
+        return self._values.size == 0
+
+    def window(self, start=None, end=None, ids=None, rows=None) -> pd.DataFrame:
+        """
+        Returns for months start..end (inclusive, like .loc) and assets `ids`
+        (None = all), as an in-memory DataFrame.
+
+        rows : optional slice of row positions, used instead of start / end
+        """
+        if rows is not None:
+            i0, i1, _ = rows.indices(len(self.index))
+        else:
+            i0 = 0 if start is None else self.index.searchsorted(start, side="left")
+            i1 = len(self.index) if end is None else self.index.searchsorted(end, side="right")
+        rows = self._values[i0:i1]  # still a memmap view
+
+        if ids is None:
+            cols = self.columns
+            block = np.array(rows)
+        else:
+            cols = pd.Index(ids)
+            pos = self.columns.get_indexer(cols)
+            if (pos < 0).any():
+                raise KeyError(f"IDs not in returns store: {list(cols[pos < 0][:20])}")
+            block = rows[:, pos]
+
+        return pd.DataFrame(block, index=self.index[i0:i1], columns=cols)
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.window()
+
+
+def open_returns_stores(data, root, keys=("SP500", "MSCI", "Other"), fingerprint=None):
+    """
+    Copy of a load_all_data() dict whose data["returns"][key] are ReturnsStore
+    objects read from <root>/<fingerprint>/<key>/, written from data["prices"]
+    if missing.
+
+    fingerprint : source fingerprint of `data` (default: data_plane.source_fingerprint()).
+                  Stores are keyed on it, so new source files never reuse
+                  returns written from older prices; a store whose sidecar
+                  records another fingerprint is rewritten.
+    """
+    if fingerprint is None:
+        from data_plane import source_fingerprint
+        fingerprint = source_fingerprint()
+
+    returns = dict(data["returns"])
+
+    for key in keys:
+        store_dir = os.path.join(root, fingerprint, key)
+        sidecar = os.path.join(store_dir, INDEX_NAME)
+        store = ReturnsStore(store_dir) if os.path.exists(sidecar) else None
+        if store is None or store.fingerprint != fingerprint:
+            # write aside and swap in: processes still reading the old
+            # files keep their (unlinked) mapping
+            tmp_dir = store_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            write_returns_store(data["prices"][key], tmp_dir, fingerprint=fingerprint)
+            shutil.rmtree(store_dir, ignore_errors=True)
+            os.rename(tmp_dir, store_dir)
+            store = ReturnsStore(store_dir)
+        returns[key] = store
+
+    out = dict(data)
+    out["returns"] = returns
+    return out
@@ -0,0 +1,279 @@
+# service.py
+"""
+Local optimization service with a warm data process.
+
+    python service.py --port 8765 --workers 4
+
+The data is published once as a memory-mapped data plane (data_plane.py)
+that every worker of a process pool attaches, and a small asyncio HTTP
+front end dispatches requests to the pool:
+
+    GET  /health    -> {"status": "ok", "workers": n}
+    POST /backtest  -> run_backtest(config)            (body = PortfolioConfig spec)
+    POST /today     -> run_today_optimization(config)  (body = PortfolioConfig spec)
+
+The body uses the same spec format as batch.py. Identical requests that
+arrive while one is already running are coalesced: they all wait for the
+same computation. ServiceClient is a small stdlib client for UIs / scripts.
+"""
+import argparse
+import asyncio
+import json
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+import pandas as pd
+
+from batch import config_from_spec
+from data_plane import attach_data, ensure_data_plane
+from engine import run_backtest, run_today_optimization
+
+MAX_BODY_BYTES = 1024 * 1024
+
+# data dict of the worker process (set once by _init_worker)
+_WORKER_DATA = None
+
+
+def _init_worker(data_source):
+    """
+    data_source: path of a published data plane (attached zero-copy),
+    or the data dict itself.
+    """
+    global _WORKER_DATA
+    _WORKER_DATA = attach_data(data_source) if isinstance(data_source, str) else data_source
+
+
+def _ping():
+    return True
+
+
+# -------------------- (De)serialization of results --------------------
+def frame_to_json(df):
+    """
+    DataFrame -> JSON-friendly dict (orient='split'); Periods become strings.
+    """
+    df = df.copy()
+    if isinstance(df.index, pd.PeriodIndex):
+        df.index = df.index.astype(str)
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.PeriodDtype):
+            df[c] = df[c].astype(str)
+    return json.loads(df.to_json(orient="split", date_format="iso"))
+
+
+def frame_from_json(payload):
+    return pd.read_json(StringIO(json.dumps(payload)), orient="split")
+
+
+def _series_to_json(s):
+    return {str(k): float(v) for k, v in s.items()}
+
+
+def _task_backtest(spec):
+    config = config_from_spec(spec)
+    perf, summary_df, weights_history = run_backtest(config, _WORKER_DATA)
+    return {
+        "perf": frame_to_json(perf),
+        "summary_df": frame_to_json(summary_df),
+        "debug_weights_df": frame_to_json(weights_history.to_frame()),
+    }
+
+
+def _task_today(spec):
+    config = config_from_spec(spec)
+    res = run_today_optimization(config, _WORKER_DATA)
+    return {
+        "candidates_period": str(res["candidates_period"]),
+        "weights": frame_to_json(res["weights"]),
+        "top5": frame_to_json(res["top5"]),
+        "alloc_by_asset_class": _series_to_json(res["alloc_by_asset_class"]),
+        "sector_in_equity": _series_to_json(res["sector_in_equity"]),
+        "esg_in_equity": _series_to_json(res["esg_in_equity"]),
+        "within_non_equity_classes": {
+            ac: _series_to_json(s) for ac, s in res["within_non_equity_classes"].items()
+        },
+    }
+
+
+TASKS = {
+    "/backtest": _task_backtest,
+    "/today": _task_today,
+}
+
+
+# -------------------- Async front end --------------------
+class OptimizationService:
+    """
+    asyncio HTTP server in front of a process pool holding the data.
+    """
+
+    def __init__(self, data_source, workers=2):
+        # data_source: data plane path (preferred) or a data dict
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=_init_worker,
+                                        initargs=(data_source,))
+        self.in_flight = {}  # request key -> asyncio.Future (request coalescing)
+        self.n_computed = 0
+        self.n_coalesced = 0
+
+    async def warm_up(self):
+        """Start every worker now, so the first requests don't pay the data transfer."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)])
+
+    async def compute(self, path, spec):
+        key = path + "|" + json.dumps(spec, sort_keys=True, default=str)
+
+        fut = self.in_flight.get(key)
+        if fut is not None:
+            self.n_coalesced += 1
+            return await asyncio.shield(fut)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.pool, TASKS[path], spec)
+        self.in_flight[key] = fut
+        try:
+            result = await asyncio.shield(fut)
+            self.n_computed += 1
+            return result
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(" ", 2)
+
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                await self._respond(writer, 413, {"error": "Request body too large."})
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            if method == "GET" and path == "/health":
+                await self._respond(writer, 200, {
+                    "status": "ok",
+                    "workers": self.workers,
+                    "computed": self.n_computed,
+                    "coalesced": self.n_coalesced,
+                })
+            elif method == "POST" and path in TASKS:
+                try:
+                    spec = json.loads(body or b"{}")
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Body is not valid JSON."})
+                    return
+                try:
+                    result = await self.compute(path, spec)
+                except ValueError as e:
+                    # infeasible constraints, unknown fields, ... -> client error
+                    await self._respond(writer, 422, {"error": str(e)})
+                    return
+                await self._respond(writer, 200, result)
+            else:
+                await self._respond(writer, 404, {"error": f"No route for {method} {path}"})
+
+        except Exception as e:
+            await self._respond(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                   422: "Unprocessable Entity", 500: "Internal Server Error"}
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        await self.warm_up()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Optimization service listening on http://{host}:{port} ({self.workers} workers)")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+# -------------------- Client --------------------
+class ServiceClient:
+    """
+    Minimal client: results come back with the same DataFrames as the engine.
+    """
+
+    def __init__(self, base_url="http://127.0.0.1:8765", timeout=600):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, spec=None):
+        data = None if spec is None else json.dumps(spec, default=str).encode("utf-8")
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            payload = json.loads(e.read() or b"{}")
+            raise ValueError(payload.get("error", f"HTTP {e.code}")) from None
+
+    def health(self):
+        return self._request("/health")
+
+    def run_backtest(self, spec):
+        res = self._request("/backtest", spec)
+        perf = frame_from_json(res["perf"])
+        if not perf.empty:
+            perf.index = pd.PeriodIndex(perf.index, freq="M", name="Date")
+        return perf, frame_from_json(res["summary_df"]), frame_from_json(res["debug_weights_df"])
+
+    def run_today_optimization(self, spec):
+        res = self._request("/today", spec)
+        for k in ("weights", "top5"):
+            res[k] = frame_from_json(res[k])
+        for k in ("alloc_by_asset_class", "sector_in_equity", "esg_in_equity"):
+            res[k] = pd.Series(res[k], dtype=float)
+        res["within_non_equity_classes"] = {
+            ac: pd.Series(v, dtype=float) for ac, v in res["within_non_equity_classes"].items()
+        }
+        return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local optimization service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    service = OptimizationService(ensure_data_plane(), workers=args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
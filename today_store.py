@@ -0,0 +1,202 @@
+# today_store.py
+"""
+Precomputed "today's portfolio" for every questionnaire gamma.
+
+The questionnaire maps its score to one of 41 gammas (engine.QUESTIONNAIRE_GAMMAS),
+so for a given configuration all possible answers can be solved in advance
+(run_today_optimization_path, warm-started along the gamma path) and served
+instantly. Results are stored in <store_dir>/<key>.pkl, where the key covers
+the PortfolioConfig fields today's optimization reads (TODAY_FIELDS: not
+gamma, nor the backtest-only horizon / rebalancing / cost / turnover
+settings), plus the version of the source data.
+
+    python today_store.py              # precompute the default configurations
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import pandas as pd
+
+from data_plane import get_shared_data, source_fingerprint
+from engine import PortfolioConfig, QUESTIONNAIRE_GAMMAS, run_today_optimization_path
+
+TODAY_STORE_DIR = os.path.join(".cache", "today_portfolios")
+
+# keys being computed by a background thread of this process
+_IN_PROGRESS = set()
+_IN_PROGRESS_LOCK = threading.Lock()
+
+# PortfolioConfig fields read by engine._prepare_today / _solve_today
+TODAY_FIELDS = (
+    "est_months", "estimation_frequency", "universe_choice",
+    "keep_sectors", "keep_esg", "selected_asset_classes_other", "keep_ids_by_class",
+    "max_weight_per_asset", "sector_constraints", "esg_constraints", "asset_class_constraints",
+    "allocator", "cvar_alpha", "cvar_scenarios",
+    "mean_estimator", "mean_halflife_months", "bl_risk_aversion", "bl_tau",
+    "covariance_estimator", "covariance_halflife_months",
+    "max_positions", "min_position_weight",
+)
+
+# bumped when the stored result dicts change (e.g. new keys read by the app)
+TODAY_STORE_FORMAT = 2
+
+# fields where an empty value means the same as None
+_EMPTY_IS_NONE = ("keep_sectors", "keep_esg", "keep_ids_by_class",
+                  "sector_constraints", "esg_constraints", "asset_class_constraints")
+
+
+def today_store_key(config: PortfolioConfig, data_version=None):
+    """
+    Hash of the TODAY_FIELDS of the configuration, and of the data version
+    (default: fingerprint of the source workbooks). Configurations that only
+    differ in gamma or in backtest settings share a key.
+    """
+    spec = {name: getattr(config, name) for name in TODAY_FIELDS}
+    for name in _EMPTY_IS_NONE:
+        if not spec[name]:
+            spec[name] = None
+    spec["format"] = TODAY_STORE_FORMAT
+    spec["data_version"] = source_fingerprint() if data_version is None else data_version
+    payload = json.dumps(spec, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:20]
+
+
+def load_today_results(config: PortfolioConfig, store_dir=TODAY_STORE_DIR, data_version=None):
+    """
+    All precomputed results for this configuration ({gamma: result}), or None.
+    """
+    path = os.path.join(store_dir, today_store_key(config, data_version) + ".pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def lookup_today(config: PortfolioConfig, store_dir=TODAY_STORE_DIR, data_version=None):
+    """
+    Precomputed run_today_optimization(config) result, or None if this
+    configuration / gamma has not been precomputed.
+    """
+    results = load_today_results(config, store_dir, data_version)
+    if results is None:
+        return None
+    return results.get(round(float(config.gamma), 2))
+
+
+def precompute_today(config: PortfolioConfig,
+                     data: dict,
+                     store_dir=TODAY_STORE_DIR,
+                     data_version=None,
+                     gammas=QUESTIONNAIRE_GAMMAS,
+                     overwrite=False):
+    """
+    Solve today's portfolio for all `gammas` of this configuration and store
+    the results (written to a temporary file, then renamed).
+
+    Returns:
+        path of the store entry
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, today_store_key(config, data_version) + ".pkl")
+
+    if os.path.exists(path) and not overwrite:
+        return path
+
+    results = run_today_optimization_path(config, data, gammas)
+
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return path
+
+
+def default_configs(data, today_date=pd.Timestamp("2025-10-01")):
+    """
+    The configurations requested most often: the app's untouched settings
+    for each equity universe (every other asset class selected, no sector /
+    ESG / asset-class constraints), which differ from the PortfolioConfig
+    defaults in selected_asset_classes_other.
+    """
+    asset_classes = (
+        data["metadata"]["Other"]["ASSET_CLASS"]
+        .dropna()
+        .astype(str)
+        .sort_values()
+        .unique()
+        .tolist()
+    )
+    return [
+        PortfolioConfig(
+            today_date=today_date,
+            universe_choice=u,
+            selected_asset_classes_other=asset_classes,
+            sector_constraints=None,
+            esg_constraints=None,
+            asset_class_constraints=None,
+        )
+        for u in ("SP500", "MSCI")
+    ]
+
+
+def start_background_precompute(configs, data, store_dir=TODAY_STORE_DIR, data_version=None):
+    """
+    Precompute `configs` in a daemon thread (skipping stored / running ones).
+
+    Infeasible configurations are skipped silently: they fail the same way
+    when requested live.
+
+    Returns:
+        the started threading.Thread
+    """
+    version = source_fingerprint() if data_version is None else data_version
+
+    def job():
+        for config in configs:
+            key = today_store_key(config, version)
+            with _IN_PROGRESS_LOCK:
+                if key in _IN_PROGRESS:
+                    continue
+                _IN_PROGRESS.add(key)
+            try:
+                precompute_today(config, data, store_dir, version)
+            except ValueError:
+                pass
+            finally:
+                with _IN_PROGRESS_LOCK:
+                    _IN_PROGRESS.discard(key)
+
+    thread = threading.Thread(target=job, name="today-precompute", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute today's portfolio for every gamma.")
+    parser.add_argument("--store", default=TODAY_STORE_DIR, help=f"store folder (default: {TODAY_STORE_DIR})")
+    parser.add_argument("--overwrite", action="store_true", help="recompute stored configurations")
+    args = parser.parse_args(argv)
+
+    data = get_shared_data()
+    for config in default_configs(data):
+        try:
+            path = precompute_today(config, data, args.store, overwrite=args.overwrite)
+            print(f"{config.universe_choice}: {path}")
+        except ValueError as e:
+            print(f"{config.universe_choice}: skipped ({e})")
+
+
+if __name__ == "__main__":
+    main()
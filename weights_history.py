@@ -0,0 +1,179 @@
+# weights_history.py
+"""
+Compact history of the portfolio weights of a backtest.
+
+Every rebalance adds one row of a sparse (rebalance x asset) matrix: only
+held assets are stored, as integer codes into a fixed vocabulary of asset
+IDs, with their weights and per-position values (ESG bucket as int8 codes,
+return / risk contributions). Names, sectors and asset classes are not
+copied per row: they are joined from the metadata table only when the
+history is displayed or exported (to_frame).
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data_plane import ESG_CATEGORIES
+
+FRAME_COLUMNS = ["ID", "Weight", "NAME", "SECTOR", "ASSET_CLASS", "ESG", "Rebalance_Month"]
+
+
+class WeightsHistory:
+    """
+    Weights of every rebalance, stored column-wise in CSR layout.
+
+    asset_ids : vocabulary of all asset IDs that can be held
+    metadata : table indexed by asset ID (NAME / SECTOR / ASSET_CLASS), kept
+               by reference and joined lazily
+    """
+
+    def __init__(self, asset_ids, metadata=None):
+        self.asset_ids = pd.Index(asset_ids)
+        self.metadata = metadata
+
+        self._months = []
+        self._codes = []
+        self._weights = []
+        self._esg = []
+        self._extra = {}  # name -> list of per-rebalance arrays
+        self._packed = None
+
+    # -------------------- Building --------------------
+    def append(self, rebalance_month, weights: pd.Series, esg=None, **columns):
+        """
+        Add the held positions of one rebalance.
+
+        weights : pd.Series indexed by asset ID (every entry is stored)
+        esg : labels aligned with `weights` (L / M / H, NaN if unknown)
+        columns : further per-position arrays aligned with `weights`
+        """
+        codes = self.asset_ids.get_indexer(weights.index)
+        if (codes < 0).any():
+            raise KeyError(f"IDs not in the weights history vocabulary: "
+                           f"{list(weights.index[codes < 0][:20])}")
+
+        n = len(codes)
+        if esg is None:
+            esg_codes = np.full(n, -1, dtype=np.int8)
+        else:
+            esg_codes = pd.Categorical(np.asarray(esg, dtype=object), categories=ESG_CATEGORIES).codes
+
+        if self._months:
+            if set(columns) != set(self._extra):
+                raise ValueError(f"Columns {sorted(columns)} differ from the history's {sorted(self._extra)}.")
+        else:
+            self._extra = {name: [] for name in columns}
+
+        self._months.append(rebalance_month)
+        self._codes.append(codes.astype(np.int32))
+        self._weights.append(weights.to_numpy(dtype=float))
+        self._esg.append(esg_codes.astype(np.int8))
+        for name, values in columns.items():
+            self._extra[name].append(np.asarray(values, dtype=float))
+        self._packed = None
+
+    def set_column(self, name, values):
+        """
+        Set a per-position column for the whole history at once (values in
+        storage order, e.g. computed from column(...) of other columns).
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) != self.nnz:
+            raise ValueError(f"Column {name} has {len(values)} values, the history {self.nnz} positions.")
+        self._pack()
+        self._packed["extra"][name] = values
+        self._extra[name] = np.split(values, self._packed["indptr"][1:-1])
+
+    def _pack(self):
+        if self._packed is None:
+            lengths = [len(c) for c in self._codes]
+
+            def cat(chunks, dtype):
+                return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+            self._packed = {
+                "indptr": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                "codes": cat(self._codes, np.int32),
+                "weights": cat(self._weights, float),
+                "esg": cat(self._esg, np.int8),
+                "extra": {name: cat(chunks, float) for name, chunks in self._extra.items()},
+            }
+        return self._packed
+
+    # -------------------- Access --------------------
+    def __len__(self):
+        return len(self._months)
+
+    @property
+    def empty(self):
+        return not self._months
+
+    @property
+    def nnz(self):
+        return int(self._pack()["indptr"][-1])
+
+    @property
+    def rebalance_months(self) -> pd.PeriodIndex:
+        return pd.PeriodIndex(self._months, freq="M", name="Rebalance_Month")
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        """
+        Weights as a sparse (rebalance x asset) matrix, columns = asset_ids.
+        """
+        p = self._pack()
+        return sparse.csr_matrix((p["weights"], p["codes"], p["indptr"]),
+                                 shape=(len(self._months), len(self.asset_ids)))
+
+    def column(self, name) -> np.ndarray:
+        """
+        Per-position values in storage order (rebalance by rebalance).
+        """
+        p = self._pack()
+        if name == "Weight":
+            return p["weights"]
+        return p["extra"][name]
+
+    def weights_at(self, rebalance_month) -> pd.Series:
+        """
+        Held weights of one rebalance, indexed by asset ID.
+        """
+        i = self._months.index(rebalance_month)
+        return pd.Series(self._weights[i], index=self.asset_ids[self._codes[i]], name=str(rebalance_month))
+
+    # -------------------- Export --------------------
+    def to_frame(self, with_metadata=True) -> pd.DataFrame:
+        """
+        Long table, one row per (rebalance, held asset), with columns
+        ID, Weight, NAME, SECTOR, ASSET_CLASS, ESG, Rebalance_Month and the
+        extra columns (metadata columns only if with_metadata).
+        """
+        p = self._pack()
+        extra = list(p["extra"])
+
+        if self.empty:
+            columns = FRAME_COLUMNS if with_metadata else ["ID", "Weight", "ESG", "Rebalance_Month"]
+            return pd.DataFrame(columns=columns + extra)
+
+        codes = p["codes"]
+        frame = {
+            "ID": np.asarray(self.asset_ids, dtype=object)[codes],
+            "Weight": p["weights"],
+        }
+
+        if with_metadata:
+            # one lookup per distinct asset, then spread with the integer codes
+            meta = self.metadata if self.metadata is not None else pd.DataFrame()
+            meta = meta.reindex(self.asset_ids)
+            for col in ("NAME", "SECTOR", "ASSET_CLASS"):
+                if col in meta.columns:
+                    frame[col] = meta[col].to_numpy()[codes]
+                else:
+                    frame[col] = np.nan
+
+        frame["ESG"] = np.asarray(pd.Categorical.from_codes(p["esg"], categories=ESG_CATEGORIES), dtype=object)
+        frame["Rebalance_Month"] = self.rebalance_months.repeat(np.diff(p["indptr"]))
+        for name in extra:
+            frame[name] = p["extra"][name]
+
+        return pd.DataFrame(frame)